@@ -6,37 +6,123 @@ for the Excel CT  templates.
 """
 
 import math
+import os
+import hashlib
 import openpyxl
 from openpyxl import Workbook
 from openpyxl import load_workbook
 import warnings
+import numpy as np
 import GTC as gtc
 
 class CALCULATOR(object):
     """
     :param source: is the spreadsheet with data
     :param output: is the name of the spreadsheet that results are placed in.
+    :param read_only: when True the source is streamed with openpyxl read-only worksheets, so only the rows that
+        are asked for are read and the full workbook is never built in memory.
+    :param cache_dir: optional directory for a persistent cache of blocks, stored as .npz files keyed on the
+        SHA-256 of the source and the block location, so that later runs need not open the workbook at all.
     """
 
-    def __init__(self, source, output):
+    # codes for the type of each cell in a block held in the persistent cache
+    cell_types = [type(None), float, int, str, bool]
+
+    def __init__(self, source, output, read_only=True, cache_dir=None):
         self.source = source
         self.output = output
+        self.read_only = read_only
+        self.cache_dir = cache_dir
+        self.workbook_cache = {}  # parsed source workbook keyed on (path, modification time)
+        self.block_cache = {}  # blocks already read, keyed on (path, modification time, sheet, block descriptor)
+        self.hash_cache = {}  # SHA-256 of the source keyed on (path, modification time)
+
+    def source_key(self):
+        """
+        :return: (path, modification time) of the source, which identifies one version of its contents
+        """
+        return (os.path.abspath(self.source), os.path.getmtime(self.source))
+
+    def load_source(self):
+        """
+        Parsing a large workbook is slow, so the parsed source is kept and reused by every block read until the
+        file on disk is modified or clear_cache is called. In read-only mode this is an open streaming handle
+        and the rows themselves are read on demand.
+
+        :return: the openpyxl workbook of the source spreadsheet, with values rather than formulae
+        """
+        key = self.source_key()
+        if key not in self.workbook_cache:
+            if self.workbook_cache:
+                self.drop_stale(key)  # an earlier parse is out of date
+            warnings.simplefilter('ignore')#not interested in 'Discarded range with reserved name'
+            self.workbook_cache[key] = load_workbook(self.source, read_only = self.read_only,
+                                                     data_only = True)#reads numbers rather than formulae
+            warnings.simplefilter('default')#turn warnings back on
+        return self.workbook_cache[key]
+
+    def drop_stale(self, key):
+        """
+        Closes and discards parses of earlier versions of the source, with the blocks read from them. Blocks of the
+        current version, e.g. just loaded from the persistent cache, are kept.
+
+        :param key: the source_key of the current version
+        """
+        for wb in self.workbook_cache.values():
+            if wb.read_only:
+                wb.close()  # read-only workbooks keep the file open
+        self.workbook_cache = {}
+        self.block_cache = dict([(k, rows) for k, rows in self.block_cache.items() if k[:2] == key])
+        self.hash_cache = dict([(k, digest) for k, digest in self.hash_cache.items() if k == key])
+
+    def clear_cache(self):
+        """
+        Discards the parsed source workbook and any blocks read from it so that the next read goes back to the file.
+        """
+        for wb in self.workbook_cache.values():
+            if wb.read_only:
+                wb.close()  # read-only workbooks keep the file open
+        self.workbook_cache = {}
+        self.block_cache = {}
+        self.hash_cache = {}
     
     def makeworkbook(self, set, this_title):
         """
-        :param set: a list of lists that are each an excel row
+        Rows are streamed to a write-only workbook as they are produced, so rows may be of different lengths and
+        'set' may be a generator. As before, the first row of the sheet is left empty.
+
+        :param set: an iterable of rows, each row an iterable of cell values
         :param this_title: name of sheet in workbook
         :return: saves the workbook file
         """
 
-        wb = Workbook() #create workbook in memory
-        ws0 = wb.active #default active worksheet in position '0'
-        ws0.title = this_title
-        no_rows = len(set)
-        no_columns = len(set[0])
-        for i in range(no_rows):
-            for j in range(no_columns):
-                ws0.cell(row = i+2, column = j+1, value =set[i][j])
+        self.write_sheets([(this_title, set)])
+
+    def report_session(self):
+        """
+        For collecting many named sheets and saving them to the output workbook once, e.g.
+
+            with labdata.report_session() as report:
+                report.add_sheet('results', rows)
+
+        :return: a ReportSession that writes to self.output when the with block closes
+        """
+        return ReportSession(self)
+
+    def write_sheets(self, sheets):
+        """
+        Writes several sheets to the output workbook with a single save. Each sheet is laid out as by makeworkbook.
+
+        :param sheets: list of (sheet title, rows) pairs, with rows in the form taken by makeworkbook
+        :return: saves the workbook file
+        """
+
+        wb = Workbook(write_only = True)  # rows are written out as they are appended
+        for this_title, rows in sheets:
+            ws = wb.create_sheet(title = this_title)
+            ws.append([])  # data starts on the second row
+            for row in rows:
+                ws.append(list(row))  # openpyxl only takes lists, tuples, ranges and dicts as rows
         wb.save(filename = self.output)
     
     def getdata_block(self, datasheet,block_range):
@@ -46,33 +132,209 @@ class CALCULATOR(object):
         :return: a list of lists, each list being the contents of a row
         """
 
-        warnings.simplefilter('ignore')#not interested in 'Discarded range with reserved name'
-        wb2 = load_workbook(self.source, data_only = True)#reads numbers rather than formulae
-        warnings.simplefilter('default')#turn warnings back on
-        sheet = wb2[datasheet]
-        selected_rows = []
-        for i in range(block_range[0],block_range[1]):
-            this_row = []
-            for j in range(block_range[2], block_range[3]):
-                this_row.append(sheet.cell(row = i, column = j).value)
-            selected_rows.append(this_row)
-        return selected_rows
+        return self.getdata_blocks(datasheet, [block_range])[0]
+
+    def getdata_blocks(self, datasheet, block_ranges):
+        """
+        Reads several blocks from one worksheet with a single pass over the rows that they span. Blocks that have
+        already been read from the current version of the source are not read again.
+
+        :param datasheet: name of the calc worksheet
+        :param block_ranges: list of 4 element lists [start row, finish row, start column, finish column]
+        :return: list with a block in the format of getdata_block for each block range
+        """
+        key = self.source_key()
+        wanted = []  # block ranges that are not yet in the block cache
+        for block_range in block_ranges:
+            block_key = key + (datasheet, tuple(block_range))
+            if block_key not in self.block_cache and block_range not in wanted:
+                rows = self.load_cached_block(datasheet, block_range)
+                if rows is None:
+                    wanted.append(block_range)
+                else:
+                    self.block_cache[block_key] = rows
+
+        if wanted:
+            sheet = self.load_source()[datasheet]
+            selected = [[] for block_range in wanted]
+            first_row = min([b[0] for b in wanted])
+            last_row = max([b[1] for b in wanted]) - 1
+            first_column = min([b[2] for b in wanted])
+            last_column = max([b[3] for b in wanted]) - 1
+            i = first_row
+            for row in sheet.iter_rows(min_row = first_row, max_row = last_row, min_col = first_column,
+                                       max_col = last_column, values_only = True):
+                for block_range, rows in zip(wanted, selected):
+                    if block_range[0] <= i < block_range[1]:
+                        rows.append(list(row[block_range[2] - first_column:block_range[3] - first_column]))
+                i = i + 1
+            for block_range, rows in zip(wanted, selected):
+                width = max(block_range[3] - block_range[2], 0)
+                while len(rows) < block_range[1] - block_range[0]:
+                    rows.append([None] * width)  # streaming stops at the last used row of the sheet
+                self.block_cache[key + (datasheet, tuple(block_range))] = rows
+                self.save_cached_block(datasheet, block_range, rows)
+
+        # copies, so that callers are free to modify what they are given
+        return [[list(row) for row in self.block_cache[key + (datasheet, tuple(b))]] for b in block_ranges]
+
+    def source_hash(self):
+        """
+        :return: hex SHA-256 digest of the source file, only recalculated when the file is modified
+        """
+        key = self.source_key()
+        if key not in self.hash_cache:
+            digest = hashlib.sha256()
+            with open(self.source, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+            self.hash_cache = {key: digest.hexdigest()}
+        return self.hash_cache[key]
+
+    def cached_block_path(self, datasheet, block_range):
+        """
+        :param datasheet: name of the calc worksheet
+        :param block_range: a 4 element list [start row, finish row, start column, finish column]
+        :return: file name in cache_dir for this block of this version of the source
+        """
+        descriptor = self.source_hash() + '|' + datasheet + '|' + repr([int(b) for b in block_range])
+        return os.path.join(self.cache_dir, hashlib.sha256(descriptor.encode('utf-8')).hexdigest() + '.npz')
+
+    def load_cached_block(self, datasheet, block_range):
+        """
+        :param datasheet: name of the calc worksheet
+        :param block_range: a 4 element list [start row, finish row, start column, finish column]
+        :return: the block in the format of getdata_block, or None if it is not in the persistent cache
+        """
+        if self.cache_dir is None:
+            return None
+        path = self.cached_block_path(datasheet, block_range)
+        if not os.path.exists(path):
+            return None
+        with np.load(path, allow_pickle = False) as stored:
+            kinds, numbers, text = stored['kinds'], stored['numbers'], stored['text']
+        rows = []
+        for i in range(kinds.shape[0]):
+            row = []
+            for j in range(kinds.shape[1]):
+                kind = self.cell_types[kinds[i, j]]
+                if kind is type(None):
+                    row.append(None)
+                elif kind is str:
+                    row.append(str(text[i, j]))
+                else:
+                    row.append(kind(numbers[i, j]))
+            rows.append(row)
+        return rows
+
+    def save_cached_block(self, datasheet, block_range, rows):
+        """
+        Stores a block in the persistent cache. Blocks holding cells other than numbers, text or blanks (dates
+        for example) are not cached and are read from the workbook each time.
+
+        :param datasheet: name of the calc worksheet
+        :param block_range: a 4 element list [start row, finish row, start column, finish column]
+        :param rows: the block in the format of getdata_block
+        """
+        if self.cache_dir is None:
+            return
+        width = max(block_range[3] - block_range[2], 0)
+        kinds = np.zeros((len(rows), width), dtype=np.int8)
+        numbers = np.zeros((len(rows), width))
+        text = np.full((len(rows), width), u'', dtype=object)
+        for i, row in enumerate(rows):
+            for j, value in enumerate(row):
+                if type(value) not in self.cell_types:
+                    return
+                kinds[i, j] = self.cell_types.index(type(value))
+                if isinstance(value, str):
+                    text[i, j] = value
+                elif value is not None:
+                    numbers[i, j] = value
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        path = self.cached_block_path(datasheet, block_range)
+        with open(path + '.tmp', 'wb') as f:  # write then rename, so an interrupted run leaves no partial file
+            np.savez(f, kinds=kinds, numbers=numbers, text=text.astype(str))
+        os.replace(path + '.tmp', path)
+
+    def prefetch(self, datasheet, block_ranges):
+        """
+        Reads all the listed blocks of a worksheet in one pass so that later getdata_block calls for any of them
+        are served from memory.
+
+        :param datasheet: name of the calc worksheet
+        :param block_ranges: list of 4 element lists [start row, finish row, start column, finish column]
+        """
+        self.getdata_blocks(datasheet, block_ranges)
+
+    def block_array(self, block):
+        """
+        Converts a block read with getdata_block to a float array. Blank or text cells become NaN, so that
+        numpy.isnan() of the array is the mask of cells that did not hold a number.
+
+        :param block: in format of self.getdata_block
+        :return: numpy float64 array with one row per spreadsheet row
+        """
+        width = max([len(row) for row in block] + [0])
+        table = np.full((len(block), width), np.nan)
+        for i, row in enumerate(block):
+            for j, value in enumerate(row):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    table[i, j] = value
+        return table
+
+    def read_sheet_array(self, datasheet, block_range):
+        """
+        Reads a block in a single pass over the worksheet rows and returns it as a dense float array rather than
+        nested lists, so that columns can be taken by slicing.
+
+        :param datasheet: name of the calc worksheet
+        :param block_range: a 4 element list [start row, finish row, start column, finish column]
+        :return: numpy float64 array, NaN where a cell is blank or holds text
+        """
+        table = self.block_array(self.getdata_block(datasheet, block_range))
+        return table.reshape(max(block_range[1] - block_range[0], 0), max(block_range[3] - block_range[2], 0))
         
     def extract_column(self, block, column_number, start_finish):
         """
         For extracting specific table columns after having read an entire sheet with get_datablock
 
-        :param block: in format of self.getdata_block
+        :param block: in format of self.getdata_block, or an array from self.read_sheet_array
         :param column_number: Row and column numbers follow R1C1=='A1'
         :param start_finish: list [start row number, finish row number]
-        :return: colunmn as a list
+        :return: colunmn as a list, or as an array slice if block is an array
         """
 
+        if isinstance(block, np.ndarray):
+            return block[start_finish[0]-1:start_finish[1], column_number-1]
         for_output = []
         for i in range(start_finish[0]-1, start_finish[1]): #the -1 includes the first row
             for_output.append(block[i][column_number-1])#-1 needed as first column is 0
         return for_output
 
+    def with_columns(self, block, placed):
+        """
+        Adds columns to the rows of a block, for writing values such as corrected results beside the data they come
+        from. The rows are generated one at a time so they can be streamed to makeworkbook.
+
+        :param block: in format of self.getdata_block
+        :param placed: list of (start_finish, columns) pairs, where start_finish is [start row number, finish row
+            number] as for extract_column and columns is a list of columns of values for those rows
+        :return: generator of rows, each the row of the block followed by the added columns, None where a row has no
+            added value
+        """
+
+        width = max([len(columns) for start_finish, columns in placed] + [0])
+        extra = {}
+        for start_finish, columns in placed:
+            for column in columns:
+                assert len(column) == start_finish[1] - start_finish[0] + 1, "column does not fit its rows"
+            for i in range(start_finish[0]-1, start_finish[1]): #the -1 includes the first row
+                extra[i] = [column[i-start_finish[0]+1] for column in columns] + [None]*(width - len(columns))
+        for i, row in enumerate(block):
+            yield list(row) + extra.get(i, [None]*width)
+
     def blockcolumns(self, block):
         """
         converts from imported excel data being lists of rows to being lists of columns
@@ -120,37 +382,114 @@ class CALCULATOR(object):
 
         return table
 
-    def budget_table(self, uncertains, fract):
+    def budget_rows(self, uncertain, fract):
+        """
+        The uncertainty budget of one uncertain number as spreadsheet rows.
+
+        :param uncertain: an uncertain number
+        :param fract: set to 0 for full budget, but typically 0.1 as fraction of total for inclusion in budget
+        :return: a list of row contents, with each row itself a list
         """
-        For creating a spreadsheet friendly block that presents the uncertainty budget for a list of uncertain numbers
+        rows = []
+        rows.append(['Name', uncertain.label])
+        rows.append(['Value', repr(uncertain)])
+        rows.append(['Name', 'Uncertainty contribution'])
+        for influence in gtc.rp.budget(uncertain, trim = fract):
+            rows.append([influence[0], influence[1]])  # label and component of uncertainty
+        rows.append(['', ''])
+        return rows
+
+    def budget_table(self, uncertains, fract, per_sheet = False, session = None):
+        """
+        For creating a spreadsheet friendly block that presents the uncertainty budget for a list of uncertain numbers.
+        All the budgets are calculated first and the output workbook is then written once.
 
         :param uncertains: a list of uncertain numbers
         :param fract: set to 0 for full budget, but typically 0.1 as fraction of total for inclusion in budget
+        :param per_sheet: when True each budget is written to its own sheet, named from the uncertain number label,
+            otherwise all budgets follow one another on a sheet called 'uncertainties'
+        :param session: optional ReportSession; the sheets are added to it rather than written to self.output
         :return: a list of row contents, with each row itself a list, suitable for the makeworkbook method
         """
+        budgets = [self.budget_rows(x, fract) for x in uncertains]
         output_block = []
-        for i in range(len(uncertains)):
-            header_row = []
-            header_row.append('Name')
-            header_row.append(uncertains[i].label)
-            output_block.append(header_row)
-            next_row = []
-            next_row.append('Value')
-            next_row.append(repr(uncertains[i]))
-            output_block.append(next_row)
-            next_row = []
-            next_row.append('Name')
-            next_row.append('Uncertainty contribution')
-            output_block.append(next_row)
-            for l, u in gtc.rp.budget(uncertains[i], trim = fract ):
-                next_row = []
-                next_row.append(l)
-                next_row.append(u)
-                output_block.append(next_row)
-            output_block.append(['',''])
-            self.makeworkbook(output_block, 'uncertainties')
+        for rows in budgets:
+            output_block.extend(rows)
+
+        if per_sheet:
+            sheets = []
+            for i in range(len(uncertains)):
+                sheets.append((uncertains[i].label or 'u' + repr(i), budgets[i]))
+        else:
+            sheets = [('uncertainties', output_block)]
+        if session is None:
+            titles = []
+            for title, rows in sheets:
+                titles.append(self.sheet_title(title, 'Sheet', titles))
+            self.write_sheets(list(zip(titles, [rows for title, rows in sheets])))
+        else:
+            for title, rows in sheets:
+                session.add_sheet(title, rows)
         return output_block
 
+    def sheet_title(self, label, default, used):
+        """
+        Excel sheet names are at most 31 characters and may not contain []:*?/\\ characters.
+
+        :param label: wanted name, possibly None
+        :param default: name to use if label is None or empty
+        :param used: list of names already taken in the workbook
+        :return: a valid sheet name that is not in used
+        """
+        title = default if not label else str(label)
+        for c in '[]:*?/\\':
+            title = title.replace(c, '_')
+        title = title[:31]
+        n = 1
+        while title in used:
+            suffix = '_' + repr(n)
+            title = title[:31 - len(suffix)] + suffix
+            n = n + 1
+        return title
+
+
+class ReportSession(object):
+    """
+    Collects named sheets for the output workbook of a CALCULATOR and writes them all with a single save when the
+    session is closed, normally at the end of a with block. Nothing is written if the block ends with an exception,
+    so a failed run does not leave a partial report behind.
+
+    :param calculator: the CALCULATOR whose output file receives the sheets
+    """
+
+    def __init__(self, calculator):
+        self.calculator = calculator
+        self.sheets = []  # (sheet title, rows) in the order they were added
+
+    def add_sheet(self, title, rows):
+        """
+        :param title: wanted sheet name, adjusted if needed to be a valid and unused Excel sheet name
+        :param rows: an iterable of rows, each row an iterable of cell values, as for makeworkbook
+        :return: the sheet name used
+        """
+        title = self.calculator.sheet_title(title, 'Sheet', [t for t, r in self.sheets])
+        self.sheets.append((title, rows))
+        return title
+
+    def save(self):
+        """
+        Writes every collected sheet to the output workbook.
+        """
+        self.calculator.write_sheets(self.sheets)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.save()
+        return False
+
 
 if __name__ == "__main__":
     ianz = CALCULATOR("S21982 1 turn V5.0_draft_KJ.xlsm", "myResults.xlsx")
@@ -9,27 +9,30 @@ import modelCT  # just for burden VA calculations
 import arnold  # uncertainty terms for dials
 import GTC as gtc
 import math
+import numpy as np
 
 class BURDEN(object):
     """
     Simple measurement method based on perturbing the burden by connecting an impedance in parallel.
     Changes in the secondary current error of the CT are then used to calculate the burden.
     """
-    def __init__(self, excelfile, datasheet, start_stop, resistors):
+    def __init__(self, excelfile, datasheet, start_stop, resistors, cache_dir=None):
         """
 
         :param excelfile: contains the worksheet 'datasheet' that contains all the essential data
         :param datasheet: the sheet name
         :param start_stop: [start row, stop row, start column, stop colunm]
         :param resistors: dictionary of values of the perturbing resistors
+        :param cache_dir: optional directory for the persistent cache of blocks read from excelfile
         """
         self.excelfile = excelfile
         self.datasheet = datasheet
-        self.data_store = ExcelPython.CALCULATOR(self.excelfile, "myBurdenResults.xlsx")
+        self.data_store = ExcelPython.CALCULATOR(self.excelfile, "myBurdenResults.xlsx", cache_dir=cache_dir)
         self.perturbr = resistors  # as a dictionary
         self.arnie = arnold.ARNOLD('source', 'output)')  # dummy source and output as not needed
         self.start_stop = start_stop  # [start row, stop row, start col, stop col]
         self.datalist = self.data_store.getdata_block(self.datasheet, start_stop)
+        self.dataarray = np.array(self.datalist, dtype=object)  # same content, but can be sliced by getblock
         self.maxfreq = 1.5e-2# 1.5% max allowed deviation
 
     def burdenZ(self, e1, e2, referenceR):
@@ -55,13 +58,8 @@ class BURDEN(object):
         :param rowcol: list of [start row, stop row, startcol, stopcol]
         :return: a list of rows as lists
         """
-        outputblock = []
-        for i in range(rowcol[0], rowcol[1]):
-            this_row = []
-            for j in range(rowcol[2], rowcol[3]):
-                this_row.append(self.datalist[i-1][j-1])  # the '-1' is an artefact of the indicies being excel r1, c1
-            outputblock.append(this_row)
-        return outputblock
+        # the '-1' is an artefact of the indicies being excel r1, c1
+        return self.dataarray[rowcol[0] - 1:rowcol[1] - 1, rowcol[2] - 1:rowcol[3] - 1].tolist()
 
     def get_test_result(self, a):
         """
@@ -123,7 +121,8 @@ if __name__ == "__main__":
     ohm1000 = gtc.ureal(1000, 0.01, 12, label = '1000 ohm') #not measured on UB
     check_r = {'10': ohm10, '50': 50.0, '100': 100.0, '1000': 1000.0}  # dictionary of values of perturbing resistors
     # analyse data from Excel sheet
-    myburden = BURDEN('S22008_py_Burden_5AmpRatio Template V5.0_draft.xlsm', 'ForPython', [1, 128, 1, 17], check_r)
+    myburden = BURDEN('S22008_py_Burden_5AmpRatio Template V5.0_draft.xlsm', 'ForPython', [1, 128, 1, 17], check_r,
+                      cache_dir='ExcelCache')
     mydata = myburden.datalist
     print('starting run')
     test_sets = [4, 6, 11, 13, 18, 25, 27, 32, 34, 39, 41, 46, 48, 53, 55, 60, 62, 67, 69,74, 76, 81, 83, 88,
@@ -173,7 +172,7 @@ if __name__ == "__main__":
 
 
     output_block = []
-    header_row = ['Label', 'Resistance', 'uR', 'df', 'jR', 'ujR', 'df', '', '', '', '', '', '', '', '', '', '']
+    header_row = ['Label', 'Resistance', 'uR', 'df', 'jR', 'ujR', 'df']
     output_block.append(header_row)
     assert len(test_results)==len(labels), "labels don't match results"
     for i in range(len(test_results)):
@@ -185,20 +184,8 @@ if __name__ == "__main__":
         myrow.append(float(test_results[i].imag.x))
         myrow.append(float(test_results[i].imag.u))
         myrow.append(float(test_results[i].imag.df))
-        #need blanks to match maximum column width
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
-        myrow.append('')
         output_block.append(myrow)
-    header_row = ['Average and zero correct the results above', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '']
+    header_row = ['Average and zero correct the results above']
     output_block.append(header_row)
     header_row = ['Label', 'Resistance', 'uR', 'df', 'k', 'jR', 'ujR', 'df', 'k', 'VA', 'uVA', 'df', 'k', 'PF', 'uPF', 'df', 'k']
     output_block.append(header_row)
@@ -9,7 +9,8 @@ class BUILDUP(object):
     """
     uses selected data from Excel spreadhseets to calibrate Ta, Tb and Tc.
     """
-    def __init__(self, spreadin1, spreadout1, spreadin2, spreadout2, excitation_levels, sec100):
+    def __init__(self, spreadin1, spreadout1, spreadin2, spreadout2, excitation_levels, sec100, cache_dir=None,
+                 excitation_tolerance=None):
         """
 
         :param spreadin1: input spreadsheet list for Ta and Tb [file name, error measure sheet, coupling sheet]
@@ -18,17 +19,21 @@ class BUILDUP(object):
         :param spreadout2: output spreadsheet for Tc
         :param excitation_levels: list of % excitation levels that must be common throughout
         :param sec100: the secondary current at 100% excitation
+        :param cache_dir: optional directory for the persistent cache of blocks read from the input spreadsheets
+        :param excitation_tolerance: optional largest allowed distance, in %, of a measured excitation from the
+         nominal level it is matched to
         """
-        self.labdata = CALCULATOR(spreadin1[0], spreadout1)
+        self.labdata = CALCULATOR(spreadin1[0], spreadout1, cache_dir=cache_dir)
         self.calpage = spreadin1[1]
         self.datapage = spreadin1[2]
         self.calrun = TWOSTAGE()
-        self.labdata_c = CALCULATOR(spreadin2[0], spreadout2)
+        self.labdata_c = CALCULATOR(spreadin2[0], spreadout2, cache_dir=cache_dir)
         self.calpage_c = spreadin2[1]
         self.target_excitation = excitation_levels
         self.full_scale = sec100
+        self.excitation_tolerance = excitation_tolerance
 
-    def step(self, sign_block, error_block, bool):
+    def step(self, sign_block, error_block, bool, uncertain=True, table=False, step=None):
         """
         The location of data blocks in the spreadsheet can vary depending on various investigations that might
         result during a calibration run. Once the data for a particular step is identified, this method does
@@ -37,26 +42,48 @@ class BUILDUP(object):
         :param sign_block: location of sign check data [row start, 1+row finish, column start column finish]
         :param error_block: list of blocks with measurement data (typically 53 Hz and 47 Hz data)
         :param bool: boolean for correct columns
+        :param uncertain: when False the errors and excitations of each block are numpy arrays of values only, so
+         that blocks of equal length stack into (frequency, excitation) arrays for TWOSTAGE.buildup_array
+        :param table: when True the errors of each block are an ErrorTable, for TWOSTAGE.buildup_table; errortable.stack
+         joins those of blocks of equal length so that buildup_table calculates every frequency at once
+        :param step: optional name of the step; block k is the step step_fk for the 'per-step' Type B policy
         :return: a list of lists of calculated errors, a matching list of lists of actual excitations, a single list
         of nominal excitation.
         """
-        # sign check
-        block_descriptor = sign_block
-        sign_data1 = self.labdata.getdata_block(self.calpage, block_descriptor, )
+        # sign check and error blocks are read together in one pass over the sheet
+        blocks = self.labdata.getdata_blocks(self.calpage, [sign_block] + list(error_block))
+        sign_data1 = blocks[0]
         sign = self.calrun.signcheck(sign_data1, self.full_scale, True)
         e = []  # will be a list of the lists of errors
         exc = []
 
-        for i in range(len(error_block)):
-            block_descriptor = error_block[i]
-            copy_data1 = self.labdata.getdata_block(self.calpage, block_descriptor)
-            initial_e, excite, nom_excite = self.calrun.ctcompare(copy_data1, self.full_scale, self.target_excitation, bool)
-            e_freq = []  # this is the errors at the test frequency modified to have the correct sign
-            for x in initial_e:
-                e_freq.append(x * sign)
+        # the blocks for all frequencies go through ctcompare together and are then split up again
+        copy_data1 = [row for block in blocks[1:] for row in block]
+        step = self.calrun.step_name(step)
+        steps = [step + '_f%d' % k for k, block in enumerate(blocks[1:]) for row in block]  # each frequency a step
+        if table:
+            initial_e, excite, nom_excite = self.calrun.ctcompare_table(copy_data1, self.full_scale,
+                                                                        self.target_excitation, bool,
+                                                                        self.excitation_tolerance, steps)
+        else:
+            initial_e, excite, nom_excite = self.calrun.ctcompare(copy_data1, self.full_scale, self.target_excitation,
+                                                                  bool, uncertain, self.excitation_tolerance, steps)
+        first = 0
+        for block in blocks[1:]:
+            last = first + len(block)
+            if table:
+                e_freq = initial_e.subset(slice(first, last)) * sign
+            elif uncertain:
+                e_freq = []  # this is the errors at the test frequency modified to have the correct sign
+                for x in initial_e[first:last]:
+                    e_freq.append(x * sign)
+            else:
+                e_freq = initial_e[first:last] * sign
             e.append(e_freq)
-            exc.append(excite)
-        return e, exc, nom_excite
+            exc.append(excite[first:last])
+            nom_excite_freq = nom_excite[first:last]
+            first = last
+        return e, exc, nom_excite_freq  # nominal excitation of the last block
 
     def magnetic(self, block_share, block_couple, ratio, Rs, rls, Is, bool):
         """
@@ -70,10 +97,9 @@ class BUILDUP(object):
         :param bool: boolean when set to True the vdrops are measured across each individual winding
         :return: ucomplex value of series - parallel error
         """
-        copy_dataA = self.labdata.getdata_block(self.datapage, block_couple)
-        # get volt drops of primary
+        # coupling measurements and volt drops of primary in one pass over the sheet
+        copy_dataA, copy_dataB = self.labdata.getdata_blocks(self.datapage, [block_couple, block_share])
         Vs = Is * Rs  # nominal voltage across burden at 5 A
-        copy_dataB = self.labdata.getdata_block(self.datapage, block_share)
         magnetic1a = self.calrun.magnetic_coupling(copy_dataB, copy_dataA, ratio, Rs, rls, 1, bool)
         return magnetic1a
 
@@ -98,16 +124,20 @@ class BUILDUP(object):
 
         return ablock
 
-    def report_ab(self, nom_excite1, errors, err_mag, err_cap, err_t):
+    def report_ab(self, nom_excite1, errors, err_mag, err_cap, err_t, session=None):
         """
         Gathers all errors for Ta and Tb for presentation in a spreadsheet for creating a final calibration report.
+        Without a session everything goes on one sheet of spreadout1. With a session from
+        CALCULATOR.report_session the measured errors, corrections and results are added to it as separate sheets
+        and are saved when the session closes.
 
         :param nom_excite1: list of the nominal % excitation levels
         :param errors: a list of the measured errors [e1, e2, e3, e4, e5a, e5b] in the buildup
         :param err_mag: a list of the magnetic series-parallel errors [magnetic1a,magnetic1b,magnetic2a,magnetic3a,magnetic2b]
         :param err_cap: a list of the capacitive series-parallel errors [cap_errora, cap_errorb]
         :param err_t: a list of the calculated errors [t1, t2, t3, t4a, t4b, t5, t6, t7]
-        :return: report blocks for Ta and Tb are placed in spreadout2
+        :param session: optional ReportSession that collects the sheets
+        :return: report blocks for Ta and Tb are placed in spreadout1
         """
 
         target_excitation = nom_excite1
@@ -142,7 +172,9 @@ class BUILDUP(object):
             output.append(e5b[i].x.imag)
             # output.append('')  # to match width
             theblock.append(output)
+        errorblock = theblock  # measured errors
 
+        theblock = []
         theblock.append(['', '1a', '1b', '2a', '3a', '2b', ''])
         theblock.append(
             ['real', repr(magnetic1a.x.real), repr(magnetic1b.x.real), repr(magnetic2a.x.real), repr(magnetic3a.x.real),
@@ -153,7 +185,9 @@ class BUILDUP(object):
         theblock.append(['', 'real', 'imag', '', '', '', ''])
         theblock.append(['capa s - p', repr(cap_errora.real), repr(cap_errora.imag), '', '', '', ''])
         theblock.append(['capb s - p', repr(cap_errorb.real), repr(cap_errorb.imag), '', '', '', ''])
+        correctionblock = theblock  # magnetic and capacitive corrections
 
+        theblock = []
         tableheader = ['Excitation', 'Real', 'Imag', 'U real', 'U imag', 'k real', 'k imag']
         self.build_block(nom_excite1,theblock, tableheader, 'P1as',t1)
         self.build_block(nom_excite1, theblock, tableheader, 'P1ap', t2)
@@ -170,17 +204,24 @@ class BUILDUP(object):
         self.build_block(nom_excite1, theblock, tableheader, 'P1asp', t11)
         self.build_block(nom_excite1, theblock, tableheader, 'P2bp', t12)
 
-        self.labdata.makeworkbook(theblock, 'my_sheet_name')
+        if session is None:
+            self.labdata.makeworkbook(errorblock + correctionblock + theblock, 'my_sheet_name')
+        else:
+            session.add_sheet('Ta Tb errors', errorblock)
+            session.add_sheet('Ta Tb corrections', correctionblock)
+            session.add_sheet('Ta Tb results', theblock)
 
-    def report_ac(self, nom_excite1, errors, err_mag, err_cap, err_t):
+    def report_ac(self, nom_excite1, errors, err_mag, err_cap, err_t, session=None):
         """
         Gathers all errors for Tc for presentation in a spreadsheet for creating a final calibration report.
+        As for report_ab, a session collects the errors, corrections and results as separate sheets instead.
 
         :param nom_excite1: list of the nominal % excitation levels
         :param errors: list of measured errors [e1_53, e6_53]
         :param err_mag: list of magnetic series-parallel errors [magnetic1a,magnetic1b,magnetic2a,magnetic3a,magnetic2b]
         :param err_cap: list of capacitive series-parallel [cap_error2a, cap_errorb]
         :param err_t: list of calculated errors [t1, t2, t3]
+        :param session: optional ReportSession that collects the sheets
         :return: a Tc report is placed in output spreadsheet spreadout2
         """
         target_excitation = nom_excite1
@@ -214,7 +255,9 @@ class BUILDUP(object):
             output.append('')
             # output.append('')  # to match width
             theblock.append(output)
+        errorblock = theblock  # measured errors
 
+        theblock = []
         theblock.append(['', '1a', '1b', '2a', '3a', '2b', ''])
         theblock.append(
             ['real', repr(magnetic1a.x.real), repr(magnetic1b.x.real), repr(magnetic2a.x.real), repr(magnetic3a.x.real),
@@ -225,13 +268,20 @@ class BUILDUP(object):
         theblock.append(['', 'real', 'imag', '', '', '', ''])
         theblock.append(['cap2a s - p', repr(cap_error2a.real), repr(cap_error2a.imag), '', '', '', ''])
         theblock.append(['capb s - p', repr(cap_errorb.real), repr(cap_errorb.imag), '', '', '', ''])
+        correctionblock = theblock  # magnetic and capacitive corrections
 
+        theblock = []
         tableheader = ['Excitation', 'Real', 'Imag', 'U real', 'U imag', 'k real', 'k imag']
         self.build_block(nom_excite1, theblock, tableheader, 'Tc', t1)
         self.build_block(nom_excite1, theblock, tableheader, 'P2as_fifth', t2)
         self.build_block(nom_excite1, theblock, tableheader, 'P2ap full', t3)
 
-        self.labdata_c.makeworkbook(theblock, 'my_sheet_name')
+        if session is None:
+            self.labdata_c.makeworkbook(errorblock + correctionblock + theblock, 'my_sheet_name')
+        else:
+            session.add_sheet('Tc errors', errorblock)
+            session.add_sheet('Tc corrections', correctionblock)
+            session.add_sheet('Tc results', theblock)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,434 @@
+from __future__ import division
+"""
+Array-backed error tables for the scale buildup. A table holds the values of a ratio error at each excitation
+point in a complex numpy array and the first-order sensitivities of those values to each elementary influence
+in a sparse (points x influences) matrix, so that the sums in the buildup are array operations rather than GTC
+arithmetic on one uncertain number at a time. As the buildup is linear in its inputs, the standard uncertainty
+and Welch-Satterthwaite degrees of freedom follow directly from the sensitivities and are the same as GTC gives.
+GTC uncertain numbers are only made when a table is reported.
+"""
+import numpy as np
+from scipy import sparse
+import GTC as gtc
+
+
+def merge_columns(n, keys, sensitivity):
+    """
+    Gives a sensitivity matrix with one column for each influence, in order of first use, adding the
+    sensitivities of columns with the same key.
+
+    :param n: number of points
+    :param keys: array of influence keys, one for each column of sensitivity
+    :param sensitivity: sparse or dense (n x len(keys)) array
+    :return: array of unique keys and the csr sensitivity matrix
+    """
+    keys = np.asarray(keys, dtype=int).reshape(-1)
+    if len(keys) == 0:
+        return keys, sparse.csr_matrix((n, 0), dtype=complex)
+    position = np.arange(len(keys))
+    first = np.full(keys.max() + 1, len(keys))
+    np.minimum.at(first, keys, position)  # position of the first use of each key
+    first = first[keys]
+    is_first = first == position
+    column = (np.cumsum(is_first) - 1)[first]  # column of each key in the merged matrix
+    coo = sparse.coo_matrix(sensitivity)
+    if is_first.all():
+        merged = coo.tocsr()
+    else:
+        merged = sparse.csr_matrix((coo.data, (coo.row, column[coo.col])), shape=(n, int(is_first.sum())))
+    merged = merged.astype(complex)
+    merged.sum_duplicates()
+    return keys[is_first], merged
+
+
+def stack(tables):
+    """
+    Joins tables end to end, e.g. the errors of a ratio at each frequency, so that the buildup of every frequency
+    is one set of array operations. The points run through those of each table in turn, and an influence shared
+    by several tables, e.g. a 'shared' Type B term, stays a single influence.
+
+    :param tables: list of ErrorTable on the same Influences
+    :return: an ErrorTable, with a common term for each point unless the tables have the same common term
+    """
+    influences = tables[0].influences
+    assert all([t.influences is influences for t in tables]), 'error tables must share their Influences to be stacked'
+    common = tables[0].common
+    if not all([t.common is common for t in tables]):
+        common = np.concatenate([np.asarray(t.common, dtype=object) if isinstance(t.common, np.ndarray)
+                                 else np.full(len(t), t.common, dtype=object) for t in tables])
+    return ErrorTable(influences, np.concatenate([t.values for t in tables]),
+                      np.concatenate([t.keys for t in tables]),
+                      sparse.block_diag([t.sensitivity for t in tables], format='csr'), common)
+
+
+class Influences(object):
+    """
+    The elementary influences that error tables may depend on. Each is a real quantity with a value, standard
+    uncertainty, degrees of freedom and label, identified by an integer key. The GTC uncertain numbers for an
+    influence are made once, the first time a table using it is converted, so that every table converted from
+    the same Influences shares them and correlations between tables are kept.
+
+    A label may also be a (text, key) pair, for a label that is text followed by the repr of the ureal of another
+    influence; it is only formatted when the GTC uncertain number is made.
+    """
+
+    def __init__(self):
+        self.n = 0  # number of influences
+        self.data = np.zeros((3, 1024))  # value, standard uncertainty and degrees of freedom, grown as needed
+        self.label = []
+        self.pair = []  # key of the other part of a complex influence, or None
+        self.elementary = {}  # GTC uncertain real of each influence already made, keyed on key
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def x(self):
+        """value of each influence, indexed by key"""
+        return self.data[0, :self.n]
+
+    @property
+    def u(self):
+        """standard uncertainty of each influence"""
+        return self.data[1, :self.n]
+
+    @property
+    def df(self):
+        """degrees of freedom of each influence"""
+        return self.data[2, :self.n]
+
+    def add(self, x, u, df, label):
+        """
+        :param x: value of the influence
+        :param u: standard uncertainty
+        :param df: degrees of freedom
+        :param label: label for the GTC ureal, and so for uncertainty budgets
+        :return: key of the new influence
+        """
+        return int(self.extend(x, u, df, [label])[0])
+
+    def extend(self, x, u, df, labels):
+        """
+        Adds an influence for each of a list of labels, e.g. one at each point of a table.
+
+        :param x: value, or array of values
+        :param u: standard uncertainty, or array
+        :param df: degrees of freedom, or array
+        :param labels: list of labels
+        :return: array of the keys of the new influences
+        """
+        n = len(labels)
+        first = self.n
+        if first + n > self.data.shape[1]:
+            data = np.zeros((3, max(2 * self.data.shape[1], first + n)))
+            data[:, :first] = self.data[:, :first]
+            self.data = data
+        self.data[:, first:first + n] = np.broadcast_arrays(x, u, df, np.zeros(n))[:3]
+        self.n = first + n
+        self.label.extend(labels)
+        self.pair.extend([None] * n)
+        return np.arange(first, first + n)
+
+    def extend_complex(self, x, u, df, labels):
+        """
+        As add_complex, for each of a list of labels.
+
+        :return: (n x 2) array of the keys of the real and imaginary parts
+        """
+        keys = self.extend(np.repeat([[complex(x).real, complex(x).imag]], len(labels), axis=0).ravel(),
+                           np.tile(u, len(labels)), df, [label for label in labels for part in range(2)])
+        keys = keys.reshape(-1, 2)
+        for key_re, key_im in keys.tolist():
+            self.pair[key_re] = key_im
+            self.pair[key_im] = key_re
+        return keys
+
+    def label_of(self, key):
+        """
+        :param key: key of an influence
+        :return: its label as text
+        """
+        label = self.label[key]
+        if isinstance(label, tuple):
+            return label[0] + self.ureal_repr(label[1])
+        return label
+
+    def add_complex(self, x, u, df, label):
+        """
+        A complex influence, e.g. a stability term made as a gtc.ucomplex, is kept as two real influences
+        for the real and imaginary parts, made together as one ucomplex when converted.
+
+        :param x: complex value
+        :param u: (real, imaginary) standard uncertainties
+        :param df: degrees of freedom
+        :param label: label for the GTC ucomplex
+        :return: keys of the real and imaginary parts
+        """
+        key_re = self.add(x.real, u[0], df, label)
+        key_im = self.add(x.imag, u[1], df, label)
+        self.pair[key_re] = key_im
+        self.pair[key_im] = key_re
+        return key_re, key_im
+
+    def uncertain(self, key):
+        """
+        :param key: key of an influence
+        :return: the GTC ureal for the influence, made on first use
+        """
+        if key not in self.elementary:
+            if self.pair[key] is None:
+                self.elementary[key] = gtc.ureal(float(self.x[key]), float(self.u[key]), float(self.df[key]),
+                                                 label=self.label_of(key))
+            else:
+                key_re, key_im = sorted([key, self.pair[key]])
+                z = gtc.ucomplex(complex(self.x[key_re], self.x[key_im]),
+                                 (float(self.u[key_re]), float(self.u[key_im])), float(self.df[key_re]),
+                                 label=self.label_of(key_re))
+                self.elementary[key_re] = z.real
+                self.elementary[key_im] = z.imag
+        return self.elementary[key]
+
+    def ureal_repr(self, key):
+        """
+        :param key: key of a real influence
+        :return: the repr the GTC ureal of the influence will have, without making it, as used in labels that
+         refer to another uncertain number
+        """
+        df = self.df[key]
+        if not np.isnan(df) and df > gtc.inf_dof:
+            df = gtc.inf
+        return "ureal({!r},{!r},{!r}, label={!r})".format(float(self.x[key]), float(self.u[key]), float(df),
+                                                           self.label_of(key))
+
+
+class ErrorTable(object):
+    """
+    Values and first-order uncertainty of a complex error at a set of points, e.g. the excitation levels of a
+    ratio in the buildup.
+
+    :param influences: the Influences the keys refer to, shared by all tables that are combined
+    :param values: complex values at each point
+    :param keys: optional list of influence keys, one for each column of sensitivity
+    :param sensitivity: optional complex (points x keys) array, dense or scipy.sparse; the real and imaginary
+     parts are the sensitivities of the real and imaginary parts of the values to each influence
+    :param common: optional GTC uncertain number, or number, added to every point, for corrections such as the
+     magnetic and capacitive errors that are already GTC uncertain numbers, or an object array of them with one
+     for each point, e.g. a correction for each frequency of a stacked table. It must not depend on the
+     influences of the table.
+    """
+
+    def __init__(self, influences, values, keys=None, sensitivity=None, common=0):
+        self.influences = influences
+        self.values = np.array(values, dtype=complex).reshape(-1)
+        keys = keys if keys is not None else []
+        if sensitivity is None:
+            sensitivity = sparse.csr_matrix((len(self.values), len(keys)), dtype=complex)
+        # one column for each influence, e.g. a term shared by all points
+        self.keys, self.sensitivity = merge_columns(len(self.values), keys, sensitivity)
+        if isinstance(common, np.ndarray):
+            assert len(common) == len(self.values), 'the common term must have one element for each point'
+        self.common = common
+
+    def __len__(self):
+        return len(self.values)
+
+    def value(self):
+        """
+        :return: complex array of the values at each point, including the common term
+        """
+        if isinstance(self.common, np.ndarray):
+            return self.values + np.array([gtc.value(c) for c in self.common], dtype=complex)
+        return self.values + gtc.value(self.common)
+
+    def with_influence(self, key, sensitivity):
+        """
+        :param key: key of an influence in self.influences
+        :param sensitivity: complex sensitivity of each point to the influence
+        :return: a new table that also depends on the influence
+        """
+        return self + ErrorTable(self.influences, np.zeros(len(self)), [key],
+                                 np.asarray(sensitivity, dtype=complex).reshape(len(self), 1))
+
+    def with_factor(self, u, df, label, keys=None):
+        """
+        Multiplies each point by an uncertain factor of value 1.0, e.g. for a burden effect, to first order.
+
+        :param u: standard uncertainty of the factor
+        :param df: degrees of freedom
+        :param label: label of the factor at every point
+        :param keys: optional key of the factor for each point; by default new factors are made that are
+         independent from point to point, as TWOSTAGE.buildup creates them
+        :return: a new table
+        """
+        n = len(self)
+        if keys is None:
+            keys = self.influences.extend(1.0, u, df, [label] * n)
+        return self + ErrorTable(self.influences, np.zeros(n), keys, sparse.diags(self.value()))
+
+    def with_offsets(self, u, df, label, keys=None):
+        """
+        Adds a complex influence of zero value at each point, e.g. the short-term stability of a ratio.
+
+        :param u: (real, imaginary) standard uncertainties
+        :param df: degrees of freedom
+        :param label: label of the ucomplex at every point
+        :param keys: optional (real, imaginary) keys of the influence for each point; by default new influences
+         are made that are independent from point to point, as TWOSTAGE.buildup creates them
+        :return: a new table
+        """
+        n = len(self)
+        if keys is None:
+            keys = self.influences.extend_complex(0j, u, df, [label] * n)
+        rows = np.repeat(np.arange(n), 2)
+        sensitivity = sparse.csr_matrix((np.tile([1.0, 1j], n), (rows, np.arange(2 * n))), shape=(n, 2 * n))
+        return self + ErrorTable(self.influences, np.zeros(n), np.asarray(keys).reshape(-1), sensitivity)
+
+    def subset(self, index):
+        """
+        :param index: a slice or list of the points wanted
+        :return: a new table of those points, keeping only the influences they depend on
+        """
+        sensitivity = self.sensitivity[np.arange(len(self))[index]]
+        sensitivity.eliminate_zeros()
+        used = np.flatnonzero(sensitivity.getnnz(axis=0))
+        common = self.common[index] if isinstance(self.common, np.ndarray) else self.common
+        return ErrorTable(self.influences, self.values[index], self.keys[used], sensitivity[:, used], common)
+
+    def split(self, n):
+        """
+        :param n: number of tables, e.g. of frequencies, stacked in this one
+        :return: list of the n tables, of equal length
+        """
+        assert len(self) % n == 0, 'the points cannot be split into equal tables'
+        m = len(self) // n
+        return [self.subset(slice(i * m, (i + 1) * m)) for i in range(n)]
+
+    def transform(self, weights):
+        """
+        :param weights: (new points x points) array, each new point being a weighted sum of the points, e.g. to
+         interpolate to other excitation levels; a single common term is carried over unchanged, so the weights of
+         each new point should sum to 1
+        :return: a new table of the new points
+        """
+        common = self.common
+        if isinstance(common, np.ndarray):
+            common = np.asarray(weights, dtype=float).dot(common)
+        weights = sparse.csr_matrix(np.asarray(weights, dtype=float))
+        return ErrorTable(self.influences, weights.dot(self.values), self.keys, weights.dot(self.sensitivity),
+                          common)
+
+    def combine(self, other, factor):
+        """
+        :param other: an ErrorTable on the same Influences
+        :param factor: number other is multiplied by before being added
+        :return: self + factor * other
+        """
+        assert other.influences is self.influences, 'error tables must share their Influences to be combined'
+        assert len(other) == len(self), 'error tables have different numbers of points'
+        return ErrorTable(self.influences, self.values + factor * other.values,
+                          np.concatenate([self.keys, other.keys]),
+                          sparse.hstack([self.sensitivity, other.sensitivity * factor]),
+                          self.common + factor * other.common)
+
+    def __add__(self, other):
+        if isinstance(other, ErrorTable):
+            return self.combine(other, 1)
+        if isinstance(other, (gtc.lib.UncertainReal, gtc.lib.UncertainComplex)) or (
+                isinstance(other, np.ndarray) and other.dtype == object):
+            return ErrorTable(self.influences, self.values, self.keys, self.sensitivity, self.common + other)
+        return ErrorTable(self.influences, self.values + other, self.keys, self.sensitivity, self.common)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return self * -1
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def __mul__(self, factor):
+        assert not isinstance(factor, (ErrorTable, gtc.lib.UncertainReal, gtc.lib.UncertainComplex)), \
+            'error tables may only be multiplied by numbers, use with_factor for uncertain factors'
+        return ErrorTable(self.influences, self.values * factor, self.keys, self.sensitivity * factor,
+                          self.common * factor)
+
+    __rmul__ = __mul__
+
+    def components(self):
+        """
+        :return: sparse (points x keys) arrays of the components of uncertainty, sensitivity times standard
+         uncertainty, of the real and imaginary parts at each point
+        """
+        c = self.sensitivity.multiply(self.influences.u[self.keys]).tocsr()
+        return c.real, c.imag
+
+    def common_parts(self):
+        """
+        :return: (standard uncertainty, degrees of freedom) arrays of the real and of the imaginary parts of the
+         common term, with one element, or one for each point when the common term is an array
+        """
+        common = np.asarray(self.common, dtype=object).reshape(-1)
+        answer = []
+        for part in [[c.real for c in common], [c.imag for c in common]]:
+            answer.append((np.array([gtc.uncertainty(x) for x in part], dtype=float),
+                           np.array([gtc.dof(x) for x in part], dtype=float)))
+        return answer[0], answer[1]
+
+    def u(self):
+        """
+        Standard uncertainties from the sensitivities, with no GTC arithmetic. An uncertain common term is
+        included as an independent contribution.
+
+        :return: arrays of the standard uncertainty of the real and imaginary parts at each point
+        """
+        answer = []
+        for c, (u_common, df_common) in zip(self.components(), self.common_parts()):
+            answer.append(np.sqrt(np.asarray(c.power(2).sum(axis=1)).ravel() + u_common ** 2))
+        return answer[0], answer[1]
+
+    def dof(self):
+        """
+        Welch-Satterthwaite degrees of freedom from the sensitivities, as GTC calculates them for the same
+        uncorrelated influences. An uncertain common term contributes u**4 / dof.
+
+        :return: arrays of the degrees of freedom of the real and imaginary parts at each point, inf where GTC
+         would give inf
+        """
+        df = self.influences.df[self.keys]
+        weight = np.where(df > gtc.inf_dof, 0.0, 1 / df)  # infinite degrees of freedom contribute nothing
+        answer = []
+        for c, (u_common, df_common), u in zip(self.components(), self.common_parts(), self.u()):
+            total = np.asarray(c.power(4).multiply(weight).sum(axis=1)).ravel()
+            total = total + np.where(df_common > gtc.inf_dof, 0.0, u_common ** 4 / df_common)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                df_eff = np.where(total > 0, u ** 4 / total, np.inf)
+            answer.append(np.where(df_eff > gtc.inf_dof, np.inf, df_eff))
+        return answer[0], answer[1]
+
+    def to_gtc(self):
+        """
+        :return: list of GTC ucomplex, one for each point, with the same value and uncertainty components as if
+         the table had been calculated with GTC arithmetic throughout
+        """
+        deviation = {}  # zero valued GTC uncertain number carrying each influence, made once per key
+        sensitivity = sparse.csr_matrix(self.sensitivity)
+        sensitivity.sort_indices()
+        for j in np.unique(sensitivity.indices[sensitivity.data != 0]):
+            q = self.influences.uncertain(self.keys[j])
+            deviation[j] = q - q.x
+        result = []
+        for i in range(len(self)):
+            real = self.values[i].real
+            imag = self.values[i].imag
+            row = slice(sensitivity.indptr[i], sensitivity.indptr[i + 1])
+            for j, s in zip(sensitivity.indices[row], sensitivity.data[row]):
+                if s.real != 0:
+                    real = real + s.real * deviation[j]
+                if s.imag != 0:
+                    imag = imag + s.imag * deviation[j]
+            common = self.common[i] if isinstance(self.common, np.ndarray) else self.common
+            result.append(real + 1j * imag + common)
+        return result
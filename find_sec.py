@@ -233,7 +233,7 @@ if __name__ == "__main__":
     	
     x = [5,10,20,40,60,100,120]
     #data will be taken from the ForPython worksheet
-    ianz = ExcelPython.CALCULATOR("S21982 1 turn V5.0_draft_KJ.xlsm", "myResults.xlsx")
+    ianz = ExcelPython.CALCULATOR("S21982 1 turn V5.0_draft_KJ.xlsm", "myResults.xlsx", cache_dir='ExcelCache')
     #copy a block from the source worksheet
     block_descriptor = [1,343,1,8]
     my_copy_data = ianz.getdata_block('ForPython', block_descriptor)
@@ -0,0 +1,102 @@
+from __future__ import division
+"""
+Interpolation of CT errors to other excitation levels, e.g. for calibrating a transformer against the buildup at a
+fraction of the excitation the buildup was done at. Every mode is linear in the errors, so an interpolation is a
+matrix of weights and the uncertainty of the errors is carried through exactly, whether they are GTC uncertain
+numbers, ErrorTables or arrays of Monte Carlo trials.
+"""
+import numpy as np
+from scipy.interpolate import CubicSpline
+from errortable import ErrorTable
+
+
+class ExcitationInterpolator(object):
+    """
+    :param excitation: nominal % excitation of each point of the errors, in any order
+    :param targets: % excitation levels the errors are wanted at, by default the same as excitation
+    :param factor: the targets are divided by factor, e.g. 5 for errors at one fifth of the target excitation
+    :param mode: 'linear' for a straight line between the neighbouring points, 'logline' for a0 + a1*x + a2*log(x),
+     as MODEL.logline, through the three nearest points, or 'spline' for a cubic spline in log(excitation).
+     Targets outside the excitation range are extrapolated from the points at that end.
+    """
+
+    modes = ['linear', 'logline', 'spline']
+
+    def __init__(self, excitation, targets=None, factor=1, mode='linear'):
+        assert mode in self.modes, 'mode must be one of ' + repr(self.modes)
+        if targets is None:
+            targets = excitation
+        self.excitation = np.asarray(excitation, dtype=float)
+        assert len(np.unique(self.excitation)) == len(self.excitation), 'excitation levels must be different'
+        self.targets = np.array([x / factor for x in targets], dtype=float)
+        self.mode = mode
+        self.order = np.argsort(self.excitation)  # points in increasing excitation
+        self.weights = {'linear': self.linear_weights, 'logline': self.logline_weights,
+                        'spline': self.spline_weights}[mode]()  # (targets x points)
+
+    def segments(self):
+        """
+        :return: for each target, the position in increasing excitation of the lower point of the pair it lies
+         between, or of the end pair nearest to it
+        """
+        x = self.excitation[self.order]
+        return np.clip(np.searchsorted(x, self.targets) - 1, 0, len(x) - 2)
+
+    def linear_weights(self):
+        """
+        :return: weights of the straight line through the neighbouring points of each target
+        """
+        weights = np.zeros((len(self.targets), len(self.excitation)))
+        for k, i in enumerate(self.segments()):
+            a, b = sorted(self.order[i:i + 2])  # from the first to the second point in the order given
+            fraction = (self.targets[k] - self.excitation[a]) / (self.excitation[b] - self.excitation[a])
+            weights[k, a] = 1 - fraction
+            weights[k, b] = fraction
+        return weights
+
+    def logline_weights(self):
+        """
+        :return: weights of a0 + a1*x + a2*log(x) through the three points nearest each target
+        """
+        assert len(self.excitation) >= 3, 'logline interpolation needs at least three points'
+        x = self.excitation[self.order]
+        weights = np.zeros((len(self.targets), len(x)))
+        for k, i in enumerate(self.segments()):
+            t = self.targets[k]
+            if i + 2 < len(x) and (i == 0 or x[i + 2] - t < t - x[i - 1]):
+                start = i
+            else:
+                start = i - 1
+            nodes = x[start:start + 3]
+            basis = np.array([np.ones(3), nodes, np.log(nodes)])  # coefficients to values at the nodes
+            weights[k, self.order[start:start + 3]] = np.linalg.solve(basis, [1.0, t, np.log(t)])
+        return weights
+
+    def spline_weights(self):
+        """
+        :return: weights of the not-a-knot cubic spline in log(excitation) through all the points
+        """
+        n = len(self.excitation)
+        weights = np.zeros((len(self.targets), n))
+        spline = CubicSpline(np.log(self.excitation[self.order]), np.eye(n))  # one spline for each point
+        weights[:, self.order] = spline(np.log(self.targets))
+        return weights
+
+    def interpolate(self, errors):
+        """
+        :param errors: errors at each excitation, as a list of GTC uncertain numbers or numbers, an ErrorTable, or
+         a numpy array with the points along the last axis, e.g. Monte Carlo trials
+        :return: errors at the targets, a list, ErrorTable or array as given
+        """
+        if isinstance(errors, ErrorTable):
+            return errors.transform(self.weights)
+        if isinstance(errors, np.ndarray):
+            return errors.dot(self.weights.T)
+        assert len(errors) == len(self.excitation), 'one error is needed at each excitation level'
+        answer = []
+        for w in self.weights:
+            value = 0
+            for j in np.flatnonzero(w):
+                value = value + float(w[j]) * errors[j]
+            answer.append(value)
+        return answer
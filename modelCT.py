@@ -1,17 +1,24 @@
 from __future__ import division
+from __future__ import print_function
 """
 The CT class optionally takes in either the real and imaginary part
 of the secondary leakage impedance separately or as a single complex number,
 in methods error or error_z. This was hurridly triggered by not being able to get
 complex numbers into scipy optimize functions, but should be tidied up.
 """
-from scipy.optimize import minimize
+from scipy.optimize import minimize, least_squares
+from scipy.interpolate import RegularGridInterpolator
+from scipy.sparse.linalg import spsolve
 
+import itertools
 import math
 import cmath
 import GTC
 import numpy as np
-import matplotlib.pyplot as plt
+try:
+    import matplotlib.pyplot as plt  # optional, only needed for the plots
+except ImportError:
+    plt = None
 import ExcelPython
 
 class CT(object):
@@ -38,7 +45,8 @@ class CT(object):
     def error(self,core,r,l,burden):
         """
         calculates the error in the secondary current from impedance values
-        of the core, secondary and burden
+        of the core, secondary and burden, which may be numpy arrays that
+        broadcast together
         """
         secondary = r + 1j*l
         return -(secondary+burden)/(core+secondary+burden)
@@ -46,35 +54,32 @@ class CT(object):
     def error_z(self,core,z,burden):
         """
         calculates the error in the secondary current from impedance values
-        of the core, secondary and burden. z is a ucomplex
+        of the core, secondary and burden. z is a ucomplex, or the values
+        may be numpy arrays that broadcast together
         """
         secondary = z
         return -(secondary+burden)/(core+secondary+burden)
 
     def burdenVA(self,VA,pf,Isec):
         """
-        calculates the complex impedance of a burden from its VA, PF and secondary current
+        calculates the complex impedance of a burden from its VA, PF and secondary current,
+        the inverse of burdenZ. VA and pf may be numpy arrays, which broadcast together
         """
-        if pf >= 0:  #check sign convention for PF, '-'for capacitive
-            multiplier = 1.0
-        else:
-            multiplier = -1.0
+        multiplier = np.where(pf >= 0, 1.0, -1.0)  #check sign convention for PF, '-'for capacitive
         magZ = VA/Isec**2
-        phi = math.acos(pf)
-        Z = magZ*math.cos(phi)+ multiplier*1j*magZ*math.sin(phi)
-        return Z
+        return magZ*(multiplier*pf + multiplier*1j*np.sqrt(1 - pf**2))
         
     def burdenVAgtc(self,VA,pf,Isec):
         """
-        calculates the complex impedance of a burden from its VA, PF and secondary current
+        calculates the complex impedance of a burden from its VA, PF and secondary current,
+        the inverse of burdenZgtc
         """
         if pf >= 0:  #check sign convention for PF, '-'for capacitive
             multiplier = 1.0
         else:
             multiplier = -1.0
         magZ = VA/Isec**2
-        phi = GTC.acos(pf)
-        Z = magZ*GTC.cos(phi)+ multiplier*1j*magZ*GTC.sin(phi)
+        Z = magZ*multiplier*pf + multiplier*1j*magZ*GTC.sqrt(1 - pf**2)
         return Z
         
     def burdenZ(self,Z,Isec):
@@ -111,11 +116,12 @@ class CT(object):
         """
         'excite' is the excitation level in %
         returns a complex impedance
-        based on empirical fits
+        based on empirical fits. excite and frequency may be numpy arrays,
+        which broadcast together
         """
         x = excite
-        inductance = (self.a1*math.log(x)+self.a2*x+self.a3)*1e-3
-        resistance = self.a4*math.log(x)+self.a5*x**2+self.a6/math.sqrt(x)
+        inductance = (self.a1*np.log(x)+self.a2*x+self.a3)*1e-3
+        resistance = self.a4*np.log(x)+self.a5*x**2+self.a6/np.sqrt(x)
         return resistance + 1j*2*math.pi*frequency*inductance
         
     def coreZgtc(self, excite, frequency):
@@ -128,38 +134,52 @@ class CT(object):
         inductance = (self.a1*GTC.log(x)+self.a2*x+self.a3)*1e-3
         resistance = self.a4*GTC.log(x)+self.a5*x**2+self.a6/GTC.sqrt(x)
         return resistance + 1j*2*math.pi*frequency*inductance    
+
+    def dcoreZ(self, excite, frequency):
+        """
+        returns the derivative of coreZ with respect to the excitation,
+        for the Jacobian of LeakageFitter
+        """
+        x = excite
+        inductance = (self.a1/x+self.a2)*1e-3
+        resistance = self.a4/x+2*self.a5*x-self.a6/(2*x*np.sqrt(x))
+        return resistance + 1j*2*math.pi*frequency*inductance
+
+    def error_surface(self, excite, z, burden, frequency, reference=None):
+        """
+        returns the complex error at every combination of excitation, burden
+        and frequency, as an (excitation x burden x frequency) array.
+        If 'reference' is given the excitation is taken as stated at that
+        burden impedance, as in table_analysis where it is 0.2, so the
+        excitation of the core scales with abs(z+burden)
+        """
+        x = np.reshape(excite, (-1, 1, 1))
+        b = np.reshape(burden, (1, -1, 1))
+        f = np.reshape(frequency, (1, 1, -1))
+        if reference is not None:
+            x = x*abs((z+b)/reference)#volts at core higher than at burden
+        return self.error_z(self.coreZ(x, f), z, b)
         
     def fit_check(self,lista, listb):
-        residual_sum = 0
         assert len(lista)==len(listb),"lists are different lengths!"
-        for i in range(len(lista)):
-            residual_sum = residual_sum + (lista[i]-listb[i])**2
-        return residual_sum
+        return np.sum((np.asarray(lista)-np.asarray(listb))**2)
         
     def table_analysis(self, r, l, burdn, points, error_data, phase_data):
         sec =r + 1j*l
-        errors = []
-        phase = []
-        for i in range(len(points)):
-            coreimpedance = self.coreZ(points[i]*abs((sec+burdn)/0.2),50)#abs recognises that volts at core higher than at burden
-            complex_error = self.error(coreimpedance,r,l,burdn)
-            errors.append(complex_error.real*100)
-            phase.append(complex_error.imag*100)
-        s1 = self.fit_check(errors, error_data)
-        s2 = self.fit_check(phase, phase_data)
+        coreimpedance = self.coreZ(np.asarray(points)*abs((sec+burdn)/0.2),50)#abs recognises that volts at core higher than at burden
+        complex_error = self.error(coreimpedance,r,l,burdn)
+        s1 = self.fit_check(complex_error.real*100, error_data)
+        s2 = self.fit_check(complex_error.imag*100, phase_data)
         return s1 + s2
         
     def plot_table_analysis(self, r, l, burdn, points, error_data, phase_data,title):
         plt.close()#useful for when repeat runs are used
         plt.title(title)
         sec = r +1j*l
-        errors = []
-        phase = []
-        for i in range(len(points)):
-            coreimpedance = self.coreZ(points[i]*abs((sec+burdn)/0.2),50)#abs recognises that volts at core higher than at burden
-            complex_error = self.error(coreimpedance,r,l,burdn)
-            errors.append(complex_error.real*100)
-            phase.append(complex_error.imag*100)
+        coreimpedance = self.coreZ(np.asarray(points)*abs((sec+burdn)/0.2),50)#abs recognises that volts at core higher than at burden
+        complex_error = self.error(coreimpedance,r,l,burdn)
+        errors = complex_error.real*100
+        phase = complex_error.imag*100
         line1 = plt.plot(points,errors)
         line2 = plt.plot(points,phase)
         line3 = plt.plot(points,error_data,'r+')
@@ -194,8 +214,8 @@ class CT(object):
             error_corrections.append(errors_nom[i]-errors[i])
             phase_corrections.append(phase_nom[i]-phase[i])
             
-        print error_corrections
-        print phase_corrections
+        print(error_corrections)
+        print(phase_corrections)
         
         correct_error = []#add corrections to the measured values
         correct_phase = []
@@ -203,8 +223,8 @@ class CT(object):
             correct_error.append(error_data[i]+error_corrections[i])
             correct_phase.append(phase_data[i]+phase_corrections[i])
             
-        print correct_error
-        print correct_phase
+        print(correct_error)
+        print(correct_phase)
         
     def burden_correction_z(self, nominal_burdn, z, burdn, points, error_data, phase_data):
         """
@@ -213,35 +233,43 @@ class CT(object):
         """
 ##         sec = r + 1j*l
         sec = z
-        errors = []#using the measured value of burden
-        phase = []
-        for i in range(len(points)):
-            coreimpedance = self.coreZ(points[i]*abs((sec+burdn)/0.2),50)#abs recognises that volts at core higher than at burden
-            complex_error = self.error_z(coreimpedance,z,burdn)
-            errors.append(complex_error.real*100)
-            phase.append(complex_error.imag*100)
-            
-        errors_nom = []#using the nominal value of burden
-        phase_nom = []
-        for i in range(len(points)):
-            coreimpedance = self.coreZ(points[i]*abs((sec+nominal_burdn)/0.2),50)#abs recognises that volts at core higher than at burden
-            complex_error = self.error_z(coreimpedance,sec,nominal_burdn)
-            errors_nom.append(complex_error.real*100)
-            phase_nom.append(complex_error.imag*100)
-            
-        error_corrections = []
-        phase_corrections = []
-        for i in range(len(points)):
-            error_corrections.append(errors_nom[i]-errors[i])
-            phase_corrections.append(phase_nom[i]-phase[i])
+        #errors using the measured value of burden, then the nominal value
+        complex_error = self.error_surface(points, sec, [burdn, nominal_burdn], 50, 0.2)[:, :, 0]*100
+        corrections = complex_error[:, 1] - complex_error[:, 0]
         
-        correct_error = []#add corrections to the measured values
-        correct_phase = []
-        for i in range(len(points)):
-            correct_error.append(error_data[i]+error_corrections[i])
-            correct_phase.append(phase_data[i]+phase_corrections[i])
+        #add corrections to the measured values
+        correct_error = np.asarray(error_data) + corrections.real
+        correct_phase = np.asarray(phase_data) + corrections.imag
             
-        return correct_error, correct_phase
+        return correct_error.tolist(), correct_phase.tolist()
+
+    def burden_corrections(self, z, datasets, frequency=50, reference=0.2):
+        """
+        Corrects many datasets to their nominal burdens at once, as
+        burden_correction_z does for one. 'datasets' is a list of
+        (nominal_burdn, burdn, points, error_data, phase_data) and a list of
+        (correct_error, correct_phase) is returned, one for each dataset.
+        """
+        n = [len(d[2]) for d in datasets]
+        burden = np.repeat([[d[1], d[0]] for d in datasets], n, axis=0)#measured then nominal at each point
+        points = np.concatenate([np.asarray(d[2], dtype=float) for d in datasets])[:, None]
+        core = self.coreZ(points*abs((z+burden)/reference), frequency)#abs recognises that volts at core higher than at burden
+        complex_error = self.error_z(core, z, burden)*100
+        data = np.concatenate([np.asarray(d[3], dtype=float) + 1j*np.asarray(d[4], dtype=float) for d in datasets])
+        corrected = data + complex_error[:, 1] - complex_error[:, 0]
+        return [(c.real.tolist(), c.imag.tolist()) for c in np.split(corrected, np.cumsum(n)[:-1])]
+
+    def write_burden_corrections(self, z, calculator, block, datasets, title, frequency=50, reference=0.2):
+        """
+        Corrects datasets as burden_corrections, each dataset followed by
+        the [start row, finish row] of its data in 'block', and writes the
+        block with the corrected errors and phase displacements beside the
+        data in one streaming write of the output workbook of 'calculator'.
+        """
+        corrected = self.burden_corrections(z, [d[:5] for d in datasets], frequency, reference)
+        placed = [(d[5], list(c)) for d, c in zip(datasets, corrected)]
+        calculator.makeworkbook(calculator.with_columns(block, placed), title)
+        return corrected
     
     def error_vs_burden(burden_list, r, l, excitation):
         """
@@ -251,21 +279,308 @@ class CT(object):
         x_axis = []
         this_error = []
         this_phase = []
-        print burden_list
+        print(burden_list)
         for i in range(len(burden_list)):
             coreimpedance = self.coreZ(excitation*abs((sec + burden_list[i])/0.2),50)
             complex_error = self.error(coreimpedance,sec,burden_list[i])
             x_axis.append(burden_list[i].real)
             this_error.append(complex_error.real*100)
             this_phase.append(complex_error.imag*100)
-        print this_error
-        print this_phase
+        print(this_error)
+        print(this_phase)
         line1 = plt.plot(x_axis,this_error)
         line2 = plt.plot(x_axis,this_phase)
         plt.show()
 
 
 
+class LeakageFitter(object):
+    """
+    Least squares fit of the secondary leakage impedance of a CT to the
+    measured errors and phase displacements at several burdens, as the
+    fitfun of find_sec.py, with every dataset stacked into arrays and an
+    analytic Jacobian.
+    """
+    def __init__(self, ct, frequency=50, reference=0.2):
+        """
+        'ct' is a CT with fitted core coefficients, 'reference' the burden
+        impedance the excitation is stated at, as in table_analysis
+        """
+        self.ct = ct
+        self.frequency = frequency
+        self.reference = reference
+        self.datasets = []
+        self.result = None#the least_squares result of the last fit
+        self.cov = None#covariance of the fitted parameters
+        self.df = None
+
+    def add(self, burden, points, error_data, phase_data, u=1.0):
+        """
+        adds a dataset of errors and phase displacements, %, measured at
+        the excitation levels 'points' with a complex 'burden'. 'u' is the
+        standard uncertainty of the data, which weights the dataset
+        """
+        assert len(points)==len(error_data)==len(phase_data),"lists are different lengths!"
+        self.datasets.append((burden, points, error_data, phase_data, u))
+
+    def stack(self):
+        """
+        returns the burden and excitation of every point, and the measured
+        errors followed by the phase displacements, and their uncertainties,
+        as arrays
+        """
+        burden = np.concatenate([np.full(len(d[1]), d[0], dtype=complex) for d in self.datasets])
+        points = np.concatenate([np.asarray(d[1], dtype=float) for d in self.datasets])
+        data = np.concatenate([np.asarray(d[2], dtype=float) for d in self.datasets] +
+                              [np.asarray(d[3], dtype=float) for d in self.datasets])
+        u = np.concatenate([np.full(len(d[1]), d[4], dtype=float) for d in self.datasets]*2)
+        return burden, points, data, u
+
+    def partials(self, ct, z, burden, points):
+        """
+        returns the calculated errors, %, at each point, with their
+        derivatives with respect to the core impedance and the real and
+        imaginary part of z
+        """
+        w = z + burden
+        x = points*abs(w)/self.reference
+        core = ct.coreZ(x, self.frequency)
+        slope = ct.dcoreZ(x, self.frequency)*x/abs(w)**2#d core/d|w| divided by |w|
+        d_w = -core/(core+w)**2*100#holding the core impedance
+        d_core = w/(core+w)**2*100
+        return -w/(core+w)*100, d_core, d_w + d_core*slope*w.real, 1j*d_w + d_core*slope*w.imag
+
+    def split(self, c):
+        """
+        returns the real then imaginary parts of complex residuals or derivatives
+        """
+        return np.concatenate([c.real, c.imag])
+
+    def residuals(self, a, burden, points, data, u):
+        """
+        'a' is the real and imaginary part of zs; returns the calculated
+        less the measured errors and phase displacements, %, divided by
+        their uncertainties
+        """
+        complex_error = self.partials(self.ct, a[0] + 1j*a[1], burden, points)[0]
+        return (self.split(complex_error) - data)/u
+
+    def jacobian(self, a, burden, points, data, u):
+        """
+        returns the derivatives of the residuals with respect to the real
+        and imaginary part of zs
+        """
+        complex_error, d_core, d_r, d_l = self.partials(self.ct, a[0] + 1j*a[1], burden, points)
+        return np.column_stack([self.split(d_r), self.split(d_l)])/u[:, None]
+
+    def least_squares(self, start):
+        """
+        fits the parameters from 'start' and sets the covariance, scaled by
+        the residual variance, and the degrees of freedom
+        """
+        arrays = self.stack()
+        self.result = least_squares(self.residuals, start, jac=self.jacobian, args=arrays)
+        self.df = len(arrays[2]) - len(start)
+        r = np.linalg.qr(self.result.jac, mode='r')
+        r_inv = np.linalg.pinv(r)
+        cov = r_inv.dot(r_inv.T)*np.sum(self.result.fun**2)/self.df
+        self.cov = 0.5*(cov + cov.T)#exactly symmetric, as GTC requires of a covariance
+        return self.result.x
+
+    def fit(self, start=(0.05, 0.001), label='zs'):
+        """
+        fits zs to all the datasets added and returns it as a ucomplex,
+        with the covariance of the fit and degrees of freedom of the
+        number of residuals less two
+        """
+        a = self.least_squares(start)
+        return GTC.ucomplex(a[0] + 1j*a[1], tuple(self.cov.ravel()), df=self.df, label=label)
+
+
+class CoreLeakageFitter(LeakageFitter):
+    """
+    Joint weighted least squares fit of the six core coefficients and the
+    secondary leakage impedance of a CT to all the burden datasets, so that
+    a CT can be characterised from its error measurements alone.
+    """
+    def residuals(self, a, burden, points, data, u):
+        """
+        'a' is a1 ... a6 followed by the real and imaginary part of zs
+        """
+        complex_error = self.partials(CT(a[:6]), a[6] + 1j*a[7], burden, points)[0]
+        return (self.split(complex_error) - data)/u
+
+    def jacobian(self, a, burden, points, data, u):
+        """
+        returns the derivatives of the residuals with respect to a1 ... a6
+        and the real and imaginary part of zs
+        """
+        ct = CT(a[:6])
+        complex_error, d_core, d_r, d_l = self.partials(ct, a[6] + 1j*a[7], burden, points)
+        x = points*abs(a[6] + 1j*a[7] + burden)/self.reference
+        omega = 1j*2*math.pi*self.frequency*1e-3#inductance is in mH
+        d_a = [omega*np.log(x), omega*x, omega*np.ones_like(x), np.log(x), x**2, 1/np.sqrt(x)]
+        columns = [self.split(d_core*d) for d in d_a] + [self.split(d_r), self.split(d_l)]
+        return np.column_stack(columns)/u[:, None]
+
+    def fit(self, start=None, label='zs'):
+        """
+        fits a1 ... a6 and zs, starting from the coefficients of the CT and
+        'start' for zs, and returns a list of the six coefficients and zs
+        as correlated uncertain numbers, with the degrees of freedom of the
+        number of residuals less eight. GTC cannot find the degrees of
+        freedom of a complex result from this ensemble of ureals, so take
+        them from the .real and .imag parts of a result
+        """
+        ct = self.ct
+        if start is None:
+            start = (0.05, 0.001)
+        a = self.least_squares([ct.a1, ct.a2, ct.a3, ct.a4, ct.a5, ct.a6] + list(start))
+        u = np.sqrt(np.diag(self.cov))
+        labels = ['a1', 'a2', 'a3', 'a4', 'a5', 'a6', label + '_re', label + '_im']
+        q = GTC.multiple_ureal(list(a), list(u), self.df, label_seq=labels)
+        r = self.cov/np.outer(u, u)
+        for i in range(len(q)):
+            for j in range(i + 1, len(q)):
+                GTC.set_correlation(r[i, j], q[i], q[j])
+        return q[:6], q[6] + 1j*q[7]
+
+
+class CTErrorSurface(object):
+    """
+    The complex error of a CT calculated on a grid of excitation, burden
+    magnitude, burden phase and frequency, so that reporting and burden
+    studies can look errors up rather than evaluate the model each time.
+    Excitation is interpolated in log(excitation), as the core impedance
+    varies with its log. Multilinear lookups read only the 16 grid points
+    around each query, so they work on a table memory mapped from a file;
+    cubic spline lookups read the whole table, and need each axis to have
+    one point or at least four.
+    """
+    def __init__(self, ct, z, excite, magnitude, phase, frequency=(50,), reference=None):
+        """
+        'excite' (%), 'magnitude' (ohm), 'phase' (radians) and 'frequency'
+        are increasing lists of the grid values, 'z' the secondary leakage
+        and 'reference' as for error_surface. 'bound' estimates the
+        interpolation error of each method as the largest error at the
+        centres of the grid cells, furthest from the calculated points
+        """
+        self.grid = [np.log(np.asarray(excite, dtype=float)), np.asarray(magnitude, dtype=float),
+                     np.asarray(phase, dtype=float), np.asarray(frequency, dtype=float)]
+        self.table = self.calculate(ct, z, self.grid, reference)
+        self.spline = None#made when first needed
+        centres = [(g[:-1]+g[1:])/2 if len(g) > 1 else g for g in self.grid]
+        exact = self.calculate(ct, z, centres, reference).ravel()
+        mesh = [np.ravel(m) for m in np.meshgrid(*centres, indexing='ij')]
+        self.bound = {'linear': float(np.abs(self.lookup(mesh) - exact).max())}
+        if self.spline_axes() is not None:
+            self.bound['cubic'] = float(np.abs(self.lookup(mesh, 'cubic') - exact).max())
+
+    def calculate(self, ct, z, grid, reference):
+        """
+        returns the error over the grid, an (excitation x magnitude x phase
+        x frequency) array
+        """
+        burden = grid[1][:, None]*np.exp(1j*grid[2][None, :])
+        surface = ct.error_surface(np.exp(grid[0]), z, burden.ravel(), grid[3], reference)
+        return surface.reshape(len(grid[0]), len(grid[1]), len(grid[2]), len(grid[3]))
+
+    def spline_axes(self):
+        """
+        returns the axes with more than one point, or None if any axis
+        has two or three points, too few for a cubic spline
+        """
+        axes = [k for k, g in enumerate(self.grid) if len(g) > 1]
+        if min([len(self.grid[k]) for k in axes] + [4]) < 4:
+            return None
+        return axes
+
+    def check(self, coordinates):
+        """
+        asserts that the coordinates are within the grid, allowing only for
+        rounding, e.g. of log(exp(x)), at its ends
+        """
+        names = ['log(excitation)', 'burden magnitude', 'burden phase', 'frequency']
+        for name, c, g in zip(names, coordinates, self.grid):
+            slack = 1e-9*max(g[-1] - g[0], abs(g[0]), abs(g[-1]), 1)
+            outside = (np.asarray(c) < g[0] - slack) | (np.asarray(c) > g[-1] + slack)
+            assert not np.any(outside), name + " " + repr(np.asarray(c)[outside].tolist()) + \
+                " outside the grid, " + repr(g[0]) + " to " + repr(g[-1])
+
+    def index(self, coordinates):
+        """
+        returns the fractional grid index of each coordinate on each axis,
+        clipped to the grid
+        """
+        return [np.interp(c, g, np.arange(len(g))) for c, g in zip(coordinates, self.grid)]
+
+    def lookup(self, coordinates, method='linear'):
+        """
+        interpolates the table at log(excitation), magnitude, phase and
+        frequency coordinates, arrays of the same shape; coordinates outside
+        the grid are not extrapolated, an AssertionError is raised instead
+        """
+        self.check(coordinates)
+        if method == 'cubic':
+            axes = self.spline_axes()
+            assert axes is not None, "cubic lookups need one or at least four points on each axis"
+            if self.spline is None:
+                shape = [len(self.grid[k]) for k in axes]
+                values = np.asarray(self.table).reshape(shape)
+                try:#a direct solve, as the default iterative one does not pass through the table exactly
+                    self.spline = RegularGridInterpolator([self.grid[k] for k in axes], values, method='cubic',
+                                                          solver=spsolve)
+                except TypeError:#scipy before 1.13 always solves directly
+                    self.spline = RegularGridInterpolator([self.grid[k] for k in axes], values, method='cubic')
+            points = [np.clip(coordinates[k], self.grid[k][0], self.grid[k][-1]) for k in axes]
+            return self.spline(np.column_stack(points))
+        assert method == 'linear', "method must be 'linear' or 'cubic'"
+        position = self.index(coordinates)
+        corners = np.array(list(itertools.product([0, 1], repeat=4)))[:, :, None]#16 x axis x 1
+        shape = np.array(self.table.shape)[:, None]
+        position = np.array(position)#axis x query
+        low = np.minimum(np.floor(position), np.maximum(shape - 2, 0))
+        fraction = position - low
+        index = np.minimum(low + corners, shape - 1).astype(int)#corner x axis x query
+        weight = np.prod(np.where(corners, fraction, 1 - fraction), axis=1)
+        return np.sum(weight*self.table[tuple(index.transpose(1, 0, 2))], axis=0)
+
+    def error(self, excite, burden, frequency=50, method='linear'):
+        """
+        returns the interpolated complex error at excitations, complex
+        burdens and frequencies, which may be numpy arrays that broadcast
+        together and must lie within the grid
+        """
+        excite, burden, frequency = np.broadcast_arrays(excite, burden, frequency)
+        coordinates = [np.log(excite), np.abs(burden), np.angle(burden), frequency]
+        return self.lookup([np.asarray(c, dtype=float).ravel() for c in coordinates], method).reshape(excite.shape)
+
+    def save(self, filename):
+        """
+        saves the table to 'filename'.npy, which load memory maps, and the
+        grid and bounds to 'filename'.npz
+        """
+        np.save(filename + '.npy', np.asarray(self.table))
+        np.savez(filename + '.npz', excite=self.grid[0], magnitude=self.grid[1], phase=self.grid[2],
+                 frequency=self.grid[3], **self.bound)
+
+    @classmethod
+    def load(cls, filename, mmap_mode='r'):
+        """
+        returns the surface saved as 'filename', with the table memory mapped
+        unless mmap_mode is None
+        """
+        surface = cls.__new__(cls)
+        with np.load(filename + '.npz') as stored:
+            surface.grid = [stored[axis] for axis in ['excite', 'magnitude', 'phase', 'frequency']]
+            surface.bound = dict([(method, float(stored[method])) for method in ['linear', 'cubic']
+                                  if method in stored])
+        surface.table = np.load(filename + '.npy', mmap_mode=mmap_mode)
+        surface.spline = None
+        return surface
+
+
+
 if __name__ == "__main__":
     #use fitted impedance coefficients to define behviour of core impedance
     this_core = [11.7204144319303, -0.0273771774408702, 29.7364068940134, 3.90272331971033, 0.000243735060998679, 5.8544055409592]
@@ -287,10 +602,10 @@ if __name__ == "__main__":
     
     this_core_gtc = [a1,a2,a3,a4,a5,a6]
     this_CT_gtc = CT(this_core_gtc)
-    print GTC.log(a1)
+    print(GTC.log(a1))
     x = GTC.ureal(100,1)
     answer = this_CT_gtc.coreZgtc(x, 50)
     error = repr(answer.real)
-    print error
+    print(error)
     burden = GTC.ucomplex((0.186 + 0.12j),(0.0001,0.0001))
     print(this_CT.burdenZgtc(burden, 5.0))
\ No newline at end of file
@@ -0,0 +1,613 @@
+from __future__ import division
+from __future__ import print_function
+"""
+Monte Carlo evaluation of the scale buildup, following GUM Supplement 1, as a check on the first-order propagation
+done by GTC. Every input of the steps, magnetic and capacitive corrections and buildup of a RECIPE is drawn as a
+numpy array of trials and pushed through the same measurement equations as TWOSTAGE uses, one chunk of trials at
+a time so that memory stays bounded however many trials are run.
+
+The circuit model of a single CT, as modelCT.CT, is evaluated in the same way: the core coefficients, secondary
+leakage impedance, excitation and burden VA and PF are drawn together and the error is calculated for every trial,
+excitation level and burden at once.
+"""
+import csv
+import itertools
+import math
+import multiprocessing
+from concurrent import futures
+import numpy as np
+import GTC as gtc
+from twostage import TWOSTAGE
+from recipe import RECIPE
+from modelCT import CT
+
+
+def summarise(trials, coverage):
+    """
+    :param trials: dictionary of (trials x points) complex arrays
+    :param coverage: coverage probability, %, of the probabilistically symmetric interval
+    :return: dictionary of the summary of each array, a dictionary of the number of trials and (2 x points)
+     arrays of the mean, sum of squared deviations from the mean and interval end points of the real and
+     imaginary parts
+    """
+    summary = {}
+    p = [(100 - coverage) / 200, (100 + coverage) / 200]
+    for name, x in trials.items():
+        parts = np.stack([x.real, x.imag], axis=1)  # trials x part x point
+        mean = parts.mean(axis=0)
+        low, high = np.quantile(parts, p, axis=0)
+        summary[name] = {'n': len(parts), 'mean': mean, 'm2': ((parts - mean) ** 2).sum(axis=0), 'low': low,
+                         'high': high}
+    return summary
+
+
+def merge_summaries(total, part):
+    """
+    Pools the summaries of two sets of trials. Means and variances are pooled exactly; the interval end points are
+    averaged over the sets, weighted by number of trials, as in the adaptive procedure of GUM Supplement 1.
+
+    :param total: summaries so far, or None
+    :param part: summaries of a further chunk of trials
+    :return: the pooled summaries
+    """
+    if total is None:
+        return part
+    merged = {}
+    for name in part:
+        a = total[name]
+        b = part[name]
+        n = a['n'] + b['n']
+        delta = b['mean'] - a['mean']
+        merged[name] = {'n': n, 'mean': a['mean'] + delta * b['n'] / n,
+                        'm2': a['m2'] + b['m2'] + delta ** 2 * a['n'] * b['n'] / n,
+                        'low': (a['low'] * a['n'] + b['low'] * b['n']) / n,
+                        'high': (a['high'] * a['n'] + b['high'] * b['n']) / n}
+    return merged
+
+
+def run_chunk(model, trials, seed, names, coverage):
+    """
+    Runs one chunk of trials, in this process or a worker.
+
+    :param model: the inputs of the recipe nodes, as made by MONTECARLO.model
+    :param trials: number of trials
+    :param seed: numpy SeedSequence for the chunk
+    :param names: names of the results to summarise
+    :param coverage: coverage probability, %
+    :return: summaries of the named results
+    """
+    results = TRIALS(model, trials, seed).run()
+    return summarise(dict([(name, results[name]) for name in names]), coverage)
+
+
+def pool_chunks(function, model, trials, chunk, workers, seed, names, coverage):
+    """
+    Runs the trials in chunks, in this process or across a pool of worker processes, and pools the summaries.
+
+    :param function: module level function that runs one chunk, called as run_chunk is
+    :param model: the inputs, as plain numbers and arrays that can be sent to worker processes
+    :param trials: total number of trials
+    :param chunk: number of trials evaluated at once
+    :param workers: number of worker processes, None or 0 to run every chunk in this process
+    :param seed: optional seed, for repeatable results
+    :param names: names of the results to summarise
+    :param coverage: coverage probability, %
+    :return: entropy of the seed used, and a dictionary of the number of trials and arrays of the mean, standard
+     deviation and interval end points of each named result
+    """
+    sizes = [chunk] * (trials // chunk)
+    if trials % chunk:
+        sizes.append(trials % chunk)
+    sequence = np.random.SeedSequence(seed)
+    seeds = sequence.spawn(len(sizes))
+    total = None
+    if workers:
+        # a fresh interpreter for each worker, as for SCHEDULER
+        pool = futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            jobs = [pool.submit(function, model, size, seed, names, coverage) for size, seed in zip(sizes, seeds)]
+            for job in jobs:  # pooled in chunk order so that the result does not depend on timing
+                total = merge_summaries(total, job.result())
+        finally:
+            pool.shutdown()
+    else:
+        for size, seed in zip(sizes, seeds):
+            total = merge_summaries(total, function(model, size, seed, names, coverage))
+    summary = {}
+    for name in names:
+        s = total[name]
+        summary[name] = {'n': s['n'], 'mean': s['mean'], 'u': np.sqrt(s['m2'] / (s['n'] - 1)), 'low': s['low'],
+                         'high': s['high']}
+    return sequence.entropy, summary
+
+
+def ct_inputs(quantities):
+    """
+    :param quantities: numbers or GTC ureals
+    :return: arrays of the values, standard uncertainties and degrees of freedom of the quantities, and their
+     correlation matrix
+    """
+    x = np.array([gtc.value(q) for q in quantities], dtype=float)
+    u = np.array([gtc.uncertainty(q) for q in quantities], dtype=float)
+    df = np.array([gtc.dof(q) for q in quantities], dtype=float)
+    r = np.eye(len(x))
+    for i, j in itertools.combinations(range(len(x)), 2):
+        if u[i] and u[j]:
+            r[i, j] = r[j, i] = gtc.get_correlation(quantities[i], quantities[j])
+    return x, u, df, r
+
+
+def run_ct_chunk(model, trials, seed, names, coverage):
+    """
+    Runs one chunk of trials of a CT model, in this process or a worker.
+
+    :param model: the inputs of the CT model, as made by CTMONTECARLO.model
+    :param trials: number of trials
+    :param seed: numpy SeedSequence for the chunk
+    :param names: names of the results to summarise
+    :param coverage: coverage probability, %
+    :return: summaries of the named results
+    """
+    results = CTTRIALS(model, trials, seed).run()
+    return summarise(dict([(name, results[name]) for name in names]), coverage)
+
+
+class TRIALS(object):
+    """
+    One chunk of Monte Carlo trials of a buildup recipe. Each input is an array with the trials along the first axis
+    and the points, e.g. excitation levels, along the second, so that each node of the recipe is evaluated once for
+    all the trials.
+
+    The readings of the steps and magnetic nodes, the Type A inputs, are drawn from normal distributions, or from
+    scaled and shifted t-distributions, as GUM Supplement 1 gives for a Type A evaluation, when the model asks for
+    them. The t-distribution has a standard deviation larger than the standard uncertainty, by sqrt(df / (df - 2)).
+    The Type B terms are drawn from the shapes declared in TWOSTAGE.type_b_shape, and 'uncertain' nodes from the
+    'shape' of the node, normal by default; their degrees of freedom describe how well the standard uncertainty is
+    known and do not widen the draws.
+    """
+
+    def __init__(self, model, trials, seed):
+        """
+        :param model: the inputs of the recipe nodes, as made by MONTECARLO.model
+        :param trials: number of trials in this chunk
+        :param seed: seed, or numpy SeedSequence, for the random numbers of this chunk
+        """
+        self.model = model
+        self.trials = trials
+        self.rng = np.random.default_rng(seed)
+        self.plan = RECIPE(model['recipe'])
+        self.calrun = TWOSTAGE()  # for its measurement equations and Type B policies
+        self.calrun.type_b_policy = dict(model['policy'])
+        self.made = {}  # Type B draws shared by several points or steps
+
+    def deviation(self, u, df=gtc.inf, shape='normal'):
+        """
+        :param u: standard uncertainty, or array of them
+        :param df: degrees of freedom, or array of them, of a t-distribution
+        :param shape: 't', for t-distributions where df is finite, 'normal' or 'rectangular'
+        :return: zero-mean random errors, a (trials x len(u)) array
+        """
+        u, df = np.broadcast_arrays(np.asarray(u, dtype=float), np.asarray(df, dtype=float))
+        size = (self.trials,) + u.shape
+        if shape == 'rectangular':
+            return u * self.rng.uniform(-math.sqrt(3), math.sqrt(3), size)
+        finite = df <= gtc.inf_dof
+        if shape == 't' and finite.all():
+            return u * self.rng.standard_t(df, size)
+        z = self.rng.standard_normal(size)
+        if shape == 't' and finite.any():
+            z = np.where(finite, self.rng.standard_t(np.where(finite, df, 1.0), size), z)
+        return u * z
+
+    def column(self, x):
+        """
+        :param x: a number, or an array of one value for each trial
+        :return: x as a (trials x 1) complex array
+        """
+        return np.zeros((self.trials, 1), dtype=complex) + np.reshape(x, (-1, 1))
+
+    def type_b(self, name, value, points, step, part=''):
+        """
+        Draws a Type B term following its policy, as TWOSTAGE.type_b makes uncertain numbers.
+
+        :param name: name of the term, e.g. 'sr830'
+        :param value: value of the term, e.g. 1.0 for a factor
+        :param points: number of points the term is used at
+        :param step: name of the step
+        :param part: distinguishes separate influences of the same term, as for TWOSTAGE.type_b
+        :return: (trials x points) array, or (trials x 1) when one draw applies to every point
+        """
+        shared = self.calrun.type_b_shared(name, step, part, False)
+        if shared is not None and shared[0] in self.made:
+            return self.made[shared[0]]
+        u, df = self.model['type_b'][name]
+        shape = self.model['shape'][name]
+        n = points if shared is None else 1
+        if name == 'ct_stability':
+            draw = (value + self.deviation(np.full(n, u[0]), shape=shape) +
+                    1j * self.deviation(np.full(n, u[1]), shape=shape))
+        else:
+            draw = value + self.deviation(np.full(n, u), shape=shape)
+        if shared is not None:
+            self.made[shared[0]] = draw
+        return draw
+
+    def readings(self, data):
+        """
+        :param data: inputs of a step or magnetic node
+        :return: trials of the shunt, X and Y voltages, each (trials x readings)
+        """
+        shape = self.model['distribution']
+        return [data[q][0] + self.deviation(data[q][1], data[q][2], shape) for q in ['shuntv', 'xv', 'yv']]
+
+    def run_node(self, node, results):
+        """
+        Calculates a single node for all the trials, as RECIPE.run_node does with uncertain numbers.
+
+        :param node: the node dictionary
+        :param results: dictionary of the trials of results already calculated, updated with those of this node
+        """
+        kind = node['kind']
+        name = node['name']
+        data = self.model['inputs'].get(name)
+        calrun = self.calrun
+        if kind == 'step':
+            shuntv, xv, yv = self.readings(data)
+            n = len(data['shunt'])
+            xv = xv * self.type_b('sr830', 1.0, n, name, '_x') + self.type_b('cmnmode', 0.0, n, name, '_x')
+            yv = yv * self.type_b('sr830', 1.0, n, name, '_y') + self.type_b('cmnmode', 0.0, n, name, '_y')
+            results[name] = calrun.ratio_value(shuntv, xv, yv, data['shunt'], data['comr']) * data['sign']
+        elif kind == 'magnetic':
+            shuntv, xv, yv = self.readings(data)
+            m = shuntv.shape[1]
+            coupling = calrun.couple([shuntv[:, i] for i in range(m)], [xv[:, i] for i in range(m)],
+                                     [yv[:, i] for i in range(m)], data['ctratio'], data['shunt'], data['comr'],
+                                     node['ratio'])
+            merror, sp_merror = calrun.magneticsp_value(coupling, data['share'], node['ratio'])
+            if len(data['share']) == 4:  # series/parallel available on Ta primaries
+                sp_merror = self.column(sp_merror) * self.type_b('sp_mag', 1.0, 1, name, '_s')
+            results[name] = self.column(merror) * self.type_b('sp_mag', 1.0, 1, name)
+            results[name + '_sp'] = self.column(sp_merror)
+        elif kind == 'capacitance':
+            s_p_error, sp_s_error = calrun.newcapsp_value(*self.plan.capacitance_arguments(node))
+            if node['ratio'][0] == 4:
+                sp_s_error = sp_s_error * self.type_b('sp_cap', 1.0, 1, name, '_s')
+            results[name] = s_p_error * self.type_b('sp_cap', 1.0, 1, name)
+            results[name + '_sp'] = self.column(sp_s_error)
+        elif kind == 'uncertain':
+            u = node['u']
+            shape = node.get('shape', 'normal')
+            value = self.column(self.plan.complex_value(node['value']))
+            results[name] = value + self.deviation([u[0]], shape=shape) + 1j * self.deviation([u[1]], shape=shape)
+        elif kind == 'buildup':
+            arguments = dict([(key, results[value]) for key, value in node['inputs'].items()])
+            n = arguments['e1'].shape[1]
+            stability = dict([(step, self.type_b('ct_stability', 0j, n, step))
+                              for step in ['p1as', 'p1ap', 'p1bs', 'p1bp', 'p2ap', 'p2bs', 'p3as_a', 'p3as_b']])
+            burden = {'burden1a': self.type_b('brdn1a', 1.0, n, 'p1as'),
+                      'burden2a': self.type_b('brdn2a', 1.0, n, 'p1as'),
+                      'burden1b': self.type_b('brdn1b', 1.0, n, 'p1ap'),
+                      'burden2b': self.type_b('brdn2b', 1.0, n, 'p1ap')}
+            answer = calrun.buildup_array(None, stability=stability, burden=burden, **arguments)
+            for output, value in zip(node['outputs'], answer):
+                results[output] = value
+        elif kind == 'extra_ratios':
+            arguments = dict([(key, results[value]) for key, value in node['inputs'].items()])
+            answer = calrun.extra_ratios_array(**arguments)
+            for output, value in zip(node['outputs'], answer):
+                results[output] = value
+
+    def run(self):
+        """
+        :return: dictionary of the trials of every result, each a (trials x points) complex array
+        """
+        results = {}
+        for level in self.plan.levels():
+            for name in level:
+                self.run_node(self.plan.nodes[name], results)
+        return results
+
+
+class CTTRIALS(TRIALS):
+    """
+    One chunk of Monte Carlo trials of the circuit model of a CT, with the trials along the first axis, excitation
+    along the second and burden along the third.
+
+    Correlated inputs, such as the core coefficients from one fit, are drawn from a multivariate normal distribution,
+    or a multivariate t-distribution with the least of their degrees of freedom, as GUM Supplement 1 gives for a
+    multivariate Type A evaluation.
+    """
+
+    def __init__(self, model, trials, seed):
+        """
+        :param model: the inputs of the CT model, as made by CTMONTECARLO.model
+        :param trials: number of trials in this chunk
+        :param seed: seed, or numpy SeedSequence, for the random numbers of this chunk
+        """
+        self.model = model
+        self.trials = trials
+        self.rng = np.random.default_rng(seed)
+
+    def joint(self, x, u, df, r):
+        """
+        :param x: values of the inputs
+        :param u: standard uncertainties of the inputs
+        :param df: degrees of freedom of the inputs
+        :param r: correlation matrix of the inputs
+        :return: (trials x inputs) array of draws, each group of correlated inputs drawn together
+        """
+        group = np.arange(len(x))
+        for i, j in zip(*np.nonzero(np.triu(r, 1))):
+            group[group == group[j]] = group[i]
+        draw = np.zeros((self.trials, len(x)))
+        for g in np.unique(group):
+            k = group == g
+            w, v = np.linalg.eigh(u[k, None] * r[np.ix_(k, k)] * u[None, k])
+            z = self.rng.standard_normal((self.trials, k.sum())).dot((v * np.sqrt(np.clip(w, 0, None))).T)
+            dof = df[k].min()
+            if self.model['distribution'] == 't' and dof <= gtc.inf_dof:
+                z = z * np.sqrt(dof / self.rng.chisquare(dof, (self.trials, 1)))
+            draw[:, k] = z
+        return x + draw
+
+    def run(self):
+        """
+        :return: dictionary of the trials of the 'error' and, when there is a nominal burden, the 'correction',
+         each a (trials x excitation x burden) complex array
+        """
+        model = self.model
+        n = model['points']
+        draw = self.joint(*model['inputs'])
+        ct = CT([draw[:, i, None, None] for i in range(6)])  # the coefficients of each trial
+        z = (draw[:, 6] + 1j * draw[:, 7])[:, None, None]
+        x = draw[:, 8:8 + n][:, :, None]
+        va = draw[:, 8 + n::2][:, None, :]
+        pf = np.clip(draw[:, 9 + n::2][:, None, :], -1.0, 1.0)  # the power factor of a trial cannot exceed 1
+        burden = ct.burdenVA(va, pf, model['isec'])
+        if model['reference'] is not None:
+            x = x * np.abs((z + burden) / model['reference'])  # volts at core higher than at burden
+        error = ct.error_z(ct.coreZ(x, model['frequency']), z, burden)
+        if not model['nominal']:
+            return {'error': error}
+        return {'error': error[:, :, :-1], 'correction': error[:, :, -1:] - error[:, :, :-1]}
+
+
+class MONTECARLO(object):
+    """
+    Monte Carlo evaluation of a buildup RECIPE. The trials are run in chunks, in this process or across a pool of
+    worker processes. Each chunk has its own random number stream spawned from one seed, so the results do not
+    depend on the number of workers. Chunk summaries are pooled, so memory use is set by the chunk size, not by the
+    number of trials.
+
+    The summaries, one for each result of the buildup and extra_ratios nodes, can be set beside the GTC results
+    with rows or write_csv.
+    """
+
+    def __init__(self, recipe, trials=10 ** 6, chunk=10 ** 4, workers=None, seed=None, distribution='normal',
+                 coverage=95):
+        """
+        :param recipe: a RECIPE, or anything RECIPE accepts
+        :param trials: total number of trials
+        :param chunk: number of trials evaluated at once
+        :param workers: number of worker processes, None or 0 to run every chunk in this process
+        :param seed: optional seed, for repeatable results
+        :param distribution: 't' for the readings, the Type A inputs, drawn from t-distributions, or 'normal'; the
+         Type B terms are drawn from the shapes of TWOSTAGE.type_b_shape either way
+        :param coverage: coverage probability, %, of the intervals
+        """
+        assert distribution in ['t', 'normal'], "distribution must be 't' or 'normal'"
+        if isinstance(recipe, RECIPE):
+            self.recipe = recipe
+        else:
+            self.recipe = RECIPE(recipe)
+        self.trials = trials
+        self.chunk = chunk
+        self.workers = workers
+        self.seed = seed
+        self.distribution = distribution
+        self.coverage = coverage
+        self.entropy = None  # entropy of the seed used by the last run, to repeat it
+        self.summary = {}  # result name: dictionary of (2 x points) arrays 'mean', 'u', 'low', 'high' and 'n'
+
+    def outputs(self):
+        """
+        :return: names of the results of the buildup and extra_ratios nodes, in recipe order
+        """
+        names = []
+        for node in self.recipe.recipe['nodes']:
+            if node['kind'] in ['buildup', 'extra_ratios']:
+                names = names + self.recipe.results_of(node)
+        return names
+
+    def model(self, build):
+        """
+        Collects every input of the recipe nodes from the data blocks, as plain numbers and arrays that can be sent
+        to worker processes.
+
+        :param build: the BUILDUP the recipe is run with
+        :return: dictionary of the recipe, the inputs of each step and magnetic node, and the Type B terms,
+         policies and shapes of build.calrun
+        """
+        plan = self.recipe
+        calrun = build.calrun
+        df = calrun.df_readings  # of the Type A readings, as in ctcompare
+        plan.prefetch(build)
+        inputs = {}
+        for node in plan.recipe['nodes']:
+            name = node['name']
+            if node['kind'] == 'step':
+                blocks = build.labdata.getdata_blocks(build.calpage, [node['sign_block']] + list(node['error_blocks']))
+                sign = calrun.signcheck(blocks[0], build.full_scale, True)
+                block = np.array(blocks[1 + node.get('frequency', 0)], dtype=float)
+                shunt, comr = [8, 9] if node['settings'] else [7, 8]  # columns as read by ctcompare
+                inputs[name] = {'shuntv': (block[:, 0], block[:, 3], df), 'xv': (block[:, 1], block[:, 4], df),
+                                'yv': (block[:, 2], block[:, 5], df), 'shunt': block[:, shunt],
+                                'comr': block[:, comr], 'sign': sign * node.get('polarity', 1)}
+            elif node['kind'] == 'magnetic':
+                couple, share = build.labdata.getdata_blocks(build.datapage, [node['couple_block'],
+                                                                              node['share_block']])
+                proportions = calrun.ishare(node['ratio'], node['Rs'], node['rls'], [x[2] for x in share],
+                                            [x[0] for x in share], 1, node['individual'])
+                column = lambda j: np.array([x[j] for x in couple], dtype=float)  # columns as magnetic_coupling
+                inputs[name] = {'shuntv': (column(1), column(4), df), 'xv': (column(2), column(5), df),
+                                'yv': (column(3), column(6), df), 'ctratio': column(7), 'shunt': column(8),
+                                'comr': column(9), 'share': proportions}
+        return {'recipe': plan.recipe, 'inputs': inputs, 'type_b': calrun.type_b_constants(),
+                'policy': dict(calrun.type_b_policy), 'shape': dict(calrun.type_b_shape),
+                'distribution': self.distribution}
+
+    def run(self, build=None, cache_dir=None):
+        """
+        :param build: optional BUILDUP to use, otherwise one is made from the recipe
+        :param cache_dir: optional directory for the persistent block cache when the BUILDUP is made here
+        :return: self.summary
+        """
+        if build is None:
+            build = self.recipe.make_buildup(cache_dir)
+        model = self.model(build)
+        self.entropy, self.summary = pool_chunks(run_chunk, model, self.trials, self.chunk, self.workers, self.seed,
+                                                 self.outputs(), self.coverage)
+        return self.summary
+
+    def rows(self, results, excitation):
+        """
+        :param results: the GTC results of the recipe, e.g. from RECIPE.run
+        :param excitation: the nominal % excitation of each point
+        :return: rows of the GTC value, standard uncertainty, degrees of freedom and coverage interval of the real
+         and imaginary parts of each result at each point, beside the Monte Carlo mean, standard deviation and
+         coverage interval, with a header row
+        """
+        rows = [['result', 'excitation', 'part', 'GTC value', 'GTC u', 'GTC dof', 'GTC low', 'GTC high', 'MC mean',
+                 'MC u', 'MC low', 'MC high']]
+        for name in self.outputs():
+            s = self.summary[name]
+            for i, q in enumerate(results[name]):
+                for j, (part, x) in enumerate([('real', q.real), ('imag', q.imag)]):
+                    k = gtc.rp.k_factor(x.df, self.coverage)
+                    rows.append([name, excitation[i], part, x.x, x.u, x.df, x.x - k * x.u, x.x + k * x.u,
+                                 s['mean'][j, i], s['u'][j, i], s['low'][j, i], s['high'][j, i]])
+        return rows
+
+    def write_csv(self, filename, results, excitation):
+        """
+        :param filename: name of the .csv file for the GTC and Monte Carlo results side by side
+        :param results: the GTC results of the recipe
+        :param excitation: the nominal % excitation of each point
+        """
+        with open(filename, 'w') as f:
+            csv.writer(f, lineterminator='\n').writerows(self.rows(results, excitation))
+
+
+class CTMONTECARLO(object):
+    """
+    Monte Carlo evaluation of the error of a modelCT.CT, -(z + b)/(core + z + b), at a set of excitation levels and
+    burdens, run in chunks in the same way as MONTECARLO. When a nominal burden is given the corrections from each
+    burden to the nominal, as CT.burden_correction_z makes, are evaluated from the same trials.
+    """
+
+    def __init__(self, ct, zs, burdens, isec, excitation, frequency=50, nominal=None, reference=None,
+                 trials=10 ** 6, chunk=10 ** 4, workers=None, seed=None, distribution='normal', coverage=95):
+        """
+        :param ct: a modelCT.CT, its coefficients a1 ... a6 numbers or correlated GTC ureals
+        :param zs: secondary leakage impedance, a complex number or GTC ucomplex
+        :param burdens: list of (VA, PF) of each burden, numbers or GTC ureals
+        :param isec: secondary current the burden VA is stated at
+        :param excitation: list of % excitation levels, numbers or GTC ureals
+        :param frequency: frequency, Hz
+        :param nominal: optional (VA, PF) of the nominal burden that corrections are made to
+        :param reference: optional burden impedance that the excitation is stated at, as 0.2 in
+         CT.burden_correction_z; the excitation of the core then scales with abs(zs + burden)
+        :param trials: total number of trials
+        :param chunk: number of trials evaluated at once
+        :param workers: number of worker processes, None or 0 to run every chunk in this process
+        :param seed: optional seed, for repeatable results
+        :param distribution: 'normal', or 't' for inputs with finite degrees of freedom drawn from t-distributions,
+         only suitable when every such input is a Type A evaluation, e.g. coefficients from a fit
+        :param coverage: coverage probability, %, of the intervals
+        """
+        assert distribution in ['t', 'normal'], "distribution must be 't' or 'normal'"
+        self.ct = ct
+        self.zs = zs
+        self.burdens = list(burdens)
+        self.isec = isec
+        self.excitation = list(excitation)
+        self.frequency = frequency
+        self.nominal = nominal
+        self.reference = reference
+        self.trials = trials
+        self.chunk = chunk
+        self.workers = workers
+        self.seed = seed
+        self.distribution = distribution
+        self.coverage = coverage
+        self.entropy = None  # entropy of the seed used by the last run, to repeat it
+        self.summary = {}  # 'error' and 'correction': dictionary of (2 x excitation x burden) arrays and 'n'
+
+    def outputs(self):
+        """
+        :return: names of the results
+        """
+        if self.nominal is None:
+            return ['error']
+        return ['error', 'correction']
+
+    def model(self):
+        """
+        :return: dictionary of the values, uncertainties, degrees of freedom and correlations of the inputs, as
+         plain numbers and arrays that can be sent to worker processes
+        """
+        ct = self.ct
+        burdens = self.burdens
+        if self.nominal is not None:
+            burdens = burdens + [self.nominal]  # evaluated as the last burden
+        quantities = [ct.a1, ct.a2, ct.a3, ct.a4, ct.a5, ct.a6, self.zs.real, self.zs.imag] + self.excitation
+        for va, pf in burdens:
+            quantities = quantities + [va, pf]
+        return {'inputs': ct_inputs(quantities), 'points': len(self.excitation), 'isec': self.isec,
+                'frequency': self.frequency, 'reference': self.reference, 'nominal': self.nominal is not None,
+                'distribution': self.distribution}
+
+    def run(self):
+        """
+        :return: self.summary
+        """
+        self.entropy, self.summary = pool_chunks(run_ct_chunk, self.model(), self.trials, self.chunk, self.workers,
+                                                 self.seed, self.outputs(), self.coverage)
+        return self.summary
+
+    def rows(self, results):
+        """
+        :param results: dictionary of the GTC results, e.g. of CT.error_z, as a list for each excitation level of a
+         list for each burden, keyed as the summary
+        :return: rows of the GTC value, standard uncertainty, degrees of freedom and coverage interval of the real
+         and imaginary parts of each result beside the Monte Carlo mean, standard deviation and coverage interval,
+         with a header row
+        """
+        rows = [['result', 'excitation', 'burden', 'part', 'GTC value', 'GTC u', 'GTC dof', 'GTC low', 'GTC high',
+                 'MC mean', 'MC u', 'MC low', 'MC high']]
+        for name in self.outputs():
+            s = self.summary[name]
+            for i, row in enumerate(results[name]):
+                for m, q in enumerate(row):
+                    for j, (part, x) in enumerate([('real', q.real), ('imag', q.imag)]):
+                        k = gtc.rp.k_factor(x.df, self.coverage)
+                        rows.append([name, gtc.value(self.excitation[i]), m, part, x.x, x.u, x.df, x.x - k * x.u,
+                                     x.x + k * x.u, s['mean'][j, i, m], s['u'][j, i, m], s['low'][j, i, m],
+                                     s['high'][j, i, m]])
+        return rows
+
+    def write_csv(self, filename, results):
+        """
+        :param filename: name of the .csv file for the GTC and Monte Carlo results side by side
+        :param results: the GTC results, as for rows
+        """
+        with open(filename, 'w') as f:
+            csv.writer(f, lineterminator='\n').writerows(self.rows(results))
+
+
+if __name__ == "__main__":
+    plan = RECIPE('buildup_2018.json')
+    build, results = plan.run(cache_dir='ExcelCache')
+    mc = MONTECARLO(plan, workers=multiprocessing.cpu_count())
+    mc.run(build)
+    mc.write_csv('buildup_montecarlo.csv', results, build.target_excitation)
@@ -0,0 +1,401 @@
+from __future__ import division
+from __future__ import print_function
+import os
+import json
+import math
+import hashlib
+import GTC as gtc
+from ctscale_mod import BUILDUP
+try:
+    import yaml  # optional, only needed for recipes written in YAML
+except ImportError:
+    yaml = None
+
+
+def pack_results(results):
+    """
+    Uncertain numbers cannot simply be pickled without losing track of which elementary uncertain numbers they
+    depend on, so results are passed back from a worker, or stored in the memo directory, as a GTC archive.
+
+    :param results: dictionary of node results, each an uncertain number, a list of them or a plain number
+    :return: the archive as a JSON string, or None if there are no uncertain numbers, a dictionary of list lengths
+     and a dictionary of the plain results
+    """
+    archive = gtc.pr.Archive()
+    archived = False
+    lengths = {}
+    plain = {}
+    for name, value in results.items():
+        if isinstance(value, list):
+            lengths[name] = len(value)
+            for i in range(len(value)):
+                archive.add(**{name + ' ' + repr(i): gtc.result(value[i])})  # archived items must be declared
+                archived = True
+        elif isinstance(value, (gtc.lib.UncertainReal, gtc.lib.UncertainComplex)):
+            archive.add(**{name: gtc.result(value)})
+            archived = True
+        else:
+            plain[name] = value  # e.g. a zero series/parallel error when there is no series/parallel connection
+    if not archived:
+        return None, lengths, plain  # GTC will not write an empty archive
+    return gtc.pr.dumps_json(archive), lengths, plain
+
+
+def unpack_results(packed):
+    """
+    :param packed: the three items returned by pack_results
+    :return: dictionary of node results
+    """
+    text, lengths, plain = packed
+    archive = {} if text is None else gtc.pr.loads_json(text)
+    results = dict(plain)
+    for name in archive.keys():
+        if name.rsplit(' ', 1)[0] not in lengths:
+            results[name] = archive[name]
+    for name in lengths:
+        results[name] = [archive[name + ' ' + repr(i)] for i in range(lengths[name])]
+    return results
+
+
+class RECIPE(object):
+    """
+    Runs a scale buildup described by a recipe rather than by a script. The recipe names the input and output
+    workbooks and lists the nodes of the calculation: the error measurement steps, the magnetic coupling and
+    capacitive corrections, and the buildup and extra ratio calculations that combine them. Nodes refer to the
+    results of other nodes by name, so the order of the nodes in the recipe does not matter.
+
+    A recipe is a JSON file, or a YAML file if PyYAML is installed, or an equivalent dictionary. For example::
+
+        {"input": ["2018Test.xlsx", "Cal(2018)", "Data(2018)"], "output": "TwoStageResults2018_new.xlsx",
+         "input_c": ["1A_CT_cal_2018.xlsm", "1A CT 2018"], "output_c": "TwoStageResults2018_c_new.xlsx",
+         "excitation": [125, 120, 100, 60, 40, 20, 10, 5, 1], "sec100": 5,
+         "nodes": [{"name": "e1", "kind": "step", "sign_block": [66, 69, 4, 14], "error_blocks": [[69, 78, 4, 14]],
+                    "settings": true}, ...]}
+
+    Node kinds and their fields are,
+
+    * step: sign_block, error_blocks, settings, optional polarity (default 1) and frequency, the index of the error
+      block carried forward (default 0). The result is the list of signed errors.
+    * magnetic: share_block, couple_block, ratio, Rs, rls, Is, individual. Results are name and name + '_sp'.
+    * capacitance: frequency, capacitance, k, z4 and z3 as [real, imag], r2, ratio. The primary leakage impedance
+      used is z4 / k. Results are name and name + '_sp'.
+    * uncertain: value and u as [real, imag], optional df and optional shape, 'normal' or 'rectangular', for the
+      Monte Carlo evaluation, for estimates of corrections that were not measured.
+    * buildup: inputs, a dictionary of the TWOSTAGE.buildup arguments e1 ... capb naming results, and outputs, the
+      eight names given to the results.
+    * extra_ratios: inputs, a dictionary of the TWOSTAGE.extra_ratios arguments, and outputs, five names.
+
+    Any node may also have a comment, which is ignored.
+
+    Results are remembered against a hash of everything that went into them: the node itself, the contents of the
+    blocks it reads and the hashes of the nodes it uses. Running the recipe again, for example after one step has
+    been re-measured, only recalculates the nodes whose data changed and the nodes downstream of them.
+
+    Remembered results hold the shared and per-step Type B influences in the type_b_made of the TWOSTAGE they were
+    calculated with, so they are only used again with that TWOSTAGE; running with another forgets them. With a
+    memo_dir, results are also stored there as GTC archives, one for each node key, together with the Type B
+    influences made so far, which are stored under a hash of the Type B constants they were made with. A fresh
+    TWOSTAGE with the same constants takes up those influences, so a later session carries on with the stored
+    results rather than recalculating them.
+    """
+
+    node_kinds = ['step', 'magnetic', 'capacitance', 'uncertain', 'buildup', 'extra_ratios']
+
+    def __init__(self, recipe, memo=None, memo_dir=None):
+        """
+        :param recipe: file name of a .json, .yaml or .yml recipe, or a recipe dictionary
+        :param memo: optional dictionary of remembered results, e.g. the memo of an earlier version of the recipe
+        :param memo_dir: optional directory for the persistent memo
+        """
+        if isinstance(recipe, dict):
+            self.recipe = recipe
+        else:
+            self.recipe = self.load(recipe)
+        self.nodes = {}  # node dictionaries keyed on node name
+        self.producer = {}  # name of the node that produces each result
+        for node in self.recipe['nodes']:
+            assert node['kind'] in self.node_kinds, 'unknown node kind ' + repr(node['kind'])
+            assert node['name'] not in self.nodes, 'node name ' + repr(node['name']) + ' used twice'
+            self.nodes[node['name']] = node
+            for result in self.results_of(node):
+                assert result not in self.producer, 'result ' + repr(result) + ' produced twice'
+                self.producer[result] = node['name']
+        if memo is None:
+            memo = {}
+        self.memo = memo  # (type_b_made, results) of each node keyed on the hash of its inputs
+        self.memo_dir = memo_dir
+        self.made = None  # the type_b_made of the TWOSTAGE the recipe is being run with
+        self.joined = None  # the type_b_made that took up the Type B influences stored in memo_dir
+        self.registry = None  # name in memo_dir of the Type B influences stored for the constants of self.made
+        self.keys = {}  # hash of the inputs of each node in the last run
+        self.recalculated = []  # names of the nodes calculated rather than remembered in the last run
+
+    def load(self, filename):
+        """
+        :param filename: name of a .json, .yaml or .yml recipe file
+        :return: the recipe dictionary
+        """
+        with open(filename) as f:
+            if filename.lower().endswith(('.yaml', '.yml')):
+                assert yaml is not None, 'PyYAML must be installed to read ' + filename
+                return yaml.safe_load(f)
+            return json.load(f)
+
+    def results_of(self, node):
+        """
+        :param node: a node dictionary
+        :return: list of the names of the results the node produces
+        """
+        if node['kind'] in ['buildup', 'extra_ratios']:
+            return list(node['outputs'])
+        if node['kind'] in ['magnetic', 'capacitance']:
+            return [node['name'], node['name'] + '_sp']
+        return [node['name']]
+
+    def inputs_of(self, node):
+        """
+        :param node: a node dictionary
+        :return: list of the names of the nodes whose results this node uses
+        """
+        references = list(node.get('inputs', {}).values())
+        for reference in references:
+            assert reference in self.producer, 'node ' + repr(node['name']) + ' uses unknown result ' + repr(reference)
+        return sorted(set([self.producer[reference] for reference in references]))
+
+    def levels(self):
+        """
+        Orders the nodes so that each only follows the nodes it depends on. Nodes in the same level are independent
+        of each other and could be calculated in any order, or at the same time.
+
+        :return: list of lists of node names, in recipe order within each level
+        """
+        names = [node['name'] for node in self.recipe['nodes']]
+        needs = dict([(name, set(self.inputs_of(self.nodes[name]))) for name in names])
+        done = set()
+        levels = []
+        while len(done) < len(names):
+            level = [name for name in names if name not in done and needs[name] <= done]
+            assert level, 'recipe nodes ' + repr(sorted(set(names) - done)) + ' depend on each other'
+            levels.append(level)
+            done.update(level)
+        return levels
+
+    def make_buildup(self, cache_dir=None):
+        """
+        :param cache_dir: optional directory for the persistent cache of blocks read from the input spreadsheets
+        :return: a BUILDUP for the workbooks and excitation levels of the recipe
+        """
+        r = self.recipe
+        return BUILDUP(r['input'], r['output'], r['input_c'], r['output_c'], r['excitation'], r['sec100'],
+                       cache_dir=cache_dir, excitation_tolerance=r.get('excitation_tolerance'))
+
+    def prefetch(self, build):
+        """
+        Reads every block named in the recipe with one pass over each worksheet, so that the nodes are then served
+        from memory.
+
+        :param build: the BUILDUP the recipe is run with
+        """
+        cal_blocks = []
+        data_blocks = []
+        for node in self.recipe['nodes']:
+            if node['kind'] == 'step':
+                cal_blocks = cal_blocks + [node['sign_block']] + list(node['error_blocks'])
+            elif node['kind'] == 'magnetic':
+                data_blocks = data_blocks + [node['couple_block'], node['share_block']]
+        if cal_blocks:
+            build.labdata.prefetch(build.calpage, cal_blocks)
+        if data_blocks:
+            build.labdata.prefetch(build.datapage, data_blocks)
+
+    def complex_value(self, pair):
+        """
+        :param pair: [real, imag] as written in a recipe
+        :return: complex number
+        """
+        return pair[0] + 1j * pair[1]
+
+    def capacitance_arguments(self, node):
+        """
+        :param node: a capacitance node
+        :return: the arguments ypg, z, r2, z2 and uut_ratio of TWOSTAGE.newcapsp
+        """
+        ypg_admit = 1j * 2 * math.pi * node['frequency'] * node['capacitance']
+        z4 = self.complex_value(node['z4']) / node['k']
+        z3 = self.complex_value(node['z3'])
+        return ypg_admit, z4, node['r2'], z3, node['ratio']
+
+    def node_key(self, build, node):
+        """
+        Hashes everything a node's results depend on. The keys of the nodes it uses must already be in self.keys.
+
+        :param build: the BUILDUP the recipe is run with
+        :param node: the node dictionary
+        :return: hex digest
+        """
+        calrun = build.calrun
+        content = [node, build.target_excitation, build.full_scale, calrun.df_readings, calrun.type_b_policy,
+                   calrun.type_b_constants(), calrun.type_b_shape]
+        if node['kind'] == 'step':
+            content.append(build.labdata.getdata_blocks(build.calpage, [node['sign_block']] + list(node['error_blocks'])))
+        elif node['kind'] == 'magnetic':
+            content.append(build.labdata.getdata_blocks(build.datapage, [node['couple_block'], node['share_block']]))
+        content.append([self.keys[name] for name in self.inputs_of(node)])
+        text = json.dumps(content, sort_keys=True, default=repr)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def memo_path(self, name):
+        """
+        :param name: a node key, or the registry name of the Type B influences
+        :return: file name in memo_dir
+        """
+        return os.path.join(self.memo_dir, name + '.json')
+
+    def store(self, name, results):
+        """
+        Writes results to memo_dir as a GTC archive.
+
+        :param name: a node key, or the registry name of the Type B influences
+        :param results: dictionary of results
+        """
+        text, lengths, plain = pack_results(results)
+        if not os.path.isdir(self.memo_dir):
+            os.makedirs(self.memo_dir)
+        path = self.memo_path(name)
+        with open(path + '.tmp', 'w') as f:  # write then rename, so an interrupted run leaves no partial file
+            json.dump({'archive': text, 'lengths': lengths, 'plain': plain}, f)
+        os.replace(path + '.tmp', path)
+
+    def stored(self, name):
+        """
+        :param name: a node key, or the registry name of the Type B influences
+        :return: the results written by store, or None if there are none
+        """
+        path = self.memo_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            packed = json.load(f)
+        return unpack_results((packed['archive'], packed['lengths'], packed['plain']))
+
+    def tie(self, build):
+        """
+        Ties the memo to the Type B influences of build.calrun. Results remembered with another TWOSTAGE are
+        forgotten. A TWOSTAGE that has not made any influences yet takes up those stored in memo_dir for its constants.
+
+        :param build: the BUILDUP the recipe is run with
+        """
+        calrun = build.calrun
+        made = calrun.type_b_made
+        text = json.dumps([calrun.type_b_constants(), calrun.type_b_shape], sort_keys=True)
+        self.registry = 'type_b_made_' + hashlib.sha256(text.encode('utf-8')).hexdigest()
+        if self.memo_dir is not None and self.joined is not made and not made:
+            stored = self.stored(self.registry)
+            if stored is not None:
+                made.update(dict([(tuple(json.loads(name)), x) for name, x in stored.items()]))
+            self.joined = made
+        for key in [key for key, entry in self.memo.items() if entry[0] is not made]:
+            del self.memo[key]
+        self.made = made
+
+    def remembered(self, build, node, results):
+        """
+        Finds the key of a node and, if the node was calculated before from the same inputs, copies the remembered
+        results into results.
+
+        :param build: the BUILDUP the recipe is run with
+        :param node: the node dictionary
+        :param results: dictionary of results already calculated
+        :return: True if the remembered results were used
+        """
+        key = self.node_key(build, node)
+        self.keys[node['name']] = key
+        if key not in self.memo and self.made is self.joined:
+            stored = self.stored(key)
+            if stored is not None:
+                self.memo[key] = (self.made, stored)
+        if key in self.memo:
+            results.update(self.memo[key][1])
+            return True
+        return False
+
+    def remember(self, node, results):
+        """
+        Keeps the results of a node just calculated against its key, and stores them in memo_dir when the Type B
+        influences they hold are stored there too.
+
+        :param node: the node dictionary
+        :param results: dictionary of results including those of the node
+        """
+        key = self.keys[node['name']]
+        self.memo[key] = (self.made, dict([(r, results[r]) for r in self.results_of(node)]))
+        self.recalculated.append(node['name'])
+        if self.memo_dir is not None and self.made is self.joined:
+            self.store(key, self.memo[key][1])
+            # the shared influences made so far, keyed (name, part, table); per-step influences are only used within
+            # the node that made them, and ErrorTable keys only mean something to this TWOSTAGE
+            self.store(self.registry, dict([(json.dumps(list(made)), x) for made, x in self.made.items()
+                                            if len(made) == 3 and not made[-1]]))
+
+    def run_node(self, build, node, results):
+        """
+        Calculates a single node.
+
+        :param build: the BUILDUP the recipe is run with
+        :param node: the node dictionary
+        :param results: dictionary of results already calculated, updated with the results of this node
+        """
+        kind = node['kind']
+        name = node['name']
+        if kind == 'step':
+            e, exc, nom_excite = build.step(node['sign_block'], node['error_blocks'], node['settings'])
+            polarity = node.get('polarity', 1)
+            e_freq = e[node.get('frequency', 0)]
+            if polarity != 1:
+                e_freq = [x * polarity for x in e_freq]  # e.g. polarity check done on Tb rather than Ta
+            results[name] = e_freq
+        elif kind == 'magnetic':
+            results[name], results[name + '_sp'] = build.magnetic(node['share_block'], node['couple_block'],
+                                                                  node['ratio'], node['Rs'], node['rls'], node['Is'],
+                                                                  node['individual'])
+        elif kind == 'capacitance':
+            results[name], results[name + '_sp'] = build.calrun.newcapsp(*self.capacitance_arguments(node))
+        elif kind == 'uncertain':
+            results[name] = gtc.ucomplex(self.complex_value(node['value']), tuple(node['u']), node.get('df', gtc.inf),
+                                         label=node.get('label', name))
+        elif kind == 'buildup':
+            arguments = dict([(key, results[value]) for key, value in node['inputs'].items()])
+            answer = build.calrun.buildup(build.target_excitation, **arguments)
+            for output, value in zip(node['outputs'], answer):
+                results[output] = value
+        elif kind == 'extra_ratios':
+            arguments = dict([(key, results[value]) for key, value in node['inputs'].items()])
+            answer = build.calrun.extra_ratios(**arguments)
+            for output, value in zip(node['outputs'], answer):
+                results[output] = value
+
+    def run(self, build=None, cache_dir=None):
+        """
+        Calculates every node of the recipe, level by level.
+
+        :param build: optional BUILDUP to use, otherwise one is made from the recipe
+        :param cache_dir: optional directory for the persistent block cache when the BUILDUP is made here
+        :return: the BUILDUP and a dictionary of all results keyed on result name
+        """
+        if build is None:
+            build = self.make_buildup(cache_dir)
+        self.prefetch(build)
+        self.tie(build)
+        results = {}
+        self.keys = {}
+        self.recalculated = []
+        for level in self.levels():
+            for name in level:
+                node = self.nodes[name]
+                if self.remembered(build, node, results):
+                    print(node['kind'], name, 'unchanged')
+                    continue
+                print(node['kind'], name)  # progress, as the steps were printed in main_ct_scale.py
+                self.run_node(build, node, results)
+                self.remember(node, results)
+        return build, results
@@ -0,0 +1,165 @@
+from __future__ import division
+from __future__ import print_function
+import csv
+import time
+import multiprocessing
+from concurrent import futures
+from recipe import RECIPE, pack_results, unpack_results
+
+
+def run_remote(recipe, name, blocks, cache_dir, policy):
+    """
+    Calculates one node in a worker process. The blocks of data already read by the main process are passed in,
+    so the worker does not open the workbook.
+
+    :param recipe: the recipe dictionary
+    :param name: name of the node to calculate
+    :param blocks: the block cache of the main process CALCULATOR
+    :param cache_dir: optional directory for the persistent block cache
+    :param policy: the type_b_policy of the main process TWOSTAGE
+    :return: packed results and the time taken, s
+    """
+    start = time.time()
+    plan = RECIPE(recipe)
+    build = plan.make_buildup(cache_dir)
+    build.labdata.block_cache.update(blocks)
+    build.calrun.type_b_policy = dict(policy)
+    results = {}
+    plan.run_node(build, plan.nodes[name], results)
+    packed = pack_results(results)
+    return packed, time.time() - start
+
+
+class SCHEDULER(object):
+    """
+    Runs the nodes of a RECIPE as a dependency graph. A node starts as soon as the nodes it uses are finished. With
+    workers, the step and magnetic nodes, which do most of the work, go to a pool of processes while the nodes that
+    join their results (buildup, extra_ratios) run in the main process. Without workers every node runs in the main
+    process, in dependency order.
+
+    Uncertain numbers made in a worker come back through a GTC archive. A worker has its own TWOSTAGE, so it can
+    only make Type B influences that are not shared with other nodes. A node that uses a Type B term whose
+    type_b_policy is 'per-step' or 'shared' therefore runs in the main process, where the influence is made once in
+    the type_b_made of build.calrun; the results are then the same whatever the number of workers.
+
+    The time taken by each node is kept in self.timing and can be written out with write_timing.
+    """
+
+    remote_kinds = ['step', 'magnetic']  # nodes worth the cost of sending to another process
+    remote_terms = {'step': ['sr830', 'cmnmode'], 'magnetic': ['sp_mag']}  # the Type B terms they use
+
+    def __init__(self, recipe, workers=None):
+        """
+        :param recipe: a RECIPE, or anything RECIPE accepts
+        :param workers: number of worker processes, None or 0 to run everything in this process
+        """
+        if isinstance(recipe, RECIPE):
+            self.recipe = recipe
+        else:
+            self.recipe = RECIPE(recipe)
+        self.workers = workers
+        self.timing = {}  # node name: dictionary of kind, where it ran, seconds taken and seconds from start to finish
+
+    def record(self, name, where, seconds, start):
+        """
+        :param name: node name
+        :param where: 'main', 'worker' or 'memo' when remembered from an earlier run
+        :param seconds: time taken to calculate the node, s
+        :param start: time the run started
+        """
+        self.timing[name] = {'kind': self.recipe.nodes[name]['kind'], 'where': where, 'seconds': seconds,
+                             'finished': time.time() - start}
+
+    def coupled(self, build, node):
+        """
+        :param build: the BUILDUP the recipe is run with
+        :param node: the node dictionary
+        :return: True if the node uses a Type B term that is not made afresh at every use
+        """
+        policy = build.calrun.type_b_policy
+        return any([policy[term] != 'per-point' for term in self.remote_terms.get(node['kind'], [])])
+
+    def run(self, build=None, cache_dir=None):
+        """
+        :param build: optional BUILDUP to use, otherwise one is made from the recipe
+        :param cache_dir: optional directory for the persistent block cache
+        :return: the BUILDUP and a dictionary of all results keyed on result name
+        """
+        plan = self.recipe
+        if build is None:
+            build = plan.make_buildup(cache_dir)
+        start = time.time()
+        self.timing = {}
+        plan.prefetch(build)  # one pass over each sheet, before any node is started
+        plan.tie(build)
+        self.timing['prefetch'] = {'kind': 'read', 'where': 'main', 'seconds': time.time() - start,
+                                   'finished': time.time() - start}
+
+        names = [node['name'] for node in plan.recipe['nodes']]
+        needs = dict([(name, set(plan.inputs_of(plan.nodes[name]))) for name in names])
+        results = {}
+        plan.keys = {}
+        plan.recalculated = []
+        done = set()
+        started = set()
+        running = {}  # future: node name
+        pool = None
+        if self.workers:
+            # a fresh interpreter for each worker so that each has its own GTC context
+            pool = futures.ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        try:
+            while len(done) < len(names):
+                ready = [name for name in names if name not in started and needs[name] <= done]
+                assert ready or running, 'recipe nodes ' + repr(sorted(set(names) - done)) + ' depend on each other'
+                for name in ready:
+                    started.add(name)
+                    node = plan.nodes[name]
+                    if plan.remembered(build, node, results):
+                        print(node['kind'], name, 'unchanged')
+                        self.record(name, 'memo', 0.0, start)
+                        done.add(name)
+                    elif pool is not None and node['kind'] in self.remote_kinds and not self.coupled(build, node):
+                        print(node['kind'], name, 'started')
+                        running[pool.submit(run_remote, plan.recipe, name, build.labdata.block_cache,
+                                            build.labdata.cache_dir, build.calrun.type_b_policy)] = name
+                    else:
+                        print(node['kind'], name)
+                        node_start = time.time()
+                        plan.run_node(build, node, results)
+                        plan.remember(node, results)
+                        self.record(name, 'main', time.time() - node_start, start)
+                        done.add(name)
+                if running and not [name for name in names if name not in started and needs[name] <= done]:
+                    # nothing else can start until a worker finishes
+                    finished, pending = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        packed, seconds = future.result()
+                        results.update(unpack_results(packed))
+                        plan.remember(plan.nodes[name], results)
+                        self.record(name, 'worker', seconds, start)
+                        done.add(name)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.timing['total'] = {'kind': '', 'where': 'main', 'seconds': time.time() - start,
+                                'finished': time.time() - start}
+        return build, results
+
+    def timing_rows(self):
+        """
+        :return: rows of node name, kind, where calculated, seconds taken and seconds from start to finish, in
+         the order the nodes finished
+        """
+        rows = [['node', 'kind', 'where', 'seconds', 'finished']]
+        for name in sorted(self.timing, key=lambda n: self.timing[n]['finished']):
+            t = self.timing[name]
+            rows.append([name, t['kind'], t['where'], t['seconds'], t['finished']])
+        return rows
+
+    def write_timing(self, filename):
+        """
+        :param filename: name of the .csv file for the timing of each node
+        """
+        with open(filename, 'w') as f:
+            csv.writer(f, lineterminator='\n').writerows(self.timing_rows())
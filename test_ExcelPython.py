@@ -0,0 +1,189 @@
+from __future__ import division
+"""
+Checks of the block reading, caching and workbook writing of CALCULATOR on small workbooks made for each test.
+Run with pytest.
+"""
+import os
+import numpy as np
+import pytest
+import openpyxl
+import GTC as gtc
+from ExcelPython import CALCULATOR
+
+
+def make_source(path, rows, title='s'):
+    """
+    :param path: file name of the workbook
+    :param rows: list of rows, written from the first cell of the sheet
+    :return: path
+    """
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = title
+    for row in rows:
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+def grid(n, m, offset=0):
+    return [[offset + 10 * i + j for j in range(1, m + 1)] for i in range(1, n + 1)]
+
+
+def test_touched_source_with_mixed_cached_blocks(tmp_path):
+    source = make_source(str(tmp_path / 'source.xlsx'), grid(10, 4))
+    calc = CALCULATOR(source, str(tmp_path / 'out.xlsx'), cache_dir=str(tmp_path / 'cache'))
+    a = [1, 3, 1, 3]
+    c = [5, 7, 2, 5]
+    assert calc.getdata_blocks('s', [a]) == [[[11, 12], [21, 22]]]  # parses the source, caches a on disk
+    mtime = os.path.getmtime(source)
+    os.utime(source, (mtime + 10, mtime + 10))  # touched, same contents
+    assert calc.getdata_blocks('s', [a, c]) == [[[11, 12], [21, 22]], [[52, 53, 54], [62, 63, 64]]]
+    assert len(calc.workbook_cache) == 1
+
+
+def test_resaved_source_with_mixed_cached_blocks(tmp_path):
+    source = make_source(str(tmp_path / 'source.xlsx'), grid(10, 4))
+    calc = CALCULATOR(source, str(tmp_path / 'out.xlsx'), cache_dir=str(tmp_path / 'cache'))
+    a = [1, 3, 1, 3]
+    c = [5, 7, 2, 5]
+    calc.getdata_blocks('s', [a])
+    mtime = os.path.getmtime(source)
+    make_source(source, grid(10, 4, 1000))  # new contents
+    os.utime(source, (mtime + 10, mtime + 10))
+    assert calc.getdata_blocks('s', [a, c]) == [[[1011, 1012], [1021, 1022]], [[1052, 1053, 1054], [1062, 1063, 1064]]]
+
+
+def test_with_columns_places_rows():
+    calc = CALCULATOR('unused.xlsx', 'unused_out.xlsx')
+    block = [[1], [2], [3], [4], [5], [6]]
+    placed = [([2, 3], [[20, 30], [200, 300]]),  # rows 2 and 3, 1-based and inclusive
+              ([6, 6], [[60]])]
+    assert list(calc.with_columns(block, placed)) == [[1, None, None], [2, 20, 200], [3, 30, 300],
+                                                       [4, None, None], [5, None, None], [6, 60, None]]
+    assert calc.extract_column(list(calc.with_columns(block, placed)), 2, [2, 3]) == [20, 30]
+
+
+def test_block_array_masks_and_pads():
+    calc = CALCULATOR('unused.xlsx', 'unused_out.xlsx')
+    table = calc.block_array([[1, 2.5, None], ['text', True], [3]])
+    assert table.shape == (3, 3)
+    assert table[0, 0] == 1 and table[0, 1] == 2.5 and table[2, 0] == 3
+    assert np.isnan(table).tolist() == [[False, False, True], [True, True, True], [False, True, True]]
+    assert calc.block_array([]).shape == (0, 0)
+
+
+def test_read_sheet_array_slices_like_extract_column(tmp_path):
+    rows = grid(6, 5)
+    rows[1][2] = None
+    rows[2][3] = 'text'
+    source = make_source(str(tmp_path / 'source.xlsx'), rows)
+    calc = CALCULATOR(source, str(tmp_path / 'out.xlsx'))
+    block = calc.getdata_block('s', [2, 6, 2, 6])
+    table = calc.read_sheet_array('s', [2, 6, 2, 6])
+    assert table.shape == (4, 4)
+    assert np.isnan(table[0, 1]) and np.isnan(table[1, 2])
+    for column in range(1, 5):
+        values = calc.extract_column(block, column, [2, 4])
+        sliced = calc.extract_column(table, column, [2, 4])
+        assert isinstance(sliced, np.ndarray) and len(sliced) == len(values) == 3
+        assert [v if isinstance(v, int) else None for v in values] == \
+               [None if np.isnan(v) else int(v) for v in sliced]
+    padded = calc.read_sheet_array('s', [5, 10, 1, 3])  # past the last used row
+    assert padded.shape == (5, 2)
+    assert padded[:2].tolist() == [[51, 52], [61, 62]] and np.isnan(padded[2:]).all()
+
+
+def test_getdata_blocks_overlapping_duplicate_and_past_the_end(tmp_path):
+    source = make_source(str(tmp_path / 'source.xlsx'), grid(5, 4))
+    calc = CALCULATOR(source, str(tmp_path / 'out.xlsx'))
+    a = [1, 4, 1, 3]
+    b = [2, 5, 2, 5]  # overlaps a
+    c = [4, 8, 1, 2]  # runs past the last used row, 5
+    blocks = calc.getdata_blocks('s', [a, b, a, c])
+    assert blocks[0] == blocks[2] == [[11, 12], [21, 22], [31, 32]]
+    assert blocks[1] == [[22, 23, 24], [32, 33, 34], [42, 43, 44]]
+    assert blocks[3] == [[41], [51], [None], [None]]
+    blocks[0][0][0] = 'changed'  # copies, the duplicate and the cache are unaffected
+    assert blocks[2][0][0] == 11
+    assert calc.getdata_block('s', a)[0][0] == 11
+
+
+def test_getdata_blocks_reuses_block_cache(tmp_path, monkeypatch):
+    source = make_source(str(tmp_path / 'source.xlsx'), grid(5, 4))
+    calc = CALCULATOR(source, str(tmp_path / 'out.xlsx'))
+    a = [1, 3, 1, 3]
+    b = [3, 5, 2, 4]
+    first = calc.getdata_blocks('s', [a, b])
+    assert len(calc.block_cache) == 2
+
+    def no_parse():
+        raise AssertionError('source parsed again')
+    monkeypatch.setattr(calc, 'load_source', no_parse)
+    assert calc.getdata_blocks('s', [b, a, b]) == [first[1], first[0], first[1]]
+    assert len(calc.block_cache) == 2
+
+
+def test_budget_table_per_sheet(tmp_path):
+    calc = CALCULATOR('unused.xlsx', str(tmp_path / 'out.xlsx'))
+    x = gtc.ureal(1.0, 0.1, label='x')
+    y = gtc.ureal(2.0, 0.2, label='y')
+    results = [gtc.result(x + y, label='sum'), gtc.result(x * y, label='sum'), gtc.result(x - y, label='a/b')]
+    block = calc.budget_table(results, 0, per_sheet=True)
+    assert block == [row for q in results for row in calc.budget_rows(q, 0)]
+    wb = openpyxl.load_workbook(calc.output)
+    assert wb.sheetnames == ['sum', 'sum_1', 'a_b']
+    for title, q in zip(wb.sheetnames, results):
+        ws = wb[title]
+        assert [ws['A2'].value, ws['B2'].value] == ['Name', q.label]
+        assert sorted([ws.cell(row=r, column=1).value for r in [5, 6]]) == ['x', 'y']
+
+
+def test_budget_table_in_session(tmp_path):
+    calc = CALCULATOR('unused.xlsx', str(tmp_path / 'out.xlsx'))
+    q = gtc.result(gtc.ureal(1.0, 0.1, label='x') * 2, label='twice')
+    with calc.report_session() as report:
+        report.add_sheet('results', [[1, 2]])
+        calc.budget_table([q], 0, session=report)
+        calc.budget_table([q], 0, per_sheet=True, session=report)
+        assert not os.path.exists(calc.output)  # written when the session closes
+    wb = openpyxl.load_workbook(calc.output)
+    assert wb.sheetnames == ['results', 'uncertainties', 'twice']
+    assert [c.value for c in wb['uncertainties'][2]] == ['Name', 'twice']
+    assert wb['twice']['A5'].value == 'x'
+
+
+def test_report_session_saves_once(tmp_path, monkeypatch):
+    calc = CALCULATOR('unused.xlsx', str(tmp_path / 'out.xlsx'))
+    writes = []
+    write_sheets = calc.write_sheets
+    monkeypatch.setattr(calc, 'write_sheets', lambda sheets: writes.append(len(sheets)) or write_sheets(sheets))
+    with calc.report_session() as report:
+        assert report.add_sheet('a', [[1]]) == 'a'
+        assert report.add_sheet('a', [[2]]) == 'a_1'
+        report.add_sheet('b', ([i] for i in range(3)))
+    assert writes == [3]
+    wb = openpyxl.load_workbook(calc.output)
+    assert wb.sheetnames == ['a', 'a_1', 'b']
+    assert [wb['b'].cell(row=r, column=1).value for r in [2, 3, 4]] == [0, 1, 2]
+
+
+def test_report_session_not_saved_on_exception(tmp_path, monkeypatch):
+    calc = CALCULATOR('unused.xlsx', str(tmp_path / 'out.xlsx'))
+    writes = []
+    monkeypatch.setattr(calc, 'write_sheets', lambda sheets: writes.append(len(sheets)))
+    with pytest.raises(ValueError):
+        with calc.report_session() as report:
+            report.add_sheet('a', [[1]])
+            raise ValueError('failed run')
+    assert writes == []
+    assert not os.path.exists(calc.output)
+
+
+def test_makeworkbook_takes_any_iterable_rows(tmp_path):
+    calc = CALCULATOR('unused.xlsx', str(tmp_path / 'out.xlsx'))
+    rows = [np.array([1.5, 2.5]), (x * 2 for x in range(3)), (7, 'text'), [None, 8]]
+    calc.makeworkbook((row for row in rows), 'mixed')
+    ws = openpyxl.load_workbook(calc.output)['mixed']
+    assert [[c for c in row] for row in ws.iter_rows(min_row=2, values_only=True)] == \
+           [[1.5, 2.5, None], [0, 2, 4], [7, 'text', None], [None, 8, None]]
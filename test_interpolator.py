@@ -0,0 +1,61 @@
+from __future__ import division
+"""
+Checks of ExcitationInterpolator: the fifth-excitation interpolation of the 2018 buildup against the hand-written
+one it replaced, and the functions each mode reproduces exactly. Run with pytest from this directory.
+"""
+import os
+import numpy as np
+from recipe import RECIPE
+from interpolator import ExcitationInterpolator
+
+here = os.path.dirname(os.path.abspath(__file__))
+excitation = [125, 120, 100, 60, 40, 20, 10, 5, 1]
+
+
+def old_one_fifth(calrun, e_orig, exc_orig):
+    """
+    TWOSTAGE.one_fifth as it was written out point by point, before ExcitationInterpolator.
+    """
+    exc_new = [exc / 5.0 for exc in exc_orig]
+    pairs = [(4, 5), (4, 5), (5, 6), (5, 6), (6, 7), (7, 8), (7, 8), (7, 8), (7, 8)]  # points used for each level
+    e_fifth = []
+    for (a, b), x in zip(pairs, exc_new):
+        e_fifth.append(calrun.interp(exc_orig[a], exc_orig[b], e_orig[a].real, e_orig[b].real, x)
+                       + 1j * calrun.interp(exc_orig[a], exc_orig[b], e_orig[a].imag, e_orig[b].imag, x))
+    return e_fifth
+
+
+def test_one_fifth_of_2018_buildup(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    plan = RECIPE('buildup_2018.json')
+    build, results = plan.run(cache_dir=str(tmp_path))
+    assert build.target_excitation == excitation
+    for name in ['t1', 't3', 't7']:
+        e = results[name]
+        new = ExcitationInterpolator(excitation, factor=5.0).interpolate(e)
+        for a, b in zip(new, old_one_fifth(build.calrun, e, excitation)):
+            for x, y in [(a.real, b.real), (a.imag, b.imag)]:
+                assert np.isclose(x.x, y.x, rtol=1e-12, atol=1e-15)
+                assert np.isclose(x.u, y.u, rtol=1e-12, atol=0)
+
+
+def test_modes_reproduce_their_functions():
+    targets = [1.5, 3, 7, 15, 30, 50, 80, 110, 124]
+    x = np.array(excitation, dtype=float)
+    cubic = lambda t: 0.01 + 0.002 * np.log(t) - 0.003 * np.log(t) ** 2 + 0.0004 * np.log(t) ** 3
+    logline = lambda t: 0.02 - 0.0001 * t + 0.005 * np.log(t)
+    line = lambda t: 0.03 - 0.0002 * t
+    for mode, f in [('spline', cubic), ('logline', logline), ('linear', line)]:
+        interpolator = ExcitationInterpolator(excitation, targets, mode=mode)
+        assert np.allclose(interpolator.weights.sum(axis=1), 1, rtol=0, atol=1e-12)
+        assert np.allclose(interpolator.interpolate(f(x)), f(np.array(targets)), rtol=1e-9, atol=1e-12)
+        assert np.allclose(interpolator.interpolate(list(f(x))), f(np.array(targets)), rtol=1e-9, atol=1e-12)
+        # the points themselves are returned unchanged
+        assert np.allclose(ExcitationInterpolator(excitation, mode=mode).interpolate(f(x)), f(x), rtol=1e-12,
+                           atol=1e-15)
+
+
+def test_logline_uses_nearest_points():
+    interpolator = ExcitationInterpolator(excitation, [22, 55, 0.5], mode='logline')
+    used = [sorted(np.array(excitation)[np.flatnonzero(w)].tolist()) for w in interpolator.weights]
+    assert used == [[10, 20, 40], [20, 40, 60], [1, 5, 10]]
@@ -0,0 +1,102 @@
+from __future__ import division
+"""
+Checks of the circuit model fits, burden corrections and error surface of modelCT. Run with pytest from this directory.
+"""
+import numpy as np
+import pytest
+import GTC
+from modelCT import CT, LeakageFitter, CTErrorSurface
+
+core = [11.72, -0.02738, 29.74, 3.903, 0.0002437, 5.854]
+points = np.array([5, 10, 20, 40, 60, 100, 120.0])
+
+
+def test_leakage_fit_of_noisy_data():
+    ct = CT(core)
+    zs = 0.0269 - 0.0008j
+    noise = 0.001  # %
+    fits = []
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        fitter = LeakageFitter(ct)
+        for burden in [0.1 + 0.0j, 0.2 + 0.05j, 0.4 + 0.1j, 0.8 + 0.2j]:
+            e = fitter.partials(ct, zs, burden, points)[0]
+            fitter.add(burden, points, e.real + rng.normal(0, noise, len(points)),
+                       e.imag + rng.normal(0, noise, len(points)), noise)
+        q = fitter.fit()
+        assert isinstance(q, GTC.lib.UncertainComplex)
+        assert abs(q.x.real - zs.real) < 4 * q.real.u
+        assert abs(q.x.imag - zs.imag) < 4 * q.imag.u
+        fits.append((q.x, q.real.u, q.imag.u))
+    x = np.array([f[0] for f in fits])
+    # the spread of the fits over the seeds agrees with the uncertainty each fit reports
+    assert 0.6 < np.std(x.real) / np.mean([f[1] for f in fits]) < 1.6
+    assert 0.6 < np.std(x.imag) / np.mean([f[2] for f in fits]) < 1.6
+
+
+def test_burden_corrections_match_each_dataset():
+    ct = CT(core)
+    z = 0.0269 - 0.0008j
+    rng = np.random.default_rng(1)
+    datasets = []
+    for nominal, measured, n in [(0.2, 0.21 + 0.01j, 7), (0.4 + 0.1j, 0.38 + 0.12j, 3), (0.8, 0.8, 5),
+                                 (0.1 + 0.05j, 0.15, 1)]:
+        datasets.append((nominal, measured, points[:n], rng.normal(0, 0.01, n), rng.normal(0, 0.01, n)))
+    batch = ct.burden_corrections(z, datasets)
+    assert len(batch) == len(datasets)
+    for d, (error, phase) in zip(datasets, batch):
+        single = ct.burden_correction_z(d[0], z, d[1], d[2], d[3], d[4])
+        assert np.allclose(error, single[0], rtol=1e-12, atol=0)
+        assert np.allclose(phase, single[1], rtol=1e-12, atol=0)
+
+
+def error_surface():
+    ct = CT(core)
+    z = 0.0269 - 0.0008j
+    surface = CTErrorSurface(ct, z, [5, 10, 20, 40, 60, 100, 120], [0.1, 0.2, 0.4, 0.8], [0, 0.2, 0.4, 0.6],
+                             (45, 50, 55, 60))
+    return ct, z, surface
+
+
+def test_error_surface_bound():
+    ct, z, surface = error_surface()
+    assert surface.bound['cubic'] < surface.bound['linear']
+    rng = np.random.default_rng(0)
+    n = 200
+    excite = np.exp(rng.uniform(np.log(5), np.log(120), n))
+    burden = rng.uniform(0.1, 0.8, n) * np.exp(1j * rng.uniform(0, 0.6, n))
+    frequency = rng.uniform(45, 60, n)
+    exact = np.array([ct.error_surface(excite[i], z, burden[i], frequency[i]).ravel()[0] for i in range(n)])
+    for method in ['linear', 'cubic']:
+        # the bound is estimated at the centres of the cells, so is not strict elsewhere
+        assert np.abs(surface.error(excite, burden, frequency, method) - exact).max() < 2 * surface.bound[method]
+        # at the grid points the calculated errors are returned
+        assert np.allclose(surface.error(20, 0.4 * np.exp(0.2j), 55, method),
+                           ct.error_surface(20, z, 0.4 * np.exp(0.2j), 55).ravel()[0], rtol=1e-9, atol=0)
+
+
+def test_error_surface_outside_the_grid():
+    ct, z, surface = error_surface()
+    surface.error(np.array([5, 120]), 0.8 * np.exp(0.6j), 60)  # the ends of the grid are within it
+    with pytest.raises(AssertionError, match='excitation'):
+        surface.error(130, 0.2, 50)
+    with pytest.raises(AssertionError, match='magnitude'):
+        surface.error(20, 0.05, 50, 'cubic')
+    with pytest.raises(AssertionError, match='phase'):
+        surface.error(20, 0.2 * np.exp(-0.1j), 50)
+    with pytest.raises(AssertionError, match='frequency'):
+        surface.error(20, 0.2, np.array([50, 65]))
+
+
+def test_error_surface_save_and_load(tmp_path):
+    ct, z, surface = error_surface()
+    filename = str(tmp_path / 'surface')
+    surface.save(filename)
+    loaded = CTErrorSurface.load(filename)
+    assert isinstance(loaded.table, np.memmap)
+    assert loaded.bound == surface.bound
+    excite = np.array([7.5, 33.0, 110.0])
+    burden = np.array([0.15, 0.3 + 0.1j, 0.7 * np.exp(0.5j)])
+    for method in ['linear', 'cubic']:
+        assert np.array_equal(loaded.error(excite, burden, 52.0, method), surface.error(excite, burden, 52.0, method))
+    assert isinstance(CTErrorSurface.load(filename, None).table, np.ndarray)
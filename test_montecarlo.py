@@ -0,0 +1,46 @@
+from __future__ import division
+"""
+Checks of the Monte Carlo evaluations against the first-order propagation done by GTC. Run with pytest from this
+directory, which holds the recipe and the workbooks it reads.
+"""
+import os
+import numpy as np
+import GTC as gtc
+from recipe import RECIPE
+from modelCT import CT
+from montecarlo import MONTECARLO, CTMONTECARLO
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_buildup_normal_inputs_agree_with_gtc(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    plan = RECIPE('buildup_2018.json')
+    build, results = plan.run(cache_dir=str(tmp_path))
+    mc = MONTECARLO(plan, trials=40000, chunk=10000, seed=1)
+    mc.run(build)
+    rows = np.array([row[3:] for row in mc.rows(results, build.target_excitation)[1:]], dtype=float)
+    gtc_u, mc_mean, mc_u = rows[:, 1], rows[:, 5], rows[:, 6]
+    assert np.allclose(mc_u / gtc_u, 1.0, atol=0.03)
+    assert np.all(np.abs(mc_mean - rows[:, 0]) < 0.05 * gtc_u)
+
+
+def test_capacitive_burden_agrees_with_ct_error():
+    ct = CT([11.72, -0.02738, 29.74, 3.903, 0.0002437, 5.854])
+    zs = 0.02688 - 8.07e-5j
+    isec = 5.0
+    z = 0.2 - 0.1j
+    va, pf = ct.burdenZ(z, isec)
+    assert pf < 0  # capacitive
+    burden = (gtc.ureal(va, 0.01 * va), gtc.ureal(pf, 0.002))
+    excitation = [5, 20, 100]
+    mc = CTMONTECARLO(ct, zs, [burden], isec, excitation, trials=40000, seed=1)
+    summary = mc.run()['error']
+    expected = ct.error(ct.coreZ(np.array(excitation), 50), zs.real, zs.imag, z)
+    b = ct.burdenVAgtc(burden[0], burden[1], isec)
+    for i, x in enumerate(excitation):
+        e = ct.error_z(ct.coreZgtc(x, 50), zs, b)
+        for j, part in enumerate([e.real, e.imag]):
+            assert abs(gtc.value(part) - [expected[i].real, expected[i].imag][j]) < 1e-12
+            assert abs(summary['mean'][j, i, 0] - gtc.value(part)) < 0.05 * gtc.uncertainty(part)
+            assert abs(summary['u'][j, i, 0] / gtc.uncertainty(part) - 1) < 0.03
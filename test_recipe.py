@@ -0,0 +1,45 @@
+from __future__ import division
+"""
+Checks that remembered results, in memory or in a memo directory, give the same uncertainties as a fresh run when
+the Type B influences are shared. Run with pytest from this directory.
+"""
+import os
+from recipe import RECIPE
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def uncertainties(plan, cache_dir, sr830=None):
+    build = plan.make_buildup(cache_dir)
+    for name in build.calrun.type_b_policy:
+        build.calrun.type_b_policy[name] = 'shared'
+    if sr830 is not None:
+        build.calrun.sr830 = sr830
+    build, results = plan.run(build=build)
+    return [(q.real.u, q.imag.u) for name in ['t7', 't12'] for q in results[name]]
+
+
+def test_memo_with_shared_type_b(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    cache_dir = str(tmp_path / 'cache')
+    fresh = uncertainties(RECIPE('buildup_2018.json'), cache_dir)
+    plan = RECIPE('buildup_2018.json', memo_dir=str(tmp_path / 'memo'))
+    assert uncertainties(plan, cache_dir) == fresh
+    assert uncertainties(plan, cache_dir) == fresh  # another TWOSTAGE takes up the stored influences
+    assert plan.recalculated == []
+    os.remove(plan.memo_path(plan.keys['e1']))
+    for name in ['buildup', 'extra_ratios']:
+        os.remove(plan.memo_path(plan.keys[name]))
+    later = RECIPE('buildup_2018.json', memo_dir=str(tmp_path / 'memo'))
+    assert uncertainties(later, cache_dir) == fresh
+    assert later.recalculated == ['e1', 'buildup', 'extra_ratios']
+
+
+def test_memo_follows_type_b_constants(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    cache_dir = str(tmp_path / 'cache')
+    memo_dir = str(tmp_path / 'memo')
+    remembered = uncertainties(RECIPE('buildup_2018.json', memo_dir=memo_dir), cache_dir)
+    changed = uncertainties(RECIPE('buildup_2018.json', memo_dir=memo_dir), cache_dir, sr830=0.15e-6)
+    assert changed != remembered
+    assert changed == uncertainties(RECIPE('buildup_2018.json'), cache_dir, sr830=0.15e-6)
@@ -0,0 +1,89 @@
+from __future__ import division
+"""
+Checks that the buildup of several frequencies stacked into one ErrorTable gives the values and uncertainties of
+the buildup of each frequency in turn, that each frequency is a step of its own for the 'per-step' Type B
+policy, and the matching of measured excitations to nominal levels. Run with pytest from this directory.
+"""
+import os
+import numpy as np
+import GTC as gtc
+import pytest
+from recipe import RECIPE
+from errortable import stack
+from twostage import TWOSTAGE
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_stacked_frequencies_match_each_frequency(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    plan = RECIPE('buildup_2018.json')
+    build, results = plan.run(cache_dir=str(tmp_path))
+    calrun = build.calrun
+    steps = ['e1', 'e2', 'e3', 'e4', 'e5a', 'e5b']
+    errors = {}
+    for name in steps:
+        node = plan.nodes[name]
+        block = node['error_blocks'][0]  # measured twice over, standing in for two frequencies
+        e, exc, nom = build.step(node['sign_block'], [block, block], node['settings'], table=True)
+        errors[name] = [x * node.get('polarity', 1) for x in e]
+    capacitance = {}
+    for hz in [53.0, 47.0]:
+        for name in ['cap_errora', 'cap_errorb']:
+            node = dict(plan.nodes[name], frequency=hz)
+            capacitance[name, hz] = calrun.newcapsp(*plan.capacitance_arguments(node))[0]
+    magnetic = [results[name] for name in ['magnetic1a', 'magnetic2a', 'magnetic3a', 'magnetic1b', 'magnetic2b']]
+    stacked = calrun.buildup(None, *([stack(errors[name]) for name in steps] + magnetic +
+                                     [[capacitance['cap_errora', hz] for hz in [53.0, 47.0]],
+                                      [capacitance['cap_errorb', hz] for hz in [53.0, 47.0]]]))
+    for i, hz in enumerate([53.0, 47.0]):
+        single = calrun.buildup(None, *([errors[name][i] for name in steps] + magnetic +
+                                        [capacitance['cap_errora', hz], capacitance['cap_errorb', hz]]))
+        for a, b in zip(stacked, single):
+            a = a.split(2)[i]
+            assert np.allclose(a.value(), b.value(), rtol=1e-12, atol=0)
+            for x, y in zip(a.u() + a.dof(), b.u() + b.dof()):
+                assert np.allclose(x, y, rtol=1e-12, atol=0)
+
+
+def test_per_step_frequencies(tmp_path, monkeypatch):
+    monkeypatch.chdir(here)
+    plan = RECIPE('buildup_2018.json')
+    build = plan.make_buildup(str(tmp_path))
+    for name in ['sr830', 'cmnmode']:
+        build.calrun.type_b_policy[name] = 'per-step'
+    node = plan.nodes['e1']
+    block = node['error_blocks'][0]  # measured twice over, standing in for two frequencies
+    for table in [False, True]:
+        e, exc, nom = build.step(node['sign_block'], [block, block], node['settings'], table=table)
+        if table:
+            e = [x.to_gtc() for x in e]
+        for freq in e:  # the points of a frequency share its sr830 and common mode influences
+            assert gtc.get_correlation(freq[0].real, freq[1].real) != 0
+        for a, b in zip(e[0], e[1]):  # but the frequencies share none
+            assert gtc.get_correlation(a.real, b.real) == 0
+            assert gtc.get_correlation(a.imag, b.imag) == 0
+
+
+def test_nominal_match():
+    calrun = TWOSTAGE()
+    levels = [120, 100, 60, 40, 20, 10, 5]  # not sorted, as in the recipes
+    excite = [4.0, 5.2, 7.5, 15.0, 30, 50, 80, 99.9, 110, 130, 0.1]
+    # the first closest level, as a scan of the whole list with min() gives
+    expected = [min(levels, key=lambda x: abs(x - e)) for e in excite]
+    assert calrun.nominal_match(excite, levels) == expected
+    assert calrun.nominal_match([15.0, 30, 50], [10, 20, 40, 60]) == [10, 20, 40]  # ties go to the earlier level
+    assert calrun.nominal_match([15.0, 30, 50], [60, 40, 20, 10]) == [20, 40, 60]
+    assert calrun.nominal_match([0.0, 500], levels) == [5, 120]  # outside the range, the end levels
+    assert calrun.nominal_match([10, 10, 10], [10, 10, 10]) == [10, 10, 10]
+    assert calrun.nominal_match([], levels) == []
+
+
+def test_nominal_match_tolerance():
+    calrun = TWOSTAGE()
+    levels = [5, 10, 20, 40, 60, 100, 120]
+    assert calrun.nominal_match([5.4, 19.5, 120.5], levels, tolerance=0.5) == [5, 20, 120]
+    with pytest.raises(AssertionError, match='30'):
+        calrun.nominal_match([19.5, 30], levels, tolerance=0.5)
+    with pytest.raises(AssertionError):
+        calrun.nominal_match([121], levels, tolerance=0.5)  # beyond the highest level
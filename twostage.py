@@ -1,8 +1,13 @@
 from __future__ import division
 from __future__ import print_function
+import itertools
 import math
+import numpy as np
+from scipy import sparse
 import GTC as gtc
 from ExcelPython import CALCULATOR
+from errortable import Influences, ErrorTable
+from interpolator import ExcitationInterpolator
 
 
 class TWOSTAGE(object):
@@ -13,7 +18,8 @@ class TWOSTAGE(object):
     Type B uncertainty terms are collected in the __init__ process. In general it is assumed that these are of a variable
     nature and should be created as new GTC uncertain numbers at each use. For example, subtracting two SR830 readings
     (i.e. the buildup calculation) would see the type B terms for gain disappear, or diminish, but in reality the
-    readings may be taken on different ranges.
+    readings may be taken on different ranges. The policy for each term can be changed in type_b_policy, so that one
+    uncertain number is shared by all uses of the term, or by all points of a step.
 
     Type A information is gathered from the experimental data.
     """
@@ -26,6 +32,7 @@ class TWOSTAGE(object):
     # TODO additional uncertainties for input data such as meter and resistor calibration.
 
     def __init__(self):
+        self.df_readings = 100  # degrees of freedom of the Type A standard deviations of the voltage readings.
         # taken from uncert_summary sheet of Ctcal32012.xlsm
         self.ct_x_stability = 0.017e-6  # Short-term stability of the real part of the CT ratio.
         self.df_ct_x_stability = 15
@@ -55,6 +62,126 @@ class TWOSTAGE(object):
         self.df_brdn1b = 5
         self.brdn2b = delta_r / (r2 + z2)  # effect on the ratio 0.005 ohm burden uncertainty with 0.2 ohm auxiliary burden.
         self.df_brdn2b = 5
+        self.influences = Influences()  # elementary influences of the error tables made by this instance
+        # How the Type B terms above become uncertain numbers:
+        # 'per-point' a new one at every use, e.g. at every excitation point of every ratio (the original behaviour)
+        # 'per-step' one for each step, e.g. a ratio of the buildup or a block of readings, labelled name_step
+        # 'shared' one for all uses, labelled with the name of the term
+        self.type_b_policy = {'ct_stability': 'per-point', 'sr830': 'per-point', 'cmnmode': 'per-point',
+                              'sp_mag': 'per-point', 'sp_cap': 'per-point', 'brdn1a': 'per-point',
+                              'brdn2a': 'per-point', 'brdn1b': 'per-point', 'brdn2b': 'per-point'}
+        # The shape of the distribution of each Type B term, for Monte Carlo evaluation: 'normal', or 'rectangular'
+        # with the half-width sqrt(3) times the standard uncertainty above
+        self.type_b_shape = {'ct_stability': 'normal', 'sr830': 'normal', 'cmnmode': 'normal', 'sp_mag': 'normal',
+                             'sp_cap': 'normal', 'brdn1a': 'normal', 'brdn2a': 'normal', 'brdn1b': 'normal',
+                             'brdn2b': 'normal'}
+        self.type_b_made = {}  # shared and per-step uncertain numbers (or ErrorTable keys) already made
+        self.type_b_steps = itertools.count()  # numbers the steps that are not named by the caller
+
+    def step_name(self, step):
+        """
+        :param step: name of a step, or None
+        :return: the name, or a new name for an unnamed step, e.g. a block of readings passed to ctcompare
+        """
+        if step is None:
+            step = 'step ' + repr(next(self.type_b_steps))
+        return step
+
+    def type_b_constants(self):
+        """
+        :return: dictionary of (standard uncertainty, degrees of freedom) of each Type B term, keyed as in
+         type_b_policy; the uncertainty of 'ct_stability' is a (real, imaginary) pair
+        """
+        terms = {}
+        for name in self.type_b_policy:
+            if name == 'ct_stability':
+                terms[name] = ((self.ct_x_stability, self.ct_y_stability), self.df_ct_x_stability)
+            else:
+                terms[name] = (getattr(self, name), getattr(self, 'df_' + name))
+        return terms
+
+    def make_type_b(self, name, value, labels, table):
+        """
+        Creates new uncertain numbers, or influences in self.influences, for the Type B term name.
+
+        :return: a list of uncertain numbers, or an array of keys, one for each label
+        """
+        if name == 'ct_stability':  # complex, with separate real and imaginary terms
+            u = (self.ct_x_stability, self.ct_y_stability)
+            df = self.df_ct_x_stability
+            if table:
+                return self.influences.extend_complex(value, u, df, labels)
+            return [gtc.ucomplex(value, u, df, label=label) for label in labels]
+        u = getattr(self, name)
+        df = getattr(self, 'df_' + name)
+        if table:
+            return self.influences.extend(value, u, df, labels)
+        return [gtc.ureal(value, u, df, label=label) for label in labels]
+
+    def type_b_shared(self, name, step, part, table):
+        """
+        :return: the key in type_b_made and the label of the influence of the term name for the step, or None if
+         a new influence is made at every use
+        """
+        policy = self.type_b_policy[name]
+        assert policy in ['per-point', 'per-step', 'shared'], 'unknown Type B policy ' + repr(policy)
+        if policy == 'per-point':
+            return None
+        if policy == 'shared':
+            return (name, part, table), name + part
+        assert step is not None, 'a step is needed for the per-step policy of ' + name
+        return (name, part, step, table), name + part + '_' + step
+
+    def type_b(self, name, value, label, step=None, part=''):
+        """
+        Returns the Type B influence for one of the terms set in __init__, according to its type_b_policy.
+
+        :param name: name of the term, e.g. 'sr830' or 'ct_stability'
+        :param value: value of the influence, e.g. 1.0 for a factor or 0.0 for an offset
+        :param label: label used when a new influence is made at every use
+        :param step: name of the step the influence is used in, needed for the 'per-step' policy
+        :param part: distinguishes separate influences of the same term, e.g. '_x' and '_y' for the two SR830 readings
+        :return: a ureal, or a ucomplex for 'ct_stability'
+        """
+        shared = self.type_b_shared(name, step, part, False)
+        if shared is None:
+            return self.make_type_b(name, value, [label], False)[0]
+        made, label = shared
+        if made not in self.type_b_made:
+            self.type_b_made[made] = self.make_type_b(name, value, [label], False)[0]
+        return self.type_b_made[made]
+
+    def type_b_list(self, name, value, n, labels, step=None, part=''):
+        """
+        As type_b, for n points at once. The labels are only read when a new influence is made at every use, so they
+        may be given lazily, e.g. as a generator. The step may also be a list of the step of each point.
+
+        :return: list of n uncertain numbers
+        """
+        if isinstance(step, list) and self.type_b_policy[name] != 'per-point':
+            return [self.type_b(name, value, None, s, part) for s in step]
+        shared = self.type_b_shared(name, step, part, False)
+        if shared is None:
+            return self.make_type_b(name, value, list(labels), False)
+        return [self.type_b(name, value, None, step, part)] * n
+
+    def type_b_keys(self, name, value, labels, step=None, part=''):
+        """
+        As type_b, for an ErrorTable with a point for each label. The step may also be a list of the step of each
+        point.
+
+        :return: array of the keys in self.influences at each point, or of (real, imaginary) keys for 'ct_stability'
+        """
+        if isinstance(step, list) and self.type_b_policy[name] != 'per-point':
+            return np.array([self.type_b_keys(name, value, [None], s, part)[0] for s in step])
+        shared = self.type_b_shared(name, step, part, True)
+        if shared is None:
+            return self.make_type_b(name, value, labels, True)
+        made, label = shared
+        if made not in self.type_b_made:
+            self.type_b_made[made] = self.make_type_b(name, value, [label], True)[0]
+        return np.repeat([self.type_b_made[made]], len(labels), axis=0)
+
     def ishare(self, ratio, Rs, rls, vdrop, i2, target_i2, individual):
         """
         Calculates the share of current in each primary in parallel using measurements of voltage across
@@ -129,7 +256,7 @@ class TWOSTAGE(object):
             coupling.append(iratio)
         return coupling
 
-    def magneticsp(self, couple, share, uut_ratio):
+    def magneticsp(self, couple, share, uut_ratio, step=None):
         """
         Calculates the series error minus the parallel error for a set of primary windings due to magnetic
         coupling differences between the windings. Note that the way coupling was measured forces the first couple
@@ -138,9 +265,25 @@ class TWOSTAGE(object):
         :param couple: list of k-1 mutual couplings for k primary windings
         :param share: list of fractional share of current for k primary windings in parallel
         :param uut_ratio: list [k, m, n] of windings for transformer
+        :param step: optional name of the step, for the 'per-step' policy of sp_mag
         :return: two complex errors, no scaling to % or ppm
         """
 
+        step = self.step_name(step)
+        merror, sp_merror = self.magneticsp_value(couple, share, uut_ratio)
+        if len(share) == 4:  # series/parallel available on Ta primaries
+            sp_merror = sp_merror * self.type_b('sp_mag', 1.0, 's_sp_mag', step, '_s')  # type B factor
+        merror = merror * self.type_b('sp_mag', 1.0, 'sp_mag', step)  # type B factor
+
+        return merror, sp_merror
+
+    def magneticsp_value(self, couple, share, uut_ratio):
+        """
+        magneticsp without the Type B factors. The couplings may be numbers, uncertain numbers or arrays, e.g. of
+        Monte Carlo trials.
+
+        :return: two complex errors, no scaling to % or ppm
+        """
         assert len(share) - len(couple) == 1, "sharing list should be one longer than coupling list"
         k = len(share)
         N = uut_ratio[2]/(uut_ratio[0] * uut_ratio[1])
@@ -157,7 +300,6 @@ class TWOSTAGE(object):
             for i in range(1, k):  # the first element of share would have been multiplied by zero, so not needed
                 sp_merror = couple[i - 1] * (sp_share[i]-1) + sp_merror
             sp_merror = N * sp_merror  # the sign of this is as derived in section A3 of E056.005, relies on aj defn
-            sp_merror = sp_merror * gtc.ureal(1.0, self.sp_mag, self.df_sp_mag, label='s_sp_mag')  # type B factor
         else:
             sp_merror = 0  #i.e. there is no series/paralle connection
 
@@ -165,8 +307,6 @@ class TWOSTAGE(object):
         for i in range(1, k):  # the first element of share would have been multiplied by zero, so not needed
             merror = couple[i - 1] * (share[i] - 1) + merror
         merror = N * merror  #the sign of this is as derived in section A3 of E056.005 and depends on aj measurement
-        merror = merror * gtc.ureal(1.0, self.sp_mag, self.df_sp_mag, label='sp_mag')  # type B factor
-
         return merror, sp_merror
 
     def oldcapsp(self, ypg, k, z4, r2, z2, uut_ratio):
@@ -188,7 +328,7 @@ class TWOSTAGE(object):
         s_p_error = s_p_error * gtc.ureal(1.0, self.sp_cap, self.df_sp_cap, label = 'sp_cap')  # type B factor
         return s_p_error
 
-    def newcapsp(self, ypg, z, r2, z2, uut_ratio):
+    def newcapsp(self, ypg, z, r2, z2, uut_ratio, step=None):
         """
         Calculates the parallel error minus the series error for a set of primary windings due to the change
         in potential distribution across the distributed capacitance from the primary windings to the screen.
@@ -200,26 +340,133 @@ class TWOSTAGE(object):
         :param r2: the secondary burden impedance
         :param z2: leakage impedance of the secondary winding
         :param uut_ratio: [k, m, n] is the ratio windings of the uut
+        :param step: optional name of the step, for the 'per-step' policy of sp_cap
+        :return: (parallel-series) error, (series/parallel - series) erro
+        """
+        step = self.step_name(step)
+        s_p_error, sp_s_error = self.newcapsp_value(ypg, z, r2, z2, uut_ratio)
+        s_p_error = s_p_error * self.type_b('sp_cap', 1.0, 'sp_cap', step)  # type B factor
+        if uut_ratio[0] == 4:
+            sp_s_error = sp_s_error * self.type_b('sp_cap', 1.0, 'sp_s_cap', step, '_s')  # type B factor
+        return s_p_error, sp_s_error
+
+    def newcapsp_value(self, ypg, z, r2, z2, uut_ratio):
+        """
+        newcapsp without the Type B factors.
+
         :return: (parallel-series) error, (series/parallel - series) erro
         """
         k = uut_ratio[0]
         m = uut_ratio[1]
         n = uut_ratio[2]
         s_p_error = ypg / 3 *(k**2 - 1) * ((r2 + z2) * (m/n) ** 2 + z)
-        s_p_error = s_p_error * gtc.ureal(1.0, self.sp_cap, self.df_sp_cap, label='sp_cap')  # type B factor
 
         if k == 4:  # 4 sections in series/parallel possible, note relies on exact integer ... isclose() needed?
             g = 2
             sp_s_error = ypg / 3 * (k ** 2 - g**2) * ((r2 + z2) * (m / n) ** 2 + z)
-            sp_s_error = sp_s_error * gtc.ureal(1.0, self.sp_cap, self.df_sp_cap, label='sp_s_cap')  # type B factor
         else:
             sp_s_error =0
         return s_p_error, sp_s_error
 
 
-    def ratioerror(self, shuntv, xv, yv, shunt, comr, nomexcitation, full_scale):
+    def nominal_match(self, excite, nomexcitation, tolerance=None):
+        """
+        Maps measured excitation levels to the closest nominal level in one pass, using a binary search of the sorted
+        nominal levels rather than a scan of the whole list for each measurement. Where a measurement is equally
+        close to two levels the one earlier in nomexcitation is chosen, as min() would.
+
+        :param excite: list or array of measured % excitation levels
+        :param nomexcitation: nominal excitation list, e.g. 10%, 20% ... 120%, in any order
+        :param tolerance: optional largest allowed distance, in %, from a measured level to its nominal level
+        :return: list of the matching nominal excitations
+        """
+        excite = np.asarray(excite, dtype=float)
+        levels, first = np.unique(np.asarray(nomexcitation, dtype=float), return_index=True)  # sorted, first positions
+        upper = np.clip(np.searchsorted(levels, excite), 0, len(levels) - 1)  # first level at or above excite
+        lower = np.clip(upper - 1, 0, len(levels) - 1)
+        to_lower = np.abs(excite - levels[lower])
+        to_upper = np.abs(levels[upper] - excite)
+        take_lower = (to_lower < to_upper) | ((to_lower == to_upper) & (first[lower] <= first[upper]))
+        nearest = np.where(take_lower, lower, upper)
+        if tolerance is not None:
+            distance = np.minimum(to_lower, to_upper)
+            assert np.all(distance <= tolerance), 'excitation ' + repr(excite[distance > tolerance].tolist()) + \
+                                                  ' % is more than ' + repr(tolerance) + ' % from every nominal level'
+        return [nomexcitation[first[j]] for j in nearest]
+
+    def ratioerror_array(self, shuntv, xv, yv, shunt, comr, nomexcitation, full_scale, tolerance=None):
         """
-        Calculates the measured ratio error. All parameters are lists of data from
+        Numerical core of ratioerror, working on whole blocks of plain numbers at once. No uncertain numbers are
+        created; instead the first-order sensitivity of each complex error to every input is returned so that
+        uncertainty can be attached afterwards, and only where it is wanted.
+
+        :param shuntv: array of voltages measured across the shunt on the secondary monitoring the primary current
+        :param xv: array of the real part of voltage across the common resistor
+        :param yv: array of the imaginary part of the voltage across the common resistor
+        :param shunt: value, or array of values, of the secondary shunt
+        :param comr: value, or array of values, of the common resistor
+        :param nomexcitation: nominal excitation list, e.g. 10%, 20% ... 120%
+        :param full_scale: the value of current, A, that equates to 100% excitation
+        :param tolerance: optional largest allowed distance, in %, between measured and nominal excitation
+        :return: complex error array, excitation array, list of matching nominal excitations and a dictionary of
+         complex sensitivity arrays keyed on 'shuntv', 'xv', 'yv', 'sr830 x', 'sr830 y', 'common mode x' and
+         'common mode y'
+        """
+        shuntv = np.asarray(shuntv, dtype=float)
+        xv = np.asarray(xv, dtype=float)
+        yv = np.asarray(yv, dtype=float)
+        shunt = np.asarray(shunt, dtype=float)
+        comr = np.asarray(comr, dtype=float)
+
+        current = shuntv / shunt  # primary =  secondary current
+        g = shunt / (comr * shuntv)  # error per volt across the common resistor
+        e = self.ratio_value(shuntv, xv, yv, shunt, comr)
+        excite = current / full_scale * 100
+
+        nom_excite = self.nominal_match(excite, nomexcitation, tolerance)
+
+        sensitivity = {}
+        sensitivity['shuntv'] = -e / shuntv
+        sensitivity['xv'] = g + 0j
+        sensitivity['yv'] = 1j * g
+        sensitivity['sr830 x'] = xv * g + 0j  # sr830 terms are unit gain factors on the X and Y readings
+        sensitivity['sr830 y'] = 1j * yv * g
+        sensitivity['common mode x'] = g + 0j  # common mode terms are offsets added to the X and Y readings
+        sensitivity['common mode y'] = 1j * g
+        return e, excite, nom_excite, sensitivity
+
+    def ratio_value(self, shuntv, xv, yv, shunt, comr):
+        """
+        The measurement equation of ratioerror, for numbers or arrays of any shape that broadcast together.
+
+        :return: complex ratio error
+        """
+        return (xv + 1j * yv) * (shunt / (comr * shuntv))
+
+    def linear_uncertain(self, value, terms):
+        """
+        Attaches uncertainty to a complex value from its first-order sensitivities. The result has the same value and
+        uncertainty components as if the measurement equation had been evaluated with the uncertain numbers directly.
+
+        :param value: complex value of the result
+        :param terms: list of (sensitivity, uncertain real) pairs, the sensitivity being complex
+        :return: a ucomplex
+        """
+        real = value.real
+        imag = value.imag
+        for s, q in terms:
+            dq = q - q.x  # zero valued, carries all the components of q
+            if s.real != 0:
+                real = real + s.real * dq
+            if s.imag != 0:
+                imag = imag + s.imag * dq
+        return real + 1j * imag
+
+    def ratioerror(self, shuntv, xv, yv, shunt, comr, nomexcitation, full_scale, tolerance=None, step=None):
+        """
+        Calculates the measured ratio error. All parameters are lists of data from the block passed to ctcompare.
+        The values are calculated for all rows at once by ratioerror_array and the Type B terms are then attached
+        through the returned sensitivities.
 
         :param shuntv: shuntv: voltage measured across the shunt on the secondary monitoring the primary current
         :param xv: xv: real part of voltage across the common resistor
@@ -227,28 +474,67 @@ class TWOSTAGE(object):
         :param shunt: value of the secondary shunt
         :param comr: value of the common resistor
         :param nomexcitation: nominal excitation list, e.g. 10%, 20% ... 120%
+        :param tolerance: optional largest allowed distance, in %, between measured and nominal excitation
+        :param step: optional name of the step, or a list of the step of each row, for the 'per-step' policy of sr830
+         and cmnmode
         :return: a list of errors, a list of actual excitation levels and a list of the matching nominal excitations
         """
 
+        step = self.step_name(step)
         # TODO consider a 'swap' flag for where the nominal reference ratio was actually on the UUT side
-        e = []  # list of error e1 at each excitation level
-        excite = []  # matching list of fractional excitation level
-        nom_excite = []  # matched nominal excitation level
-        for i in range(len(xv)):
-            xvolt = xv[i] * gtc.ureal(1.0, self.sr830, self.df_sr830, label = 'sr830 '+ repr(xv[i]))  #type B
-            xvolt = xvolt + gtc.ureal(0.0, self.cmnmode, self.df_cmnmode, label = 'common mode ' + repr(xvolt.x))
-            yvolt = yv[i] * gtc.ureal(1.0, self.sr830, self.df_sr830, label='sr830 '+ repr(yv[i]))  # type B
-            yvolt = yvolt + gtc.ureal(0.0, self.cmnmode, self.df_cmnmode, label='common mode '+ repr(yvolt.x))
-            ecurrent = (xvolt + 1j * yvolt) / comr[i]  # difference current measured by SR830
-            current = shuntv[i] / shunt[i]  # primary =  secondary current
-            e_answer =  gtc.result((ecurrent/current), 'my label')  # key intermiediate result? decide later
-            e.append(e_answer)
-            excite.append(current / full_scale * 100)  # note this is a ureal
-            nom_excite.append(
-                min(nomexcitation, key=lambda x: abs(x - excite[i].x)))  # finds closest nominal excitation level
+        values, excite_values, nom_excite, s = self.ratioerror_array([v.x for v in shuntv], [v.x for v in xv],
+                                                                     [v.x for v in yv], shunt, comr, nomexcitation,
+                                                                     full_scale, tolerance)
+        n = len(xv)
+        # type B terms of the whole block, labelled only when a new one is made for each point
+        sr830_x = self.type_b_list('sr830', 1.0, n, ('sr830 ' + repr(v) for v in xv), step, '_x')
+        cmn_x = self.type_b_list('cmnmode', 0.0, n, ('common mode ' + repr(v.x) for v in xv), step, '_x')
+        sr830_y = self.type_b_list('sr830', 1.0, n, ('sr830 ' + repr(v) for v in yv), step, '_y')
+        cmn_y = self.type_b_list('cmnmode', 0.0, n, ('common mode ' + repr(v.x) for v in yv), step, '_y')
+        names = ['shuntv', 'xv', 'yv', 'sr830 x', 'sr830 y', 'common mode x', 'common mode y']
+        inputs = [shuntv, xv, yv, sr830_x, sr830_y, cmn_x, cmn_y]
+        e = [self.linear_uncertain(values[i], [(s[name][i], q[i]) for name, q in zip(names, inputs)])
+             for i in range(n)]  # list of error e1 at each excitation level
+        excite = [shuntv[i] / shunt[i] / full_scale * 100 for i in range(n)]  # note these are ureals
         return e, excite, nom_excite
 
-    def ctcompare(self, datablock, fullscale, targetexcitation, settings):
+    def ctcompare_table(self, datablock, fullscale, targetexcitation, settings, tolerance=None, step=None):
+        """
+        As ctcompare, but the errors are returned as an ErrorTable rather than a list of uncertain numbers. The
+        influences are those ctcompare would create, with the same labels, so the table gives the same uncertainty
+        budgets when converted with to_gtc.
+
+        :return: an ErrorTable of errors, an array of actual excitation levels and a list of the matching nominal
+         excitations
+        """
+        assert settings in [True, False], "settings must be True for range and gain information, otherwise False"
+        if settings == True:
+            columns = [0, 1, 2, 3, 4, 5, 8, 9]  # values and standard deviations of shunt V, X V, Y V, Shunt, Com R
+        else:
+            columns = [0, 1, 2, 3, 4, 5, 7, 8]
+        values = np.array([[x[c] for c in columns] for x in datablock], dtype=float)
+        e, excite, nom_excite, s = self.ratioerror_array(values[:, 0], values[:, 1], values[:, 2], values[:, 6],
+                                                         values[:, 7], targetexcitation, fullscale, tolerance)
+        step = self.step_name(step)
+        inf = self.influences
+        n = len(datablock)
+        current = [str(i) for i in (values[:, 0] / values[:, 6] / fullscale).tolist()]  # use current as label
+        key_xv = inf.extend(values[:, 1], values[:, 4], self.df_readings, ['X V ' + c for c in current])
+        key_yv = inf.extend(values[:, 2], values[:, 5], self.df_readings, ['Y V ' + c for c in current])
+        key_shuntv = inf.extend(values[:, 0], values[:, 3], self.df_readings, ['shuntv ' + c for c in current])
+        keys = np.column_stack([  # seven influences at each point, in this order
+            key_shuntv, key_xv, key_yv,
+            self.type_b_keys('sr830', 1.0, [('sr830 ', k) for k in key_xv.tolist()], step, '_x'),
+            self.type_b_keys('sr830', 1.0, [('sr830 ', k) for k in key_yv.tolist()], step, '_y'),
+            self.type_b_keys('cmnmode', 0.0, ['common mode ' + repr(v) for v in values[:, 1].tolist()], step, '_x'),
+            self.type_b_keys('cmnmode', 0.0, ['common mode ' + repr(v) for v in values[:, 2].tolist()], step, '_y')])
+        names = ['shuntv', 'xv', 'yv', 'sr830 x', 'sr830 y', 'common mode x', 'common mode y']
+        data = np.column_stack([s[name] for name in names]).ravel()
+        sensitivity = sparse.csr_matrix((data, (np.repeat(np.arange(n), 7), np.arange(7 * n))), shape=(n, 7 * n))
+        return ErrorTable(inf, e, keys.ravel(), sensitivity), excite, nom_excite
+
+    def ctcompare(self, datablock, fullscale, targetexcitation, settings, uncertain=True, tolerance=None,
+                  step=None):
         """
         Takes a set of CT error measurements as a block and returns the calculated ratio errors. Older spread sheets
         did not include gain and reserve settings for the SR830, hence the boolean settings
@@ -257,10 +543,25 @@ class TWOSTAGE(object):
         :param fullscale: the value of current, A, that equates to 100% excitation
         :param targetexcitation: the set of nominal % excitation levels at which measurements were made
         :param settings: a boolean set to True if gain and reserve colunmns available
+        :param uncertain: when False only values are calculated, as arrays, and no uncertain numbers are created
+        :param tolerance: optional largest allowed distance, in %, between measured and nominal excitation
+        :param step: optional name of the step, or a list of the step of each row, for the 'per-step' policy of sr830
+         and cmnmode
         :return: a list of errors, a list of actual excitation levels and a list of the matching nominal excitations
         """
 
         assert settings in [True, False], "settings must be True for range and gain information, otherwise False"
+        if not uncertain:
+            if settings == True:
+                columns = [0, 1, 2, 8, 9]  # shunt volts, X V, Y V, Shunt, Com R
+            else:
+                columns = [0, 1, 2, 7, 8]
+            values = np.array([[x[c] for c in columns] for x in datablock], dtype=float)
+            e, excite, nom_excite, sensitivity = self.ratioerror_array(values[:, 0], values[:, 1], values[:, 2],
+                                                                       values[:, 3], values[:, 4], targetexcitation,
+                                                                       fullscale, tolerance)
+            return e, excite, nom_excite
+
         shuntv = []  # gtc values
         xv = []  # gtc values
         yv = []  # gtc values
@@ -273,21 +574,22 @@ class TWOSTAGE(object):
             if settings == False:
                 shunt.append(x[7])
                 comr.append(x[8])
-                shuntv.append(
-                    gtc.ureal(x[0], x[3], 100, label='shuntv ' + str(x[0] / x[7] / fullscale)))  # use current as label
-                xv.append(gtc.ureal(x[1], x[4], 100, label='X V ' + str(x[0] / x[7] / fullscale)))
-                yv.append(gtc.ureal(x[2], x[5], 100, label='Y V ' + str(x[0] / x[7] / fullscale)))
+                shuntv.append(gtc.ureal(x[0], x[3], self.df_readings,
+                                        label='shuntv ' + str(x[0] / x[7] / fullscale)))  # use current as label
+                xv.append(gtc.ureal(x[1], x[4], self.df_readings, label='X V ' + str(x[0] / x[7] / fullscale)))
+                yv.append(gtc.ureal(x[2], x[5], self.df_readings, label='Y V ' + str(x[0] / x[7] / fullscale)))
             elif settings == True:
                 gain.append(x[6])
                 reserve.append(x[7])
                 shunt.append(x[8])
                 comr.append(x[9])
-                shuntv.append(
-                    gtc.ureal(x[0], x[3], 100, label='shuntv ' + str(x[0] / x[8] / fullscale)))  # use current as label
-                xv.append(gtc.ureal(x[1], x[4], 100, label='X V ' + str(x[0] / x[8] / fullscale)))
-                yv.append(gtc.ureal(x[2], x[5], 100, label='Y V ' + str(x[0] / x[8] / fullscale)))
+                shuntv.append(gtc.ureal(x[0], x[3], self.df_readings,
+                                        label='shuntv ' + str(x[0] / x[8] / fullscale)))  # use current as label
+                xv.append(gtc.ureal(x[1], x[4], self.df_readings, label='X V ' + str(x[0] / x[8] / fullscale)))
+                yv.append(gtc.ureal(x[2], x[5], self.df_readings, label='Y V ' + str(x[0] / x[8] / fullscale)))
 
-        e, excite, nom_excite = self.ratioerror(shuntv, xv, yv, shunt, comr, targetexcitation, fullscale)
+        e, excite, nom_excite = self.ratioerror(shuntv, xv, yv, shunt, comr, targetexcitation, fullscale, tolerance,
+                                                step)
         return e, excite, nom_excite
 
     def signcheck(self, datablock, fullscale, settings):
@@ -303,13 +605,13 @@ class TWOSTAGE(object):
         :param settings: a boolean set to True if gain and reserve colunmns are available
         :return: either +1.0 or -1.0
         """
-        e, excite, nom_excite = self.ctcompare(datablock, fullscale, [10, 10, 10], settings)  # assumed check at 10%
-        if e[1].x.real - e[0].x.real > 0:
+        e, excite, nom_excite = self.ctcompare(datablock, fullscale, [10, 10, 10], settings, False)  # check at 10%
+        if e[1].real - e[0].real > 0:
             signreal = -1.0
         else:
             signreal = 1.0
 
-        if e[2].x.imag - e[0].x.imag > 0:
+        if e[2].imag - e[0].imag > 0:
             signimag = -1.0
         else:
             signimag = 1.0
@@ -350,9 +652,9 @@ class TWOSTAGE(object):
         comr = []  # common resistance duplicates of a fixed value
 
         for x in block2:
-            shuntv.append(gtc.ureal(x[1], x[4], 100, label='shuntv ' + repr(x[0])))
-            xv.append(gtc.ureal(x[2], x[5], 100, label='X V ' + repr(x[0])))
-            yv.append(gtc.ureal(x[3], x[6], 100, label='Y V ' + repr(x[0])))
+            shuntv.append(gtc.ureal(x[1], x[4], self.df_readings, label='shuntv ' + repr(x[0])))
+            xv.append(gtc.ureal(x[2], x[5], self.df_readings, label='X V ' + repr(x[0])))
+            yv.append(gtc.ureal(x[3], x[6], self.df_readings, label='Y V ' + repr(x[0])))
             ctratio.append(x[7])
             shunt.append(x[8])
             comr.append(x[9])
@@ -382,40 +684,14 @@ class TWOSTAGE(object):
         excitation levels are selected for interpolation to give the new errors at one_fifth excitation. Note that
         for Tc purposes these will be quoted as being the 1% to 125% errors at 1A.
 
+        Each error is interpolated between the neighbouring original points, or extrapolated from the lowest two,
+        with ExcitationInterpolator, which also gives other factors and modes.
+
         :param e_orig: array of errors at original excitation
-        :param exc_orig:
+        :param exc_orig: the original excitation levels
         :return: e_fifth, an array of errors at one fifth the original excitation
         """
-        ereal = []
-        eimag = []
-        for e in e_orig:
-            ereal.append(e.real)
-            eimag.append(e.imag)
-
-        exc_new = []
-        for exc in exc_orig:
-            exc_new.append(exc/5.0)  # excitation level one fifth of normal
-
-        e_fifth = []
-        e_fifth.append(self.interp(exc_orig[4], exc_orig[5], ereal[4], ereal[5], exc_new[0])
-                            +1j * self.interp(exc_orig[4], exc_orig[5], eimag[4], eimag[5], exc_new[0]))
-        e_fifth.append(self.interp(exc_orig[4], exc_orig[5], ereal[4], ereal[5], exc_new[1])
-                            +1j * self.interp(exc_orig[4], exc_orig[5], eimag[4], eimag[5], exc_new[1]))
-        e_fifth.append(self.interp(exc_orig[5], exc_orig[6], ereal[5], ereal[6], exc_new[2])
-                            +1j * self.interp(exc_orig[5], exc_orig[6], eimag[5], eimag[6], exc_new[2]))
-        e_fifth.append(self.interp(exc_orig[5], exc_orig[6], ereal[5], ereal[6], exc_new[3])
-                            +1j * self.interp(exc_orig[5], exc_orig[6], eimag[5], eimag[6], exc_new[3]))
-        e_fifth.append(self.interp(exc_orig[6], exc_orig[7], ereal[6], ereal[7], exc_new[4])
-                            +1j * self.interp(exc_orig[6], exc_orig[7], eimag[6], eimag[7], exc_new[4]))
-        e_fifth.append(self.interp(exc_orig[7], exc_orig[8], ereal[7], ereal[8], exc_new[5])
-                            +1j * self.interp(exc_orig[7], exc_orig[8], eimag[7], eimag[8], exc_new[5]))
-        e_fifth.append(self.interp(exc_orig[7], exc_orig[8], ereal[7], ereal[8], exc_new[6])
-                            +1j * self.interp(exc_orig[7], exc_orig[8], eimag[7], eimag[8], exc_new[6]))
-        e_fifth.append(self.interp(exc_orig[7], exc_orig[8], ereal[7], ereal[8], exc_new[7])
-                            +1j * self.interp(exc_orig[7], exc_orig[8], eimag[7], eimag[8], exc_new[7]))
-        e_fifth.append(self.interp(exc_orig[7], exc_orig[8], ereal[7], ereal[8], exc_new[8])
-                            +1j * self.interp(exc_orig[7], exc_orig[8], eimag[7], eimag[8], exc_new[8]))
-        return e_fifth
+        return ExcitationInterpolator(exc_orig, factor=5.0).interpolate(e_orig)
 
     def extra_ratios(self, xp1ap, xp2ap, xp3as, xp2bs, mag1a, mag1asp, mag2a, mag2asp, mag3a, mag2b, cap1a, cap1asp, cap2asp, cap2b):
         """
@@ -441,6 +717,9 @@ class TWOSTAGE(object):
         :return:  the five lists of error for each of the five transformer connections
         """
 
+        if isinstance(xp1ap, ErrorTable):
+            return self.extra_ratios_table(xp1ap, xp2ap, xp3as, xp2bs, mag1a, mag1asp, mag2a, mag2asp, mag3a, mag2b,
+                                           cap1a, cap1asp, cap2asp, cap2b)
         cap3a = 0
         p3ap = []
         for x in xp3as:
@@ -465,6 +744,69 @@ class TWOSTAGE(object):
 
         return p3ap, p2as, p2asp, p1asp, p2bp
 
+    def extra_ratios_table(self, xp1ap, xp2ap, xp3as, xp2bs, mag1a, mag1asp, mag2a, mag2asp, mag3a, mag2b, cap1a,
+                           cap1asp, cap2asp, cap2b):
+        """
+        extra_ratios for errors held as ErrorTable, each ratio being one array operation. The tables may hold
+        several frequencies stacked by errortable.stack, with corrections given as lists of one for each frequency.
+
+        :return:  the five ErrorTable of error for each of the five transformer connections
+        """
+        v = lambda correction: self.frequency_terms(correction, len(xp1ap))
+        cap3a = 0
+        cap2a = 0
+        p3ap = xp3as + v(mag3a) + cap3a
+        p2as = xp2ap - v(mag2a) - cap2a
+        p2asp = xp2ap + v(mag2asp) - v(mag2a) + v(cap2asp) - cap2a
+        p1asp = xp1ap + v(mag1asp) - v(mag1a) + v(cap1asp) - v(cap1a)
+        p2bp = xp2bs + v(mag2b) + v(cap2b)
+        return p3ap, p2as, p2asp, p1asp, p2bp
+
+    def frequency_terms(self, correction, points):
+        """
+        :param correction: a correction as a number or uncertain number, or a list of them with one per frequency
+        :param points: number of points of the stacked ErrorTable the correction is added to
+        :return: the correction, or an object array of the correction at each point when there is one for each
+         frequency
+        """
+        if isinstance(correction, (list, tuple)):
+            terms = np.empty(len(correction), dtype=object)
+            terms[:] = correction
+            return np.repeat(terms, points // len(correction))
+        return correction
+
+    def frequency_values(self, correction):
+        """
+        :param correction: a correction as a number or uncertain number, a list of them with one per frequency, or
+         an array that already broadcasts over the errors
+        :return: its value as a complex, or a (frequency, 1) complex array that broadcasts over excitation
+        """
+        if isinstance(correction, np.ndarray):
+            return correction
+        if isinstance(correction, (list, tuple)):
+            return np.array([gtc.value(c) for c in correction], dtype=complex)[:, np.newaxis]
+        return complex(gtc.value(correction))
+
+    def extra_ratios_array(self, xp1ap, xp2ap, xp3as, xp2bs, mag1a, mag1asp, mag2a, mag2asp, mag3a, mag2b, cap1a,
+                           cap1asp, cap2asp, cap2b):
+        """
+        Values only version of extra_ratios for any number of frequencies at once. The error arguments are complex
+        arrays of shape (frequency, excitation), as from buildup_array. The corrections are single values, used at
+        every frequency, or lists with one value per frequency. extra_ratios_table gives the uncertainties of
+        stacked frequencies.
+
+        :return:  the five arrays of error for each of the five transformer connections
+        """
+        v = self.frequency_values
+        cap3a = 0
+        cap2a = 0
+        p3ap = np.asarray(xp3as) + v(mag3a) + cap3a
+        p2as = np.asarray(xp2ap) - v(mag2a) - cap2a
+        p2asp = np.asarray(xp2ap) + v(mag2asp) - v(mag2a) + v(cap2asp) - cap2a
+        p1asp = np.asarray(xp1ap) + v(mag1asp) - v(mag1a) + v(cap1asp) - v(cap1a)
+        p2bp = np.asarray(xp2bs) + v(mag2b) + v(cap2b)
+        return p3ap, p2as, p2asp, p1asp, p2bp
+
     def buildup(self, excite, e1, e2, e3, e4, e5a, e5b, mag1a, mag2a, mag3a, mag1b, mag2b, capa, capb):
         """
         Assembles all the measurement results so that final ratio errors can be calculated.
@@ -487,64 +829,59 @@ class TWOSTAGE(object):
         """
 
         # TODO should the measured errors already be fully corrected, or should some corrections occur in this method?
+        if isinstance(e1, ErrorTable):
+            return self.buildup_table(excite, e1, e2, e3, e4, e5a, e5b, mag1a, mag2a, mag3a, mag1b, mag2b, capa, capb)
         #P1as, 5:5 in series
 
         polarity = 1  # SR830 readings normalised to be 'error' when Ta is the UUT
         p1as = []
         for x in e1:
             ans = x * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p1as')
-            ans = ans * gtc.ureal(1.0, self.brdn1a, self.df_brdn1a, label="burden1a")
-            ans = ans * gtc.ureal(1.0, self.brdn2a, self.df_brdn2a, label="burden2a")
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p1as', 'p1as')
+            ans = ans * self.type_b('brdn1a', 1.0, 'burden1a', 'p1as')
+            ans = ans * self.type_b('brdn2a', 1.0, 'burden2a', 'p1as')
             p1as.append(ans)  # as measured, modified by polarity
 
         p1ap = []
         for x in p1as:
             ans = x + mag1a + capa
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p1ap')
-            ans = ans * gtc.ureal(1.0, self.brdn1b, self.df_brdn1b, label = "burden1b")
-            ans = ans * gtc.ureal(1.0, self.brdn2b, self.df_brdn2b, label="burden2b")
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p1ap', 'p1ap')
+            ans = ans * self.type_b('brdn1b', 1.0, 'burden1b', 'p1ap')
+            ans = ans * self.type_b('brdn2b', 1.0, 'burden2b', 'p1ap')
             p1ap.append(ans)
 
         polarity = -1 # as Tb is being calibrated
         p1bs = []
         for i in range(len(p1ap)):
             ans = p1ap[i] + e2[i] * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p1bs')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p1bs', 'p1bs')
             p1bs.append(ans)
 
         p1bp = []
         for i in range(len(p1bs)):
             ans = p1bs[i] + capb + mag1b
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p1bp')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p1bp', 'p1bp')
             p1bp.append(ans)
 
         polarity = 1  # as Ta is being calibrated
         p2ap = []
         for i in range(len(p1bp)):
             ans = p1bp[i] + e3[i] * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p2ap')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p2ap', 'p2ap')
             p2ap.append(ans)
 
         polarity = -1  # as Tb is being calibrated
         p2bs = []
         for i in range(len(p2ap)):
             ans = p2ap[i] + e4[i] * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p2bs')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p2bs', 'p2bs')
             p2bs.append(ans)
 
         polarity = 1  # as Ta is being calibrated
         p3as_a = []
         for i in range(len(p2bs)):
             ans = p2bs[i] + e5a[i] * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p3as_a')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p3as_a', 'p3as_a')
             p3as_a.append(ans)
 
 
@@ -552,12 +889,89 @@ class TWOSTAGE(object):
         p3as_b = []
         for i in range(len(p1bp)):
             ans = p1bp[i] + e5b[i] * polarity
-            ans = ans + gtc.ucomplex(0 + 0j,(self.ct_x_stability, self.ct_y_stability),self.df_ct_x_stability,
-                                     label = 'ct_stability_p3as_b')
+            ans = ans + self.type_b('ct_stability', 0j, 'ct_stability_p3as_b', 'p3as_b')
             p3as_b.append(ans)
 
         return p1as, p1ap, p2ap, p3as_a, p3as_b, p1bs, p1bp, p2bs
 
+    def buildup_table(self, excite, e1, e2, e3, e4, e5a, e5b, mag1a, mag2a, mag3a, mag1b, mag2b, capa, capb):
+        """
+        buildup for measured errors held as ErrorTable, e.g. from ctcompare_table. The same stability and burden
+        influences are added as in buildup, following type_b_policy, but each ratio is a few array operations.
+
+        The errors may hold several frequencies, stacked by errortable.stack from the tables that BUILDUP.step
+        returns with table=True, so that every frequency is calculated at once with its uncertainty. The
+        corrections are then single values, used at every frequency, or lists with one for each frequency. The
+        Type B terms are made as a buildup of each frequency in turn with the same TWOSTAGE would make them, and
+        ErrorTable.split gives back the table of each frequency.
+
+        :return: ErrorTable of errors for p1as, p1ap, p2ap, p3as, p1bs, p1bp, p2bs
+        """
+        def stability(table, step):
+            label = 'ct_stability_' + step
+            keys = self.type_b_keys('ct_stability', 0j, [label] * len(table), step)
+            return table.with_offsets((self.ct_x_stability, self.ct_y_stability), self.df_ct_x_stability, label, keys)
+
+        def burden(table, name, label, step):
+            keys = self.type_b_keys(name, 1.0, [label] * len(table), step)
+            return table.with_factor(getattr(self, name), getattr(self, 'df_' + name), label, keys)
+
+        v = lambda correction: self.frequency_terms(correction, len(e1))
+        polarity = 1  # SR830 readings normalised to be 'error' when Ta is the UUT
+        p1as = stability(e1 * polarity, 'p1as')
+        p1as = burden(p1as, 'brdn1a', 'burden1a', 'p1as')
+        p1as = burden(p1as, 'brdn2a', 'burden2a', 'p1as')
+
+        p1ap = stability(p1as + v(mag1a) + v(capa), 'p1ap')
+        p1ap = burden(p1ap, 'brdn1b', 'burden1b', 'p1ap')
+        p1ap = burden(p1ap, 'brdn2b', 'burden2b', 'p1ap')
+
+        polarity = -1  # as Tb is being calibrated
+        p1bs = stability(p1ap + e2 * polarity, 'p1bs')
+        p1bp = stability(p1bs + v(capb) + v(mag1b), 'p1bp')
+
+        polarity = 1  # as Ta is being calibrated
+        p2ap = stability(p1bp + e3 * polarity, 'p2ap')
+        polarity = -1  # as Tb is being calibrated
+        p2bs = stability(p2ap + e4 * polarity, 'p2bs')
+        polarity = 1  # as Ta is being calibrated
+        p3as_a = stability(p2bs + e5a * polarity, 'p3as_a')
+        p3as_b = stability(p1bp + e5b * polarity, 'p3as_b')
+
+        return p1as, p1ap, p2ap, p3as_a, p3as_b, p1bs, p1bp, p2bs
+
+    def buildup_array(self, excite, e1, e2, e3, e4, e5a, e5b, mag1a, mag2a, mag3a, mag1b, mag2b, capa, capb,
+                      stability=None, burden=None):
+        """
+        Values only version of buildup for any number of frequencies at once. The measured errors are complex arrays
+        of shape (frequency, excitation), e.g. np.array(e) for the e returned by BUILDUP.step with uncertain=False.
+        The corrections are single values, used at every frequency, lists with one value per frequency or arrays
+        that broadcast with the errors. The stability and burden terms that buildup adds have zero value and unit
+        gain, so are left out unless values for them are given, e.g. Monte Carlo trials. For the uncertainties of
+        several frequencies at once, stack their tables into buildup_table.
+
+        :param stability: optional dictionary of the stability offset of each ratio, keyed on 'p1as', 'p1ap' ...
+        :param burden: optional dictionary of the burden factors keyed on 'burden1a', 'burden2a', 'burden1b' and
+         'burden2b'
+        :return: arrays of errors for p1as, p1ap, p2ap, p3as_a, p3as_b, p1bs, p1bp, p2bs
+        """
+        v = self.frequency_values
+        if stability is None:
+            stability = {}
+        if burden is None:
+            burden = {}
+        s = lambda step: stability.get(step, 0)
+        b = lambda label: burden.get(label, 1)
+        p1as = (np.asarray(e1) * 1 + s('p1as')) * b('burden1a') * b('burden2a')  # as measured, Ta polarity
+        p1ap = (p1as + v(mag1a) + v(capa) + s('p1ap')) * b('burden1b') * b('burden2b')
+        p1bs = p1ap + np.asarray(e2) * -1 + s('p1bs')  # as Tb is being calibrated
+        p1bp = p1bs + v(capb) + v(mag1b) + s('p1bp')
+        p2ap = p1bp + np.asarray(e3) * 1 + s('p2ap')
+        p2bs = p2ap + np.asarray(e4) * -1 + s('p2bs')
+        p3as_a = p2bs + np.asarray(e5a) * 1 + s('p3as_a')
+        p3as_b = p1bp + np.asarray(e5b) * 1 + s('p3as_b')
+        return p1as, p1ap, p2ap, p3as_a, p3as_b, p1bs, p1bp, p2bs
+
 
 if __name__ == "__main__":
     # TODO check for and record agreement/disagreement with old Excel calculations